@@ -1,6 +1,6 @@
 import React, { useEffect, useState, Suspense, lazy } from 'react';
-import { Song, Snippet, Club100Job, TrackItem, Effect } from './types';
-import { generateTrack, youtubeSearch, getEffects } from './api';
+import { Song, Snippet, Club100Job, JobStatus, TrackItem, Effect } from './types';
+import { generateTrack, getStreamUrl, youtubeSearch, getEffects } from './api';
 import { GenerateButton } from './GenerateButton';
 import { SongSearch } from './SongSearch';
 import {
@@ -42,6 +42,7 @@ export const Club100Page: React.FC = () => {
     return '';
   });
   const [job, setJob] = useState<Club100Job | null>(null);
+  const [jobStatus, setJobStatus] = useState<JobStatus | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
@@ -71,19 +72,22 @@ export const Club100Page: React.FC = () => {
   const handleRemoveItem = (idx: number) => setTrackItems(prev => removeAt(prev, idx));
   const handleMoveItem = (from: number, to: number) => setTrackItems(prev => moveItem(prev, from, to));
 
-  const handleGenerate = async () => {
+  const handleGenerate = async (draft = false) => {
+    const previousJobId = job?.jobId;
     setLoading(true);
     setError(null);
     setJob(null);
+    setJobStatus(null);
     try {
       const autoEffect = effects.find(e => e.id === autoEffectId);
       const timeline = autoEffectId ? injectAutoEffect(trackItems, autoEffect) : trackItems;
-      const result = await generateTrack({ timeline });
-      setJob(result);
+      const result = await generateTrack({ timeline, previousJobId, draft }, setJobStatus);
+      setJob({ ...result, draft });
     } catch (e: unknown) {
       setError((e as Error).message || 'Failed to generate track');
     } finally {
       setLoading(false);
+      setJobStatus(null);
     }
   };
 
@@ -228,19 +232,39 @@ export const Club100Page: React.FC = () => {
           onClearTimeline={() => setTrackItems([])}
         />
       </Suspense>
-      <GenerateButton onClick={handleGenerate} loading={loading} />
+      <div style={{ display: 'flex', gap: 16 }}>
+        <GenerateButton onClick={() => handleGenerate(true)} loading={loading} label="Preview Draft" />
+        <GenerateButton onClick={() => handleGenerate()} loading={loading} />
+      </div>
       {loading && (
         <div style={{ marginTop: 16, textAlign: 'center' }}>
           <div style={{ display: 'inline-block', width: 40, height: 40, border: '4px solid #000', borderRadius: '50%', borderTop: '4px solid #baffc9', animation: 'spin 1s linear infinite' }} />
           <style>{`@keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }`}</style>
           <div style={{ fontWeight: 'bold', marginTop: 8 }}>Generating track...</div>
+          {jobStatus && (
+            <div style={{ marginTop: 4 }}>
+              {jobStatus.status === 'queued'
+                ? `Queued${jobStatus.queuePosition ? ` (${jobStatus.queuePosition} ahead)` : ''}`
+                : `${jobStatus.stage ?? 'starting'} ${jobStatus.progress.done}/${jobStatus.progress.total}`}
+            </div>
+          )}
+          {/* /stream plays each finished item while the rest of the mix renders. */}
+          {jobStatus?.status === 'running' && (
+            <audio controls src={getStreamUrl(jobStatus.jobId)} style={{ marginTop: 8 }} />
+          )}
         </div>
       )}
       {error && <div style={{ color: 'red', marginTop: 12 }}>{error}</div>}
       {job && (
         <div style={{ marginTop: 24, padding: 16, border: '2px solid black', borderRadius: 8, background: '#e6ffe6' }}>
           <div style={{ fontWeight: 'bold', marginBottom: 8 }}>Track Status: {job.status}</div>
-          {job.downloadUrl && (
+          {job.draft && (
+            <div>
+              <audio controls src={getStreamUrl(job.jobId)} />
+              <div style={{ marginTop: 4 }}>Draft preview. Generate Track keeps these song starts.</div>
+            </div>
+          )}
+          {job.downloadUrl && !job.draft && (
             <a href={job.downloadUrl} download style={{ fontSize: 18, color: '#007700', fontWeight: 'bold' }}>Download MP3</a>
           )}
         </div>
@@ -3,7 +3,8 @@ import React from 'react';
 export const GenerateButton: React.FC<{
   onClick: () => void;
   loading?: boolean;
-}> = ({ onClick, loading }) => (
+  label?: string;
+}> = ({ onClick, loading, label = 'Generate Track' }) => (
   <button
     onClick={onClick}
     disabled={loading}
@@ -20,6 +21,6 @@ export const GenerateButton: React.FC<{
       margin: '24px 0',
     }}
   >
-    {loading ? 'Generating...' : 'Generate Track'}
+    {loading ? 'Generating...' : label}
   </button>
 ); 
\ No newline at end of file
@@ -1,4 +1,4 @@
-import React, { useRef, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { TrackItem, Song, Snippet, Effect } from './types';
 import {
   DndContext,
@@ -14,9 +14,11 @@ import {
   verticalListSortingStrategy,
 } from '@dnd-kit/sortable';
 import { CSS } from '@dnd-kit/utilities';
-import { getEffectAudioUrl } from './api';
+import { getEffectAudioUrl, prefetchSongs } from './api';
 import { getYoutubeId, songNumberAt } from './timeline';
 
+const PREFETCH_DEBOUNCE_MS = 1500;
+
 type RecorderInstance = { stop: () => Promise<{ blob: Blob }>; start: () => void; init: (s: MediaStream) => Promise<void> };
 
 export const TrackTimeline: React.FC<{
@@ -42,6 +44,23 @@ export const TrackTimeline: React.FC<{
   const [audioContext, setAudioContext] = useState<AudioContext | null>(null);
   const audioRef = useRef<HTMLAudioElement>(null);
 
+  // Warm the backend caches as songs are added, so Generate finds them already downloaded.
+  // Songs are sent once (keyed by url + start) and batched over a short debounce.
+  const prefetchedRef = useRef<Set<string>>(new Set());
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      const fresh = items.flatMap(item => {
+        if (item.type !== 'song') return [];
+        const key = `${item.song.url}#${item.song.start ?? ''}`;
+        if (prefetchedRef.current.has(key)) return [];
+        prefetchedRef.current.add(key);
+        return [item.song];
+      });
+      void prefetchSongs(fresh);
+    }, PREFETCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [items]);
+
   // Recording logic
   const handleStartRecording = async () => {
     setNewSnippetAudio(null);
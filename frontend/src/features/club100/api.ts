@@ -1,25 +1,111 @@
-import { Club100Job, Song, TrackItem, Effect } from './types';
+import { Club100Job, JobStatus, Song, TrackItem, Effect } from './types';
 import { BACKEND_URL } from './config';
 
-export async function generateTrack(payload: { timeline: TrackItem[] }): Promise<Club100Job> {
+const JOB_POLL_INTERVAL_MS = 2000;
+
+/** Upload a snippet's audio once and get back the content handle the backend stores it under. */
+export async function uploadSnippet(audioUrl: string): Promise<string> {
+  const blob = await (await fetch(audioUrl)).blob();
+  const form = new FormData();
+  form.append('file', blob, 'snippet');
+  const res = await fetch(`${BACKEND_URL}/snippets`, { method: 'POST', body: form });
+  if (!res.ok) throw new Error('Failed to upload snippet');
+  const data = await res.json();
+  return data.snippetId;
+}
+
+/**
+ * Replace inline base64 snippets with `/snippets` handles so the generate request stays small.
+ * Identical clips (e.g. the same recorded "Cheers!") are uploaded only once.
+ */
+async function withSnippetHandles(timeline: TrackItem[]): Promise<TrackItem[]> {
+  const uploads = new Map<string, Promise<string>>();
+  return Promise.all(
+    timeline.map(async item => {
+      if (item.type !== 'snippet' || item.snippet.snippetId || !item.snippet.audioUrl) return item;
+      const audioUrl = item.snippet.audioUrl;
+      if (!uploads.has(audioUrl)) uploads.set(audioUrl, uploadSnippet(audioUrl));
+      const snippetId = await uploads.get(audioUrl)!;
+      return { ...item, snippet: { type: 'upload' as const, snippetId } };
+    }),
+  );
+}
+
+/**
+ * `previousJobId` names the last render of this timeline: songs that did not change keep the
+ * same random window, so the backend reuses their rendered segments instead of redoing them.
+ * `draft` asks for a quick low-quality preview with shortened songs; a full render that names
+ * the draft as `previousJobId` keeps its song starts and reuses its downloads.
+ */
+export type GeneratePayload = { timeline: TrackItem[]; previousJobId?: string; draft?: boolean };
+
+export async function startGeneration(payload: GeneratePayload): Promise<string> {
+  const timeline = await withSnippetHandles(payload.timeline);
   const res = await fetch(`${BACKEND_URL}/generate`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify(payload),
+    body: JSON.stringify({ ...payload, timeline }),
   });
+  if (res.status === 503) throw new Error('The server is busy, please try again in a moment');
   if (!res.ok) throw new Error('Failed to start generation');
   const data = await res.json();
-  return {
-    jobId: data.jobId,
-    status: 'done', // Python backend is synchronous for now
-    downloadUrl: `${BACKEND_URL}/download/${data.jobId}`,
-  };
+  return data.jobId;
+}
+
+export async function getJobStatus(jobId: string): Promise<JobStatus> {
+  const res = await fetch(`${BACKEND_URL}/jobs/${jobId}`);
+  if (!res.ok) throw new Error('Failed to fetch job status');
+  return res.json();
+}
+
+/**
+ * Queue a generation job and poll `/jobs/<id>` until it finishes.
+ * `onProgress` receives every intermediate status so the UI can show per-item progress.
+ */
+export async function generateTrack(
+  payload: GeneratePayload,
+  onProgress?: (status: JobStatus) => void,
+): Promise<Club100Job> {
+  const jobId = await startGeneration(payload);
+  for (;;) {
+    const status = await getJobStatus(jobId);
+    onProgress?.(status);
+    if (status.status === 'done') {
+      return { jobId, status: 'done', downloadUrl: getDownloadUrl(jobId) };
+    }
+    if (status.status === 'error') {
+      throw new Error(status.error || 'Track generation failed');
+    }
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+}
+
+/**
+ * Ask the backend to warm its caches for these songs ahead of Generate. Best effort: the
+ * backend does the work at low priority, and a failure here only means a slower render later.
+ */
+export async function prefetchSongs(songs: Song[]): Promise<void> {
+  if (songs.length === 0) return;
+  try {
+    await fetch(`${BACKEND_URL}/prefetch`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ timeline: songs.map(song => ({ type: 'song', song: { url: song.url, start: song.start } })) }),
+    });
+  } catch {
+    // Ignored: prefetching is an optimization.
+  }
 }
 
 export function getDownloadUrl(jobId: string): string {
   return `${BACKEND_URL}/download/${jobId}`;
 }
 
+/** URL that plays the mix while it is still rendering (and supports seeking once finished). */
+export function getStreamUrl(jobId: string): string {
+  return `${BACKEND_URL}/stream/${jobId}`;
+}
+
 // --- YouTube Search ---
 /**
  * Search YouTube for songs via the Next.js `/api/youtube-search` route, which
@@ -8,15 +8,39 @@ export type Song = {
 };
 
 // Snippets are user-supplied audio (recorded or uploaded). TTS has been removed.
+// `snippetId` is the backend handle returned by `/snippets`; it replaces inlining `audioUrl`.
 export type Snippet = {
   type: 'upload';
   audioUrl?: string;
+  snippetId?: string;
 };
 
 export type Club100Job = {
   jobId: string;
   status: 'processing' | 'done' | 'error';
   downloadUrl?: string;
+  draft?: boolean;
+};
+
+// Backend job record returned by `/jobs/<id>` while a track is being rendered.
+export type JobStatus = {
+  jobId: string;
+  status: 'queued' | 'running' | 'done' | 'error';
+  stage: 'downloading' | 'processing' | 'concatenating' | null;
+  progress: { done: number; total: number };
+  queuePosition?: number | null;
+  error?: string | null;
+  // Set once the job finishes: where its time went, per stage and per timeline item.
+  timings?: {
+    queueWaitSeconds: number;
+    renderSeconds: number;
+    stages: Record<string, { count: number; seconds: number }>;
+    items: Array<{ item: number } & Record<string, number>>;
+    subprocesses?: number;
+    cacheHits?: number;
+    cacheMisses?: number;
+    downloadBytes?: number;
+  } | null;
 };
 
 export type Effect = {
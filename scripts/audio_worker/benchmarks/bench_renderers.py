@@ -0,0 +1,81 @@
+"""Compare the render modes on a synthetic timeline (no network; needs ffmpeg on PATH).
+
+Usage: python benchmarks/bench_renderers.py [--items 100] [--modes segments,single_pass,pcm]
+
+Songs are served from locally generated tone files instead of YouTube, so only the
+trim/normalize/mix/encode work is measured. Prints one JSON object per mode.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+from harness import point_caches_at, write_tone  # noqa: E402
+
+
+def synthetic_timeline(items: int):
+    """Songs with an effect after every third one, like a typical Club 100 timeline."""
+    timeline = []
+    for n in range(items):
+        if n % 4 == 3:
+            effect = main.EFFECTS[n % len(main.EFFECTS)]
+            timeline.append({'type': 'effect', 'effect': {'id': effect['id']}})
+        else:
+            video_id = f"bench{n:06d}"
+            timeline.append({'type': 'song', 'song': {'url': f'https://youtu.be/{video_id}', 'start': 30}})
+    return timeline
+
+
+def run_mode(mode: str, timeline) -> dict:
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    output = main.process_audio({'timeline': timeline, 'renderMode': mode})
+    wall = time.perf_counter() - started
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(getattr(after, f) - getattr(before, f)
+              for after, before in ((after_self, before_self), (after_children, before_children))
+              for f in ('ru_utime', 'ru_stime'))
+    size = os.path.getsize(output)
+    os.unlink(output)
+    return {'mode': mode, 'items': len(timeline), 'wallSeconds': round(wall, 3),
+            'cpuSeconds': round(cpu, 3), 'outputBytes': size}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--modes', default=','.join(main.RENDER_MODES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='club100_bench_') as tmp:
+        tmp = Path(tmp)
+        timeline = synthetic_timeline(args.items)
+        sources = {}
+        for n, item in enumerate(timeline):
+            if item['type'] == 'song':
+                path = tmp / f"song_{n:04d}.wav"
+                write_tone(path, 120, 220 + n)
+                sources[item['song']['url']] = path
+        # Cold caches in a scratch dir, so every run does the full encode work.
+        point_caches_at(main, tmp / 'cache')
+        # Serve songs from the tone files: no yt-dlp, no network.
+        main.prefetch_metadata = lambda urls: {}
+        main.get_youtube_duration = lambda url: 120
+        main.ensure_source_window = lambda url, start, duration=main.SONG_SECONDS: (sources[url], start)
+        main.is_valid_youtube_url = lambda url: url in sources
+        main.extract_youtube_id = lambda url: url.rsplit('/', 1)[-1]
+        for mode in args.modes.split(','):
+            print(json.dumps(run_mode(mode, timeline)))
+
+
+if __name__ == '__main__':
+    main_cli()
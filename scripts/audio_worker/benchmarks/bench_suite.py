@@ -0,0 +1,163 @@
+"""Offline end-to-end benchmark: synthetic timelines through the real pipeline, cold and warm.
+
+Usage: python benchmarks/bench_suite.py [--sizes 10,100,500] [--modes segments,single_pass,pcm]
+                                        [--output results.json]
+
+Nothing touches the network: benchmarks/fake_ytdlp/yt-dlp is put first on PATH and serves
+generated tones for every probe, download and search, so yt-dlp process overhead is still
+measured. Timelines mix songs, uploaded (base64) snippets and library effects. Each size and
+render mode is run twice in fresh worker processes sharing one scratch cache: "cold" starts
+from an empty cache, "warm" repeats the same timeline against what the cold run left behind.
+Needs ffmpeg on PATH. Results are printed (and with --output written) as one JSON document.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+FAKE_YTDLP_DIR = HERE / 'fake_ytdlp'
+# Fraction of timeline items that are uploaded snippets and effects; the rest are songs.
+SNIPPET_SHARE = 0.15
+EFFECT_SHARE = 0.15
+# Distinct snippet clips; a timeline reuses them, like a party's recurring shout-outs.
+SNIPPET_CLIPS = 4
+
+
+def synthetic_timeline(items: int, effects: list, snippets: list, seed: int = 100) -> list:
+    """A deterministic mix of songs (fixed starts), snippets and effects."""
+    rng = random.Random(seed + items)
+    timeline = []
+    for n in range(items):
+        roll = rng.random()
+        if roll < SNIPPET_SHARE:
+            timeline.append({'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': rng.choice(snippets)}})
+        elif roll < SNIPPET_SHARE + EFFECT_SHARE:
+            timeline.append({'type': 'effect', 'effect': {'id': rng.choice(effects)['id']}})
+        else:
+            # Fixed starts keep the warm run on the same windows as the cold one.
+            timeline.append({'type': 'song', 'song': {'url': f'https://youtu.be/bench{n:06d}',
+                                                      'start': rng.randint(0, 60)}})
+    return timeline
+
+
+def snippet_data_urls(scratch: Path) -> list:
+    from harness import write_tone
+    urls = []
+    for n in range(SNIPPET_CLIPS):
+        path = scratch / f'snippet_{n}.wav'
+        write_tone(path, 3, 330 + 110 * n, rate=22050, channels=1)
+        urls.append('data:audio/wav;base64,' + base64.b64encode(path.read_bytes()).decode('ascii'))
+        path.unlink()
+    return urls
+
+
+def run_child(args) -> dict:
+    """Render one timeline in this process and measure it (run via --child by the parent)."""
+    import main
+    import tracing
+    from harness import dir_bytes, point_caches_at
+
+    root = Path(args.root)
+    point_caches_at(main, root / 'cache')
+    timeline = synthetic_timeline(args.items, main.EFFECTS, snippet_data_urls(root))
+    bytes_before = dir_bytes(root / 'cache')
+    before = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    started = time.perf_counter()
+    with tracing.job_trace() as trace:
+        output = main.process_audio({'timeline': timeline, 'renderMode': args.mode})
+    wall = time.perf_counter() - started
+    after = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    main.CACHE.flush()
+
+    def delta(field):
+        return sum(getattr(a, field) - getattr(b, field) for a, b in zip(after, before))
+
+    by_tool = {}
+    for span in trace.spans:
+        if span['tool']:
+            by_tool[span['tool']] = by_tool.get(span['tool'], 0) + 1
+    summary = trace.summary()
+    return {
+        'items': args.items, 'mode': args.mode, 'cache': args.phase,
+        'wallSeconds': round(wall, 3),
+        'cpuSeconds': round(delta('ru_utime') + delta('ru_stime'), 3),
+        # ru_maxrss is in KiB on Linux; children is the largest single ffmpeg/yt-dlp process.
+        'peakRssBytes': after[0].ru_maxrss * 1024,
+        'peakChildRssBytes': after[1].ru_maxrss * 1024,
+        'subprocesses': sum(by_tool.values()),
+        'subprocessesByTool': by_tool,
+        # Block-layer writes charged to this process and its children (512-byte units).
+        'diskBytesWritten': delta('ru_oublock') * 512,
+        'diskBytesAdded': dir_bytes(root / 'cache') - bytes_before,
+        'outputBytes': os.path.getsize(output),
+        'cacheHits': summary.get('cacheHits', 0),
+        'cacheMisses': summary.get('cacheMisses', 0),
+        'stages': summary['stages'],
+    }
+
+
+def run_scenario(items: int, mode: str, phase: str, root: Path) -> dict:
+    env = dict(os.environ, YTDLP_ENGINE='subprocess',
+               PATH=os.pathsep.join([str(FAKE_YTDLP_DIR), os.environ.get('PATH', '')]))
+    cmd = [sys.executable, __file__, '--child', '--items', str(items), '--mode', mode,
+           '--phase', phase, '--root', str(root)]
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        return {'items': items, 'mode': mode, 'cache': phase, 'error': f'exit status {result.returncode}'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def machine_info() -> dict:
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n', 1)[0]
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'ffmpeg': ffmpeg}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,500')
+    parser.add_argument('--modes', default='segments,single_pass,pcm')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--items', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--phase', help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+    if shutil.which('ffmpeg') is None:
+        sys.exit('ffmpeg not found on PATH; the benchmark renders real audio.')
+
+    results = []
+    for items in (int(s) for s in args.sizes.split(',')):
+        for mode in args.modes.split(','):
+            with tempfile.TemporaryDirectory(prefix='club100_suite_') as root:
+                for phase in ('cold', 'warm'):
+                    result = run_scenario(items, mode, phase, Path(root))
+                    print(f"{items:>4} items  {mode:<12} {phase:<5} "
+                          f"{result.get('wallSeconds', '-')}s", file=sys.stderr)
+                    results.append(result)
+    report = json.dumps({'machine': machine_info(), 'results': results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(report + '\n', encoding='utf-8')
+    print(report)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,45 @@
+"""Helpers shared by the benchmark scripts: scratch caches and generated audio."""
+import wave
+from pathlib import Path
+
+import numpy as np
+
+# main's on-disk locations that a benchmark redirects into its scratch directory.
+CACHE_LOCATIONS = ('CACHE_DIR', 'SEGMENT_CACHE_DIR', 'SECTION_CACHE_DIR', 'SNIPPET_CACHE_DIR',
+                   'EFFECT_CACHE_DIR', 'RENDER_MANIFEST_DIR', 'JOB_WORK_DIR', 'OUTPUT_DIR',
+                   'LEASE_DIR', 'HIGHLIGHT_DIR')
+# main's module-level stores, rebuilt over the redirected locations by point_caches_at().
+CACHE_STORES = ('CACHE', '_inflight', 'METADATA', 'LOUDNESS', 'HIGHLIGHTS')
+
+
+def point_caches_at(main, root: Path):
+    """Move every cache, work and output directory of `main` under root (reused if it exists).
+
+    The stores built from those locations at import are rebuilt too, so a "cold" run never
+    sees measurements or indexes left in the real cache by an earlier run.
+    """
+    for name in CACHE_LOCATIONS:
+        path = root / name.lower()
+        path.mkdir(parents=True, exist_ok=True)
+        setattr(main, name, path)
+    main.CACHE = main._build_cache_manager()
+    main._inflight = main._build_inflight()
+    main.METADATA = main.MetadataStore(root / 'metadata.json')
+    main.LOUDNESS = main.MetadataStore(root / 'loudness.json')
+    if main.highlights is not None:
+        main.HIGHLIGHTS = main.highlights.HighlightIndex(main.HIGHLIGHT_DIR)
+
+
+def write_tone(path: Path, seconds: float, freq: float, rate: int = 48000, channels: int = 2):
+    t = np.arange(int(seconds * rate)) / rate
+    samples = (0.3 * np.sin(2 * np.pi * freq * t) * 32767).astype(np.int16)
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.repeat(samples[:, None], channels, axis=1).tobytes())
+
+
+def dir_bytes(root: Path) -> int:
+    """Total size of the regular files under root."""
+    return sum(p.stat().st_size for p in Path(root).rglob('*') if p.is_file())
@@ -0,0 +1,258 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import tracing
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, the index is last-writer-wins there.
+    fcntl = None
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+class CacheManager:
+    """Tracks every cached file in a persistent index and evicts to per-area budgets.
+
+    Callers report stores with `record()` and look entries up with `lookup()`, which counts
+    hits and misses and remembers when (and how often) each file was used. Eviction never walks
+    the cache directories: `collect()` works from the index alone, dropping expired entries and
+    then the least recently (or, with "lfu", least frequently) used ones until every area fits
+    its byte budget. Files used in the last `grace_seconds` are never evicted, so a source a
+    running job is reading in place can't disappear under it. `start_janitor()` runs
+    `collect()` on a background thread, off the request path.
+
+    Several processes may share one index: `flush()` merges the entries other processes
+    persisted (keeping the latest use of each) instead of overwriting them, minus the ones
+    this process evicted or found gone.
+    """
+
+    def __init__(self, index_path: Path, policy: str = "lru", grace_seconds: float = 600):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown cache eviction policy: {policy!r}")
+        self._index_path = Path(index_path)
+        self._policy = policy
+        self._grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._areas: dict[str, dict] = {}
+        self._dirty = False
+        self._wake = threading.Event()
+        self._janitor = None
+        self._loaded = self._load()
+
+    def add_area(self, name: str, directory: Path, pattern: str = "*", max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        """Register a cache area: files matching `pattern` in `directory`, bounded by size and/or age."""
+        with self._lock:
+            self._areas[name] = {
+                "directory": Path(directory), "pattern": pattern,
+                "maxBytes": max_bytes, "maxAge": max_age,
+                "entries": self._loaded.get(name, {}), "bytes": 0, "dropped": set(),
+                "hits": 0, "misses": 0, "evictions": 0, "evictedBytes": 0,
+            }
+            area = self._areas[name]
+            area["bytes"] = sum(e["size"] for e in area["entries"].values())
+
+    def record(self, area_name: str, path: Path):
+        """Index a file that was just added (or rewritten) in an area."""
+        try:
+            size = Path(path).stat().st_size
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            area = self._areas[area_name]
+            entry = area["entries"].get(str(path))
+            if entry is not None:
+                area["bytes"] -= entry["size"]
+            area["entries"][str(path)] = {"size": size, "accessed": now, "hits": entry["hits"] if entry else 0}
+            area["dropped"].discard(str(path))
+            area["bytes"] += size
+            self._dirty = True
+            over_budget = area["maxBytes"] is not None and area["bytes"] > area["maxBytes"]
+        if over_budget:
+            self._wake.set()
+
+    def lookup(self, area_name: str, path: Path) -> Optional[Path]:
+        """Return path if the file is cached (counting a hit and marking it used), else None."""
+        path = Path(path)
+        exists = path.exists()
+        with self._lock:
+            area = self._areas[area_name]
+            entry = area["entries"].get(str(path))
+            if not exists:
+                tracing.count("cacheMisses")
+                area["misses"] += 1
+                if entry is not None:
+                    area["bytes"] -= entry["size"]
+                    del area["entries"][str(path)]
+                    area["dropped"].add(str(path))
+                    self._dirty = True
+                return None
+            tracing.count("cacheHits")
+            area["hits"] += 1
+            if entry is not None:
+                entry["accessed"] = time.time()
+                entry["hits"] += 1
+                self._dirty = True
+        if entry is None:
+            # Cached before the index knew about it (e.g. written by an older version).
+            self.record(area_name, path)
+        return path
+
+    def contains(self, area_name: str, path: Path) -> bool:
+        """Whether path is cached, without counting a hit or miss or marking it used."""
+        if area_name not in self._areas:
+            raise KeyError(area_name)
+        return Path(path).exists()
+
+    def collect(self) -> int:
+        """Evict expired and over-budget entries, then persist the index. Returns files removed."""
+        now = time.time()
+        victims = []
+        with self._lock:
+            for area in self._areas.values():
+                entries = area["entries"]
+                if area["maxAge"] is not None:
+                    for key, entry in list(entries.items()):
+                        if now - entry["accessed"] > area["maxAge"]:
+                            victims.append(self._drop_locked(area, key))
+                if area["maxBytes"] is not None and area["bytes"] > area["maxBytes"]:
+                    for key in sorted(entries, key=lambda k: self._rank(entries[k])):
+                        if area["bytes"] <= area["maxBytes"]:
+                            break
+                        if now - entries[key]["accessed"] < self._grace_seconds:
+                            continue
+                        victims.append(self._drop_locked(area, key))
+            if victims:
+                self._dirty = True
+        for path in victims:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not evict cached file {path}: {e}", file=sys.stderr)
+        self.flush()
+        return len(victims)
+
+    def reconcile(self):
+        """Bring the index in line with the disk: one directory walk, meant for janitor startup."""
+        with self._lock:
+            areas = list(self._areas.items())
+        for name, area in areas:
+            try:
+                found = {str(p): p.stat() for p in area["directory"].glob(area["pattern"]) if p.is_file()}
+            except OSError:
+                continue
+            with self._lock:
+                entries = area["entries"]
+                for key in [k for k in entries if k not in found]:
+                    area["bytes"] -= entries.pop(key)["size"]
+                    area["dropped"].add(key)
+                for key, st in found.items():
+                    if key not in entries:
+                        entries[key] = {"size": st.st_size, "accessed": st.st_mtime, "hits": 0}
+                        area["bytes"] += st.st_size
+                self._dirty = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: {"entries": len(a["entries"]), "bytes": a["bytes"], "maxBytes": a["maxBytes"],
+                           "hits": a["hits"], "misses": a["misses"], "evictions": a["evictions"],
+                           "evictedBytes": a["evictedBytes"]}
+                    for name, a in self._areas.items()}
+
+    def flush(self):
+        """Persist the index, merged with what other processes sharing it wrote (atomic replace)."""
+        with self._file_lock(), self._lock:
+            self._merge_locked(self._load())
+            if not self._dirty:
+                return
+            data = {name: a["entries"] for name, a in self._areas.items()}
+            self._index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._index_path.with_suffix(f".{uuid.uuid4().hex}.partial")
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self._index_path)
+            finally:
+                tmp.unlink(missing_ok=True)
+            self._dirty = False
+            for area in self._areas.values():
+                area["dropped"].clear()
+
+    def _merge_locked(self, disk: dict):
+        """Fold entries persisted by other processes into ours."""
+        for name, area in self._areas.items():
+            entries = area["entries"]
+            for key, theirs in disk.get(name, {}).items():
+                if key in area["dropped"]:
+                    continue
+                ours = entries.get(key)
+                if ours is None:
+                    entries[key] = dict(theirs)
+                    area["bytes"] += theirs["size"]
+                elif theirs["accessed"] > ours["accessed"]:
+                    ours["accessed"] = theirs["accessed"]
+                    ours["hits"] = max(ours["hits"], theirs["hits"])
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        self._index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._index_path.with_suffix(".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def start_janitor(self, interval: float) -> threading.Thread:
+        """Start the background thread that collects every `interval` seconds (or when over budget)."""
+        with self._lock:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,),
+                                                 name="club100-cache-janitor", daemon=True)
+                self._janitor.start()
+            return self._janitor
+
+    def _janitor_loop(self, interval: float):
+        self.reconcile()
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Cache janitor failed: {e}", file=sys.stderr)
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def _rank(self, entry: dict):
+        if self._policy == "lfu":
+            return (entry["hits"], entry["accessed"])
+        return entry["accessed"]
+
+    def _drop_locked(self, area: dict, key: str) -> str:
+        entry = area["entries"].pop(key)
+        area["bytes"] -= entry["size"]
+        area["dropped"].add(key)
+        area["evictions"] += 1
+        area["evictedBytes"] += entry["size"]
+        return key
+
+    def _load(self) -> dict:
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
@@ -0,0 +1,121 @@
+import os
+import random
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Analysis decodes mono at a low rate: loudness and onsets need no more, and it keeps the decode cheap.
+ANALYSIS_RATE = 11025
+# Samples per analysis frame; frames are summarized into one envelope row per second.
+FRAME_SAMPLES = 512
+# Seconds quieter than this count as silence (keeps -inf dB out of the scores).
+SILENCE_DB = -60.0
+# Weight of onset density (how much is going on) against loudness in a window's score.
+ONSET_WEIGHT = 0.5
+# Starts are drawn from this share of a video's best-scoring windows, so repeats still vary.
+TOP_FRACTION = 0.1
+
+
+def decode_mono(source: Path, dest: Path, timeout=None) -> np.ndarray:
+    """Decode source to mono float32 at ANALYSIS_RATE via a raw file at dest."""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(source), "-vn", "-ac", "1",
+           "-ar", str(ANALYSIS_RATE), "-f", "f32le", str(dest)]
+    subprocess.run(cmd, check=True, capture_output=True, timeout=timeout)
+    return np.fromfile(dest, dtype=np.float32)
+
+
+def envelope(samples: np.ndarray, rate: int = ANALYSIS_RATE) -> np.ndarray:
+    """Per-second (loudness dB, onset strength) rows of mono samples, shaped (seconds, 2) float32.
+
+    Onset strength is the mean rise in frame energy (attacks: drums, note starts), which tells
+    a busy chorus apart from a sustained pad at the same loudness.
+    """
+    n_frames = len(samples) // FRAME_SAMPLES
+    if n_frames == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    frames = samples[:n_frames * FRAME_SAMPLES].reshape(n_frames, FRAME_SAMPLES)
+    power = np.einsum("ij,ij->i", frames, frames, dtype=np.float64) / FRAME_SAMPLES
+    frame_db = 10 * np.log10(power + 1e-12)
+    onset = np.maximum(np.diff(frame_db, prepend=frame_db[0]), 0.0)
+    second = np.arange(n_frames) * FRAME_SAMPLES // rate
+    counts = np.bincount(second)
+    loudness_db = np.maximum(10 * np.log10(np.bincount(second, weights=power) / counts + 1e-12), SILENCE_DB)
+    return np.stack([loudness_db, np.bincount(second, weights=onset) / counts], axis=1).astype(np.float32)
+
+
+def window_scores(index: np.ndarray, window_seconds: int) -> np.ndarray:
+    """Score of the window starting at every whole second of an envelope (higher is livelier)."""
+    if len(index) <= window_seconds:
+        return np.zeros(1)
+    per_second = _standardize(index[:, 0]) + ONSET_WEIGHT * _standardize(index[:, 1])
+    sums = np.concatenate([[0.0], np.cumsum(per_second)])
+    return (sums[window_seconds:] - sums[:-window_seconds]) / window_seconds
+
+
+def choose_start(index: np.ndarray, duration: int, window_seconds: int, rng=random) -> int:
+    """A start (seconds) among the best-scoring windows that fit in duration, picked at random."""
+    scores = window_scores(index, window_seconds)[:max(1, int(duration) - window_seconds + 1)]
+    count = max(1, int(len(scores) * TOP_FRACTION))
+    best = np.argpartition(scores, -count)[-count:]
+    return int(best[rng.randrange(count)])
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    spread = float(values.std())
+    return (values - values.mean()) / (spread or 1.0)
+
+
+class HighlightIndex:
+    """Envelopes of analyzed videos: one small .npy per video id, recently used ones kept in memory."""
+
+    def __init__(self, directory: Path, memory_entries: int = 256):
+        self._directory = Path(directory)
+        self._memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._loaded: OrderedDict = OrderedDict()
+
+    def _path(self, video_id: str) -> Path:
+        return self._directory / f"{video_id}.npy"
+
+    def get(self, video_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            index = self._loaded.get(video_id)
+            if index is not None:
+                self._loaded.move_to_end(video_id)
+                return index
+        try:
+            index = np.load(self._path(video_id))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        self._remember(video_id, index)
+        return index
+
+    def put(self, video_id: str, index: np.ndarray):
+        """Persist a video's envelope (atomic replace)."""
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(video_id)
+        tmp = path.with_name(f"{video_id}.{uuid.uuid4().hex}.partial.npy")
+        try:
+            np.save(tmp, index)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self._remember(video_id, index)
+
+    def __contains__(self, video_id) -> bool:
+        with self._lock:
+            if video_id in self._loaded:
+                return True
+        return self._path(video_id).exists()
+
+    def _remember(self, video_id: str, index: np.ndarray):
+        with self._lock:
+            self._loaded[video_id] = index
+            self._loaded.move_to_end(video_id)
+            while len(self._loaded) > self._memory_entries:
+                self._loaded.popitem(last=False)
@@ -0,0 +1,226 @@
+import binascii
+import hashlib
+import re
+import uuid
+from pathlib import Path
+
+# Bytes read from a request body (or upload) per step.
+CHUNK_SIZE = 64 * 1024
+
+# Inline data URLs are replaced by this prefix plus the snippet id they were stored as.
+SNIPPET_MARKER = "club100-snippet:"
+
+_DATA_URL_HEAD = re.compile(rb'data:audio/[\w.+-]+(?:;[^,;"\\]*)*;base64,')
+_DATA_URL_PREFIX = b"data:audio/"
+# A string whose first HEAD_MAX bytes are not a data URL header is an ordinary string.
+HEAD_MAX = 256
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_WHITESPACE = re.compile(rb"\s+")
+
+
+class BodyTooLargeError(ValueError):
+    """The JSON left after streaming out inline audio is larger than allowed."""
+
+
+class Base64Decoder:
+    """Incremental base64 decoder: feed text in arbitrary pieces, get bytes out as it completes."""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._pending + _WHITESPACE.sub(b"", data)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b""
+
+    def finish(self) -> bytes:
+        if self._pending:
+            raise ValueError("Truncated base64 data")
+        return b""
+
+
+class HashingWriter:
+    """Streams bytes to a temporary file in `directory` while hashing them.
+
+    `commit()` hands the finished file and its sha256 to `on_commit(path, digest)` and returns
+    what that returns; `abort()` (or leaving a `with` block on an exception) removes the file.
+    """
+
+    def __init__(self, directory: Path, on_commit):
+        self._on_commit = on_commit
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.path = Path(directory) / f"{uuid.uuid4().hex}.upload.partial"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+
+    def write(self, data: bytes):
+        if data:
+            self._hash.update(data)
+            self._file.write(data)
+            self.size += len(data)
+
+    def commit(self):
+        self._file.close()
+        try:
+            return self._on_commit(self.path, self._hash.hexdigest())
+        finally:
+            self.path.unlink(missing_ok=True)
+
+    def abort(self):
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+def copy_stream(stream, writer: HashingWriter):
+    """Copy a file-like object into writer one CHUNK_SIZE read at a time."""
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        writer.write(chunk)
+
+
+class JsonSnippetExtractor:
+    """Scans a JSON body as it streams in, moving inline audio data URLs straight to disk.
+
+    Every string value that is a base64 `data:audio/...` URL is decoded chunk by chunk into a
+    writer from `open_writer()` and replaced in the retained text by SNIPPET_MARKER plus the
+    id `commit()` returned. Only the remaining JSON (at most `max_json_bytes`) is held in
+    memory, so a body's peak memory no longer grows with the size or number of its snippets.
+    """
+
+    def __init__(self, open_writer, max_json_bytes: int):
+        self._open_writer = open_writer
+        self._max_json_bytes = max_json_bytes
+        self._out = bytearray()
+        self._state = "out"
+        self._head = bytearray()
+        self._head_raw = bytearray()
+        self._writer = None
+        self._decoder = None
+
+    def feed(self, chunk: bytes):
+        try:
+            self._feed(chunk)
+        except BaseException:
+            self.abort()
+            raise
+
+    def finish(self) -> bytes:
+        """Return the JSON text with data URLs replaced; raises ValueError if it was cut short."""
+        if self._state != "out":
+            self.abort()
+            raise ValueError("Truncated JSON body")
+        return bytes(self._out)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+
+    def _emit(self, data):
+        self._out += data
+        if len(self._out) > self._max_json_bytes:
+            raise BodyTooLargeError(f"JSON body exceeds {self._max_json_bytes} bytes without its audio")
+
+    def _feed(self, chunk: bytes):
+        pos, end = 0, len(chunk)
+        while pos < end:
+            state = self._state
+            if state == "out":
+                quote = chunk.find(b'"', pos)
+                if quote < 0:
+                    self._emit(chunk[pos:])
+                    return
+                self._emit(chunk[pos:quote + 1])
+                pos = quote + 1
+                self._state, self._head, self._head_raw = "head", bytearray(), bytearray()
+            elif state in ("head", "head_esc"):
+                # Collect just enough of the string to tell whether it is a data URL. `_head`
+                # is the unescaped text, `_head_raw` the bytes to emit if it turns out not to be.
+                byte = chunk[pos]
+                if state == "head_esc":
+                    pos += 1
+                    self._head_raw.append(byte)
+                    if byte != ord("/"):
+                        self._emit(self._head_raw)
+                        self._state = "str"
+                        continue
+                    self._state = "head"
+                elif byte == ord('"'):
+                    self._emit(self._head_raw)
+                    self._state = "str"
+                    continue
+                else:
+                    pos += 1
+                    self._head_raw.append(byte)
+                    if byte == ord("\\"):
+                        self._state = "head_esc"
+                        continue
+                self._head.append(byte)
+                if byte == ord(",") and _DATA_URL_HEAD.fullmatch(self._head):
+                    self._writer, self._decoder = self._open_writer(), Base64Decoder()
+                    self._state = "data"
+                elif self._head[:len(_DATA_URL_PREFIX)] != _DATA_URL_PREFIX[:len(self._head)] \
+                        or len(self._head) >= HEAD_MAX:
+                    self._emit(self._head_raw)
+                    self._state = "str"
+            elif state in ("str", "data"):
+                match = _STRING_SPECIAL.search(chunk, pos)
+                stop = match.start() if match else end
+                if state == "str":
+                    self._emit(chunk[pos:stop + 1] if match else chunk[pos:])
+                elif stop > pos:
+                    self._writer.write(self._decoder.feed(chunk[pos:stop]))
+                if not match:
+                    return
+                pos = stop + 1
+                if chunk[stop] == ord("\\"):
+                    self._state = state + "_esc"
+                elif state == "str":
+                    self._state = "out"
+                else:
+                    self._writer.write(self._decoder.finish())
+                    snippet_id = self._writer.commit()
+                    self._writer = None
+                    self._emit(f'{SNIPPET_MARKER}{snippet_id}"'.encode("ascii"))
+                    self._state = "out"
+            elif state == "str_esc":
+                self._emit(chunk[pos:pos + 1])
+                pos += 1
+                self._state = "str"
+            else:  # data_esc: JSON may escape "/" and wrap base64 with "\n".
+                escaped = chunk[pos:pos + 1]
+                pos += 1
+                if escaped == b"/":
+                    self._writer.write(self._decoder.feed(b"/"))
+                elif escaped not in (b"n", b"r", b"t"):
+                    raise ValueError("Unexpected escape in base64 data")
+                self._state = "data"
+
+
+def read_json_with_snippets(stream, open_writer, max_json_bytes: int) -> bytes:
+    """Stream a JSON body through a JsonSnippetExtractor; returns the retained JSON text."""
+    extractor = JsonSnippetExtractor(open_writer, max_json_bytes)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        extractor.feed(chunk)
+    return extractor.finish()
+
+
+def snippet_id_from_marker(value):
+    """The snippet id a streamed data URL was stored as, or None if value is not a marker."""
+    if isinstance(value, str) and value.startswith(SNIPPET_MARKER):
+        return value[len(SNIPPET_MARKER):]
+    return None
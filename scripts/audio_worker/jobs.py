@@ -0,0 +1,236 @@
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+import concurrent.futures
+from typing import Optional
+
+import metrics
+import tracing
+
+# Number of timelines rendered concurrently. Rendering is CPU/ffmpeg bound, so this
+# scales with cores rather than with the number of HTTP threads.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Admission control: how many jobs may wait for a free worker before new ones are refused.
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "16"))
+# Finished job records are forgotten after this long (matches the output file retention).
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", str(60 * 60)))
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity and cannot admit another job."""
+
+
+class JobQueue:
+    """Bounded background queue that renders timelines on a fixed-size worker pool.
+
+    `render(data, job_id, progress)` does the actual work; `progress(stage, done, total)`
+    lets it report per-item progress, which is exposed through `get()`. `submit_batch()`
+    admits several jobs at once that share a preparation step; see `get_batch()`.
+    """
+
+    def __init__(self, render, workers: int = JOB_WORKERS, max_queued: int = MAX_QUEUED_JOBS,
+                 retention_seconds: int = JOB_RETENTION_SECONDS):
+        self._render = render
+        self._workers = max(1, workers)
+        self._max_queued = max(0, max_queued)
+        self._retention_seconds = retention_seconds
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="club100-job")
+        self._lock = threading.Lock()
+        self._jobs: dict[str, dict] = {}
+        self._batches: dict[str, dict] = {}
+
+    def submit(self, data: dict) -> str:
+        """Admit a job and return its id, or raise QueueFullError if the queue is full."""
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._admit_locked(1)
+            self._jobs[job_id] = self._new_job(job_id, data)
+        self._executor.submit(self._run, job_id, data)
+        return job_id
+
+    def submit_batch(self, datas: list, prepare=None) -> tuple:
+        """Admit several jobs at once (all or none); returns (batch_id, job_ids).
+
+        `prepare(datas)` runs once on its own thread before any of them renders and returns
+        (datas, plan): what each job actually renders, plus a dict reported with the batch.
+        It is where work the timelines share is done a single time. The jobs only reach the
+        worker pool once it has finished, so a planning batch holds no worker threads.
+        """
+        batch_id = str(uuid.uuid4())
+        job_ids = [str(uuid.uuid4()) for _ in datas]
+        with self._lock:
+            self._admit_locked(len(datas))
+            for job_id, data in zip(job_ids, datas):
+                self._jobs[job_id] = {**self._new_job(job_id, data), "batchId": batch_id, "stage": "planning"}
+            batch = self._batches[batch_id] = {
+                "batchId": batch_id, "jobIds": job_ids, "createdAt": time.time(), "plan": None,
+                "_prepared": concurrent.futures.Future(), "_runs": [],
+            }
+        threading.Thread(target=self._prepare, args=(batch, prepare, datas),
+                         name="club100-batch-plan", daemon=True).start()
+        return batch_id, job_ids
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        """Snapshot of a batch: its jobs, shared-work plan and an aggregate throughput report."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            jobs = [{**self._jobs[j], "progress": dict(self._jobs[j]["progress"])}
+                    for j in batch["jobIds"] if j in self._jobs]
+            public = {k: v for k, v in batch.items() if not k.startswith("_")}
+        return {**public, "jobs": jobs, "report": batch_report(batch["createdAt"], jobs)}
+
+    def wait_batch(self, batch_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Block until every job of the batch has finished; returns get_batch()."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # The jobs are only submitted (and _runs filled in) once planning is over.
+        concurrent.futures.wait([batch["_prepared"]], timeout=timeout)
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        concurrent.futures.wait(batch["_runs"], timeout=remaining)
+        return self.get_batch(batch_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a snapshot of a job record, or None if unknown/expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, "progress": dict(job["progress"])}
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Number of queued jobs ahead of this one (None if it is not queued)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                return None
+            return sum(1 for j in self._jobs.values()
+                       if j["status"] == "queued" and j["createdAt"] < job["createdAt"])
+
+    def _admit_locked(self, count: int):
+        self._prune_locked()
+        active = sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+        if active + count > self._workers + self._max_queued:
+            raise QueueFullError("Too many jobs in progress, try again later")
+
+    def _new_job(self, job_id: str, data: dict) -> dict:
+        return {
+            "jobId": job_id,
+            "batchId": None,
+            "status": "queued",
+            "stage": None,
+            "progress": {"done": 0, "total": len(data.get("timeline", []))},
+            "error": None,
+            "createdAt": time.time(),
+            "startedAt": None,
+            "finishedAt": None,
+            "timings": None,
+        }
+
+    def _prepare(self, batch: dict, prepare, datas: list):
+        try:
+            prepared, plan = prepare(datas) if prepare else (datas, {})
+        except Exception as e:
+            print(traceback.format_exc(), file=sys.stderr)
+            for job_id in batch["jobIds"]:
+                self._finish(job_id, time.time(), 0.0, "error", f"Batch planning failed: {e}", {})
+            batch["_prepared"].set_exception(e)
+            return
+        with self._lock:
+            batch["plan"] = plan
+        # Batch jobs render what the shared preparation step made of their timeline.
+        batch["_runs"] = [self._executor.submit(self._run, job_id, data)
+                          for job_id, data in zip(batch["jobIds"], prepared)]
+        batch["_prepared"].set_result(prepared)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _run(self, job_id: str, data: dict):
+        started = time.time()
+        with self._lock:
+            queue_wait = started - self._jobs[job_id]["createdAt"] if job_id in self._jobs else 0.0
+        metrics.QUEUE_WAIT_SECONDS.observe(queue_wait)
+        self._update(job_id, status="running", stage=None, startedAt=started)
+
+        def progress(stage, done, total):
+            self._update(job_id, stage=stage, progress={"done": done, "total": total})
+
+        status, error, summary = run_render(self._render, data, job_id, progress)
+        self._finish(job_id, started, queue_wait, status, error, summary)
+
+    def _finish(self, job_id: str, started: float, queue_wait: float, status: str, error, summary: dict):
+        self._update(job_id, **finished_fields(started, queue_wait, status, error, summary))
+
+    def _prune_locked(self):
+        cutoff = time.time() - self._retention_seconds
+        stale = [jid for jid, j in self._jobs.items()
+                 if j["finishedAt"] is not None and j["finishedAt"] < cutoff]
+        for jid in stale:
+            del self._jobs[jid]
+        for bid in [b for b, batch in self._batches.items() if not any(j in self._jobs for j in batch["jobIds"])]:
+            del self._batches[bid]
+
+
+def run_render(render, data: dict, job_id: str, progress) -> tuple:
+    """Render one job under a trace; returns (status, error, trace summary). Never raises."""
+    status, error = "done", None
+    with tracing.job_trace() as trace:
+        try:
+            output_path = render(data, job_id, progress)
+            if not output_path or not os.path.exists(output_path):
+                raise RuntimeError("Audio generation failed, no output file was produced.")
+        except Exception as e:
+            # Log the full traceback server-side, but only keep the message on the record.
+            print(traceback.format_exc(), file=sys.stderr)
+            status, error = "error", str(e)
+    return status, error, trace.summary()
+
+
+def finished_fields(started: float, queue_wait: float, status: str, error, summary: dict) -> dict:
+    """Record a finished job's metrics; returns the fields its job record is updated with."""
+    finished = time.time()
+    metrics.RENDER_SECONDS.observe(finished - started, status=status)
+    metrics.JOB_SUBPROCESSES.observe(summary.get("subprocesses", 0))
+    timings = {"queueWaitSeconds": round(queue_wait, 4), "renderSeconds": round(finished - started, 4),
+               **summary}
+    fields = {"status": status, "finishedAt": finished, "timings": timings}
+    if status == "done":
+        fields["stage"] = None
+    else:
+        fields["error"] = error
+    return fields
+
+
+def batch_report(created_at: float, jobs: list) -> dict:
+    """Aggregate throughput of a batch's jobs (finished ones only for the rates)."""
+    finished = [j for j in jobs if j["finishedAt"] is not None]
+    done = [j for j in finished if j["status"] == "done"]
+    items = sum(j["progress"]["total"] for j in done)
+    wall = max((j["finishedAt"] for j in finished), default=created_at) - created_at
+    timings = [j["timings"] or {} for j in finished]
+    return {
+        "timelines": len(jobs),
+        "done": len(done),
+        "failed": len(finished) - len(done),
+        "wallSeconds": round(wall, 4),
+        "renderSeconds": round(sum(t.get("renderSeconds", 0) for t in timings), 4),
+        "timelinesPerMinute": round(len(done) * 60 / wall, 3) if wall > 0 else None,
+        "itemsPerSecond": round(items / wall, 3) if wall > 0 else None,
+        "subprocesses": sum(t.get("subprocesses", 0) for t in timings),
+        "cacheHits": sum(t.get("cacheHits", 0) for t in timings),
+    }
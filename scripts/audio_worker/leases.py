@@ -0,0 +1,115 @@
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+
+class LeaseManager:
+    """Cross-process mutual exclusion on cache keys, through lease files in a shared directory.
+
+    A lease is a file created with O_EXCL, so exactly one process (on this host or any other
+    sharing the directory) holds it. The holder renews it every `ttl / 3` seconds while its
+    work runs; a lease not renewed for `ttl` seconds belonged to a process that died and is
+    broken by the next process that wants it. Waiters poll every `poll_interval` seconds.
+    """
+
+    def __init__(self, directory: Path, ttl: float = 60, poll_interval: float = 0.1):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._held: dict = {}
+        self._renewer = None
+        self.waits = 0
+        self.broken = 0
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        """Hold the lease on key for the duration of the block (waiting for any other holder)."""
+        path = self.directory / f"{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}.lease"
+        token = self._acquire(path, key)
+        try:
+            yield
+        finally:
+            self._release(path, token)
+
+    def _acquire(self, path: Path, key) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        token = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        waited = False
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                self._break_if_expired(path)
+                time.sleep(self.poll_interval)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"owner": token, "key": repr(key)}, f)
+            with self._lock:
+                self._held[path] = token
+                self._start_renewer_locked()
+            return token
+
+    def _release(self, path: Path, token: str):
+        with self._lock:
+            self._held.pop(path, None)
+        # Only remove it if it is still ours (it may have been broken after a long stall).
+        if self._read_owner(path) == token:
+            path.unlink(missing_ok=True)
+
+    def _break_if_expired(self, path: Path):
+        try:
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if age <= self.ttl:
+            return
+        # Rename first so that of several processes breaking it at once, exactly one wins.
+        stale = path.with_name(f"{path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return
+        try:
+            if time.time() - stale.stat().st_mtime <= self.ttl:
+                # Someone broke and re-took it between our stat and rename: give it back.
+                os.link(stale, path)
+            else:
+                self.broken += 1
+        except OSError:
+            pass
+        finally:
+            stale.unlink(missing_ok=True)
+
+    def _read_owner(self, path: Path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("owner")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _start_renewer_locked(self):
+        if self._renewer is None:
+            self._renewer = threading.Thread(target=self._renew_loop, name="club100-lease-renewer", daemon=True)
+            self._renewer.start()
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                held = list(self._held)
+            for path in held:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
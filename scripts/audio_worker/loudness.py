@@ -0,0 +1,66 @@
+import json
+import math
+import os
+import re
+import subprocess
+from typing import Optional
+
+_JSON_BLOCK = re.compile(r"\{[^{}]*\"input_i\"[^{}]*\}", re.DOTALL)
+
+
+def measure_command(source, start=None, duration=None) -> list:
+    """ffmpeg invocation that decodes (a window of) source through loudnorm's analysis pass only."""
+    cmd = ["ffmpeg", "-hide_banner", "-nostats"]
+    if start is not None:
+        cmd += ["-ss", str(start)]
+    if duration is not None:
+        cmd += ["-t", str(duration)]
+    cmd += ["-i", str(source), "-vn",
+            # The measured input values don't depend on loudnorm's targets, so the defaults do.
+            "-af", "loudnorm=print_format=json",
+            "-f", "null", os.devnull]
+    return cmd
+
+
+def parse_measurement(stderr: str) -> dict:
+    """Integrated loudness, true peak, range and threshold from loudnorm's JSON report."""
+    matches = _JSON_BLOCK.findall(stderr or "")
+    if not matches:
+        raise ValueError("ffmpeg printed no loudness measurement")
+    report = json.loads(matches[-1])
+    return {
+        "inputI": float(report["input_i"]),
+        "inputTP": float(report["input_tp"]),
+        "inputLRA": float(report["input_lra"]),
+        "inputThresh": float(report["input_thresh"]),
+    }
+
+
+def measure(source, start=None, duration=None, timeout=None) -> dict:
+    """Run the analysis pass on (a window of) source; see parse_measurement()."""
+    proc = subprocess.run(measure_command(source, start, duration), check=True, capture_output=True,
+                          text=True, timeout=timeout)
+    return parse_measurement(proc.stderr)
+
+
+def gain_db(measured: dict, target_i: float, target_tp: float) -> float:
+    """Constant gain that brings measured audio to target_i without pushing its peak past target_tp.
+
+    This is what loudnorm's linear mode applies given these measurements, so applying it
+    while encoding is a one-pass normalization. Silent audio (no integrated loudness) is left
+    as it is.
+    """
+    loudness, peak = measured.get("inputI"), measured.get("inputTP")
+    if loudness is None or not math.isfinite(loudness):
+        return 0.0
+    gain = target_i - loudness
+    if peak is not None and math.isfinite(peak):
+        gain = min(gain, target_tp - peak)
+    return round(gain, 2)
+
+
+def volume_filter(gain: Optional[float]) -> list:
+    """ffmpeg output args applying gain dB ([] for no change)."""
+    if not gain:
+        return []
+    return ["-af", f"volume={gain}dB"]
@@ -4,16 +4,36 @@ import os
 import re
 import shutil
 import subprocess
-import tempfile
 import threading
 import time
 from pathlib import Path
 import random
 import base64
+import hashlib
 import pathlib
 import concurrent.futures
+import functools
 import uuid
 
+from metadata import MetadataStore
+from scheduler import PRIORITY_LOW, get_scheduler
+from singleflight import SingleFlight
+from leases import LeaseManager
+from cache_manager import CacheManager
+from jobs import JobQueue
+from shared_queue import JOB_QUEUE_DB, QueueWorker, SharedJobQueue
+from ingest import HashingWriter
+from output_profiles import DRAFT_PROFILE, OUTPUT_EXTENSIONS, OutputProfile, audio_offset, get_profile
+import loudness
+import metrics
+import tracing
+from ytdlp_engine import make_engine, parse_probe_line  # noqa: F401 -- parse_probe_line re-exported
+
+try:
+    import highlights
+except ImportError:  # NumPy missing: song starts stay random.
+    highlights = None
+
 EFFECTS_DIR = pathlib.Path(__file__).parent / 'effects'
 EFFECTS = [
     {
@@ -215,39 +235,216 @@ EFFECTS = [
 ]
 EFFECTS_MAP = {e['id']: e for e in EFFECTS}
 
-CACHE_DIR = Path(__file__).parent / "cache"
-CACHE_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR = Path(__file__).parent / "output"
-OUTPUT_DIR.mkdir(exist_ok=True)
+# Point these at shared storage (e.g. an NFS mount) to let several servers and workers, on one
+# host or many, share one cache and serve each other's outputs.
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", Path(__file__).parent / "cache"))
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+OUTPUT_DIR = Path(os.environ.get("OUTPUT_DIR", Path(__file__).parent / "output"))
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Second cache tier: final normalized song segments, keyed by content (see segment_cache_key).
+SEGMENT_CACHE_DIR = CACHE_DIR / "segments"
+SEGMENT_CACHE_DIR.mkdir(exist_ok=True)
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Uploaded snippets, content-addressed by the sha256 of their bytes and stored normalized.
+SNIPPET_CACHE_DIR = CACHE_DIR / "snippets"
+SNIPPET_CACHE_DIR.mkdir(exist_ok=True)
+SNIPPET_CACHE_MAX_BYTES = int(os.environ.get("SNIPPET_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Effects pre-transcoded to the canonical format, plus a manifest recording what they were built from.
+EFFECT_CACHE_DIR = CACHE_DIR / "effects"
+EFFECT_CACHE_DIR.mkdir(exist_ok=True)
+# Guards manifest updates only; each effect is built under its own single-flight key.
+_effects_lock = threading.Lock()
+# Normalized effect file -> fingerprint it is known to be built from, so repeat uses skip the manifest.
+_effects_ready = {}
+
+# Section downloads: just the window a song needs, fetched instead of the full track.
+SECTION_CACHE_DIR = CACHE_DIR / "sections"
+SECTION_CACHE_DIR.mkdir(exist_ok=True)
+SECTION_CACHE_MAX_BYTES = int(os.environ.get("SECTION_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# "sections" fetches only the needed window unless a song is hot; "full" always caches whole tracks.
+DOWNLOAD_MODES = ("sections", "full")
+DOWNLOAD_MODE = os.environ.get("DOWNLOAD_MODE", "sections")
+# A video requested this many times is worth caching in full (it will be cut again and again).
+HOT_SONG_THRESHOLD = int(os.environ.get("HOT_SONG_THRESHOLD", "3"))
+# Energy/onset envelopes of fully cached videos (see highlights.py), built once per video in the
+# background. Songs without a start then begin in one of their liveliest windows, found with an
+# index lookup, instead of at a random offset. A few KB per video, so never evicted.
+HIGHLIGHT_INDEX = os.environ.get("HIGHLIGHT_INDEX", "1") not in ("0", "false", "no", "")
+HIGHLIGHT_DIR = CACHE_DIR / "highlights"
+HIGHLIGHTS = highlights.HighlightIndex(HIGHLIGHT_DIR) if highlights else None
+
+# Whole-track downloads (DOWNLOAD_MODE=full or hot songs) in CACHE_DIR, bounded like the other tiers.
+FULL_CACHE_MAX_BYTES = int(os.environ.get("FULL_CACHE_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Finished mixes are kept this long for /download and /stream (matches JOB_RETENTION_SECONDS).
+OUTPUT_RETENTION_SECONDS = int(os.environ.get("OUTPUT_RETENTION_SECONDS", str(60 * 60)))
+RENDER_MANIFEST_RETENTION_SECONDS = 24 * 60 * 60
+# Over-budget cache tiers evict the least recently ("lru") or least frequently ("lfu") used files
+# first; anything used in the last CACHE_EVICTION_GRACE_SECONDS is kept, since a running job may
+# be reading it in place. The janitor thread enforces budgets every CACHE_JANITOR_INTERVAL seconds.
+CACHE_EVICTION = os.environ.get("CACHE_EVICTION", "lru")
+CACHE_EVICTION_GRACE_SECONDS = int(os.environ.get("CACHE_EVICTION_GRACE_SECONDS", "600"))
+CACHE_JANITOR_INTERVAL = int(os.environ.get("CACHE_JANITOR_INTERVAL", "60"))
+
+# Per-job scratch dirs. They live under the cache so cached segments and snippets are hardlinked
+# into a job (same filesystem), never copied.
+JOB_WORK_DIR = CACHE_DIR / "jobs"
+
+# Per-job render manifests (item fingerprint -> resolved song start), so a regeneration that
+# names its previous job keeps the same windows and hits the segment/section caches.
+RENDER_MANIFEST_DIR = CACHE_DIR / "renders"
+RENDER_MANIFEST_DIR.mkdir(exist_ok=True)
+
+# Persistent video_id -> duration/title/format index, so cached songs never need a yt-dlp probe.
+METADATA = MetadataStore(CACHE_DIR / "index" / "metadata.json")
+# How many URLs a single batched yt-dlp probe resolves.
+METADATA_BATCH_SIZE = int(os.environ.get("METADATA_BATCH_SIZE", "50"))
+
+# Every song window, snippet and effect is loudness-normalized to LOUDNESS_TARGET_I LUFS
+# (true peak at most LOUDNESS_TARGET_TP dBTP). Each source is analyzed once; the measurements
+# are kept in LOUDNESS (keyed by video window, snippet hash or effect file), so every later
+# encode applies the gain in the same pass instead of analyzing the audio again.
+LOUDNESS_NORMALIZE = os.environ.get("LOUDNESS_NORMALIZE", "1") not in ("0", "false", "no", "")
+LOUDNESS_TARGET_I = float(os.environ.get("LOUDNESS_TARGET_I", "-16"))
+LOUDNESS_TARGET_TP = float(os.environ.get("LOUDNESS_TARGET_TP", "-1.5"))
+LOUDNESS = MetadataStore(CACHE_DIR / "index" / "loudness.json")
+
+# Length of every song window.
+SONG_SECONDS = 60
+# A draft preview (`"draft": true`) plays only the first this many seconds of each song's
+# window, encoded with output_profiles.DRAFT_PROFILE. The full window is still downloaded, so
+# the full render (with the draft as `previousJobId`) reuses the draft's starts and sources.
+DRAFT_SONG_SECONDS = int(os.environ.get("DRAFT_SONG_SECONDS", "15"))
+# Default output profile (see output_profiles.PROFILES): every timeline item is encoded to it
+# and so is the mix. Can be overridden per request with `outputProfile`.
+OUTPUT_PROFILE = os.environ.get("OUTPUT_PROFILE", "mp3")
+DEFAULT_PROFILE = get_profile(OUTPUT_PROFILE)
+# "copy" joins per-item files that already share the output profile with stream copy (no
+# second encode of the whole mix); "encode" always re-encodes the concatenation.
+CONCAT_MODES = ("copy", "encode")
+CONCAT_MODE = os.environ.get("CONCAT_MODE", "copy")
+
+# "segments" renders each item to its own normalized file and concatenates them (uses the
+# segment cache); "single_pass" trims, normalizes and concatenates in one ffmpeg filter graph;
+# "pcm" decodes items to float32 and mixes them with NumPy (crossfades, overlays), encoding once.
+RENDER_MODES = ("segments", "single_pass", "pcm")
+RENDER_MODE = os.environ.get("RENDER_MODE", "segments")
+# Default crossfade between consecutive items in the "pcm" renderer.
+PCM_CROSSFADE_SECONDS = float(os.environ.get("PCM_CROSSFADE_SECONDS", "0"))
 
 # Subprocess timeouts (seconds) so a hanging yt-dlp/ffmpeg can't tie up a worker forever.
 YTDLP_TIMEOUT = int(os.environ.get("YTDLP_TIMEOUT", "300"))
 FFMPEG_TIMEOUT = int(os.environ.get("FFMPEG_TIMEOUT", "180"))
 
-# Per-video locks so two timeline entries with the same URL don't race on the cache file.
-_cache_locks_guard = threading.Lock()
-_cache_locks: dict[str, threading.Lock] = {}
-
-def _get_cache_lock(key: str) -> threading.Lock:
-    with _cache_locks_guard:
-        lock = _cache_locks.get(key)
-        if lock is None:
-            lock = threading.Lock()
-            _cache_locks[key] = lock
-        return lock
-
-def cleanup_old_files(directory: Path, max_age_seconds: int):
-    """Delete files in a directory older than max_age_seconds to bound disk usage."""
-    now = time.time()
+# "subprocess" runs the yt-dlp CLI per call; "inprocess" keeps YoutubeDL loaded in YTDLP_WORKERS
+# long-lived processes. Both implement the same probe/download/search interface.
+YTDLP_ENGINE = os.environ.get("YTDLP_ENGINE", "subprocess")
+YTDLP_WORKERS = int(os.environ.get("YTDLP_WORKERS", "2"))
+YTDLP = make_engine(YTDLP_ENGINE, YTDLP_TIMEOUT, workers=YTDLP_WORKERS)
+
+# Lease files that serialize cache fills across processes sharing CACHE_DIR. A lease whose
+# holder stops renewing it (the process died) is broken after CACHE_LEASE_SECONDS.
+LEASE_DIR = CACHE_DIR / "leases"
+CACHE_LEASE_SECONDS = int(os.environ.get("CACHE_LEASE_SECONDS", "60"))
+
+def _build_inflight() -> SingleFlight:
+    """Fill coalescing for the current cache location (tests rebuild it for a temp dir)."""
+    return SingleFlight(LeaseManager(LEASE_DIR, CACHE_LEASE_SECONDS))
+
+# Concurrent requests for the same cache entry share one in-flight download/encode: threads of
+# this process wait on its future, other processes on its lease, then find the entry cached.
+_inflight = _build_inflight()
+
+def _ytdlp_tool():
+    """Tool name for tracing yt-dlp calls: only the CLI engine spawns a process per call."""
+    return "yt-dlp" if getattr(YTDLP, "name", None) == "subprocess" else None
+
+def _record_download(path: Path):
     try:
-        for f in directory.iterdir():
-            try:
-                if f.is_file() and now - f.stat().st_mtime > max_age_seconds:
-                    f.unlink(missing_ok=True)
-            except OSError:
-                pass
-    except FileNotFoundError:
-        pass
+        size = path.stat().st_size
+    except OSError:
+        return
+    metrics.DOWNLOAD_BYTES.observe(size)
+    tracing.count("downloadBytes", size)
+
+def _build_cache_manager() -> CacheManager:
+    """The cache manager for the current cache locations (tests rebuild it for a temp dir)."""
+    manager = CacheManager(CACHE_DIR / "index" / "cache.json", policy=CACHE_EVICTION,
+                           grace_seconds=CACHE_EVICTION_GRACE_SECONDS)
+    manager.add_area("full", CACHE_DIR, "*.full.m4a", max_bytes=FULL_CACHE_MAX_BYTES)
+    manager.add_area("sections", SECTION_CACHE_DIR, max_bytes=SECTION_CACHE_MAX_BYTES)
+    manager.add_area("segments", SEGMENT_CACHE_DIR, max_bytes=SEGMENT_CACHE_MAX_BYTES)
+    manager.add_area("snippets", SNIPPET_CACHE_DIR, max_bytes=SNIPPET_CACHE_MAX_BYTES)
+    manager.add_area("outputs", OUTPUT_DIR, "club100_*", max_age=OUTPUT_RETENTION_SECONDS)
+    manager.add_area("renders", RENDER_MANIFEST_DIR, "*.json", max_age=RENDER_MANIFEST_RETENTION_SECONDS)
+    return manager
+
+CACHE = _build_cache_manager()
+
+def segment_cache_key(video_id: str, start: int, duration: int = SONG_SECONDS, encode_args=None) -> str:
+    """Content key for a normalized song segment: same video, window and encode => same bytes."""
+    params = [video_id, int(start), int(duration), list(encode_args or encode_params(DEFAULT_PROFILE))]
+    return hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()
+
+def encode_params(profile: OutputProfile) -> list:
+    """Everything a per-item file's bytes depend on besides its source: codec args and loudness target."""
+    params = list(profile.codec_args)
+    if LOUDNESS_NORMALIZE:
+        params += ["loudness", LOUDNESS_TARGET_I, LOUDNESS_TARGET_TP]
+    return params
+
+def _item_suffix(profile: OutputProfile) -> str:
+    """Suffix of normalized snippet/effect files; loudness-normalized copies get their own name."""
+    if not LOUDNESS_NORMALIZE:
+        return profile.cache_suffix
+    tag = hashlib.sha256(json.dumps(encode_params(profile)).encode("utf-8")).hexdigest()[:8]
+    return f"{tag}.{profile.cache_suffix}"
+
+def song_loudness_key(video_id: str, start: int) -> str:
+    # Always the full window, so a draft and the full render share one measurement.
+    return f"song:{video_id}:{int(start)}:{SONG_SECONDS}"
+
+def effect_loudness_key(effect_path: Path) -> str:
+    st = effect_path.stat()
+    return f"effect:{effect_path.name}:{st.st_size}:{st.st_mtime_ns}"
+
+def loudness_gain(key: str, source, start=None, duration=None) -> float:
+    """Gain (dB) normalizing (a window of) source to the loudness target; 0 when normalization is off.
+
+    The source is analyzed only the first time its key is seen; concurrent first uses share
+    one analysis.
+    """
+    if not LOUDNESS_NORMALIZE:
+        return 0.0
+    measured = LOUDNESS.get(key)
+    if measured is None:
+        measured = _inflight.do(("loudness", key), _analyze_loudness, key, source, start, duration)
+    return loudness.gain_db(measured, LOUDNESS_TARGET_I, LOUDNESS_TARGET_TP)
+
+def _analyze_loudness(key: str, source, start, duration) -> dict:
+    measured = LOUDNESS.get(key)
+    if measured is None:
+        with tracing.span("analyze", tool="ffmpeg"):
+            measured = loudness.measure(source, start, duration, timeout=FFMPEG_TIMEOUT)
+        LOUDNESS.put(key, measured)
+    return measured
+
+def lookup_segment(key: str, profile: OutputProfile = None):
+    """Return the cached segment path for key (marking it recently used), or None on a miss."""
+    return CACHE.lookup("segments", SEGMENT_CACHE_DIR / f"{key}.{(profile or DEFAULT_PROFILE).extension}")
+
+def store_segment(src: Path, key: str, profile: OutputProfile = None):
+    """Atomically add a rendered segment to the cache (the janitor keeps it within budget)."""
+    path = SEGMENT_CACHE_DIR / f"{key}.{(profile or DEFAULT_PROFILE).extension}"
+    tmp = path.with_suffix(f".{uuid.uuid4().hex}.partial")
+    try:
+        # The job's file and the cache entry share one inode; eviction only drops the cache's name.
+        link_or_copy(src, tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    CACHE.record("segments", path)
 
 # --- Helper Functions ---
 def extract_youtube_id(url):
@@ -272,192 +469,1069 @@ def is_valid_youtube_url(url) -> bool:
     allowed = {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"}
     return host in allowed and extract_youtube_id(url) is not None
 
+def prefetch_metadata(urls) -> dict:
+    """Resolve metadata for every URL not yet in METADATA with batched yt-dlp invocations.
+
+    One process resolves up to METADATA_BATCH_SIZE URLs, instead of one process per song.
+    Returns {video_id: info} for the URLs that were probed.
+    """
+    pending = []
+    seen = set()
+    for url in urls:
+        if not is_valid_youtube_url(url):
+            continue
+        video_id = extract_youtube_id(url)
+        if video_id in seen or "duration" in (METADATA.get(video_id) or {}):
+            continue
+        seen.add(video_id)
+        pending.append(url)
+    infos = {}
+    for n in range(0, len(pending), METADATA_BATCH_SIZE):
+        with tracing.span("probe", tool=_ytdlp_tool()):
+            infos.update(YTDLP.probe(pending[n:n + METADATA_BATCH_SIZE]))
+    METADATA.put_many(infos)
+    return infos
+
 def get_youtube_duration(url):
-    """Get the duration of a YouTube video in seconds using yt-dlp."""
-    cmd = ["yt-dlp", "--get-duration", url]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=YTDLP_TIMEOUT)
-    duration_str = result.stdout.strip()
-    parts = duration_str.split(":")
-    if len(parts) == 3:
-        h, m, s = map(int, parts)
-        return h * 3600 + m * 60 + s
-    elif len(parts) == 2:
-        m, s = map(int, parts)
-        return m * 60 + s
-    else:
-        return int(parts[0])
+    """Get the duration of a YouTube video in seconds, from the metadata cache or yt-dlp."""
+    video_id = extract_youtube_id(url) if isinstance(url, str) else None
+    info = (METADATA.get(video_id) if video_id else None) or {}
+    if "duration" not in info and video_id:
+        prefetch_metadata([url])
+        info = METADATA.get(video_id) or {}
+    if "duration" not in info:
+        raise RuntimeError(f"Could not determine duration of {url!r}")
+    return info["duration"]
 
-def download_random_youtube_audio(url, out_path, start_override=None):
-    """Download a random 60s audio segment from a YouTube video, with caching."""
+def parse_song_start(value):
+    """A client-supplied song start in whole seconds, or None (random start) if absent or not a number."""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        print(f"Ignoring invalid song start {value!r}, using a random start", file=sys.stderr)
+        return None
+
+def choose_song_start(duration, start_override=None, video_id=None) -> int:
+    """Pick the start of a song's window: the clamped override, one of the video's most energetic
+    windows if it has a highlight index, or a random offset."""
+    if duration <= SONG_SECONDS:
+        return 0
+    if start_override is not None:
+        return max(0, min(duration - SONG_SECONDS, int(start_override)))
+    index = HIGHLIGHTS.get(video_id) if HIGHLIGHT_INDEX and HIGHLIGHTS and video_id else None
+    if index is not None:
+        return highlights.choose_start(index, duration, SONG_SECONDS)
+    return random.randint(0, duration - SONG_SECONDS)
+
+def _queue_highlight_index(video_id: str, source: Path):
+    """Build the video's highlight index in the background (low priority) if it has none yet.
+
+    Returns the analysis future, or None when nothing was queued.
+    """
+    if not HIGHLIGHT_INDEX or HIGHLIGHTS is None or video_id in HIGHLIGHTS:
+        return None
+    future = get_scheduler().submit("cpu", "highlights", _inflight.do, ("highlights", video_id),
+                                    _build_highlight_index, video_id, source, priority=PRIORITY_LOW)
+    future.add_done_callback(functools.partial(_log_highlight_failure, video_id))
+    return future
+
+def _build_highlight_index(video_id: str, source: Path):
+    if video_id in HIGHLIGHTS:
+        return
+    scratch = HIGHLIGHT_DIR / f"{video_id}.{uuid.uuid4().hex}.partial.f32"
+    HIGHLIGHT_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        with tracing.span("analyze", tool="ffmpeg"):
+            samples = highlights.decode_mono(source, scratch, timeout=FFMPEG_TIMEOUT)
+        HIGHLIGHTS.put(video_id, highlights.envelope(samples))
+    finally:
+        scratch.unlink(missing_ok=True)
+
+def _log_highlight_failure(video_id, future):
+    if future.exception() is not None:
+        print(f"Highlight analysis of {video_id} failed: {future.exception()}", file=sys.stderr)
+
+def ensure_cached_source(url) -> Path:
+    """Return the path of the cached full-length audio for a YouTube URL, downloading it if needed."""
     if not is_valid_youtube_url(url):
         raise ValueError(f"Refusing to download non-YouTube URL: {url!r}")
-    duration = get_youtube_duration(url)
-    if duration <= 60:
-        start = 0
-    else:
-        if start_override is not None:
-            start = max(0, min(duration - 60, int(start_override)))
-        else:
-            start = random.randint(0, duration - 60)
     video_id = extract_youtube_id(url)
-    cache_path = CACHE_DIR / f"{video_id}.full.m4a" if video_id else None
-    temp_audio = out_path.with_suffix('.full.m4a')
-    # Serialize downloads of the same video so concurrent entries don't corrupt the cache file.
-    lock = _get_cache_lock(video_id or url)
-    with lock:
-        if cache_path and cache_path.exists():
-            shutil.copy(cache_path, temp_audio)
-        else:
-            cmd_dl = ["yt-dlp", "-f", "bestaudio", "-o", str(temp_audio), url]
-            subprocess.run(cmd_dl, check=True, timeout=YTDLP_TIMEOUT)
-            if cache_path:
-                # Write to a temp file then atomically move into place.
-                cache_tmp = cache_path.with_suffix('.m4a.partial')
-                shutil.copy(temp_audio, cache_tmp)
-                os.replace(cache_tmp, cache_path)
-    cmd_trim = ["ffmpeg", "-y", "-ss", str(start), "-i", str(temp_audio), "-t", "60", "-acodec", "mp3", str(out_path)]
-    subprocess.run(cmd_trim, check=True, timeout=FFMPEG_TIMEOUT)
-    temp_audio.unlink(missing_ok=True)
+    cache_path = CACHE_DIR / f"{video_id}.full.m4a"
+    if not CACHE.lookup("full", cache_path):
+        _inflight.do(("full", video_id), _download_full, url, cache_path)
+    # Also covers videos cached in full before they had an index.
+    _queue_highlight_index(video_id, cache_path)
+    return cache_path
+
+def _download_full(url, cache_path: Path):
+    if cache_path.exists():
+        return
+    # Download to a temp file then atomically move into place.
+    cache_tmp = cache_path.with_suffix('.m4a.partial')
+    # The download reports the video's metadata too, which fills METADATA for free.
+    with tracing.span("download", tool=_ytdlp_tool()):
+        METADATA.put_many(YTDLP.download(url, cache_tmp))
+    _record_download(cache_tmp)
+    os.replace(cache_tmp, cache_path)
+    CACHE.record("full", cache_path)
+
+def is_hot_song(video_id: str) -> bool:
+    info = METADATA.get(video_id) or {}
+    return info.get("requests", 0) >= HOT_SONG_THRESHOLD
+
+def ensure_source_window(url, start: int, duration: int = SONG_SECONDS):
+    """Return (path, offset) of local audio covering [start, start + duration) of a video.
+
+    Uses the full cached download when there is one, or when DOWNLOAD_MODE is "full" or the
+    song is hot; otherwise fetches (and caches) only that window. `offset` is where the window
+    begins inside the returned file.
+    """
+    if not is_valid_youtube_url(url):
+        raise ValueError(f"Refusing to download non-YouTube URL: {url!r}")
+    video_id = extract_youtube_id(url)
+    full_path = CACHE_DIR / f"{video_id}.full.m4a"
+    # Only a probe: the hit (or miss) is counted by ensure_cached_source(), when it is used.
+    if CACHE.contains("full", full_path) or DOWNLOAD_MODE == "full" or is_hot_song(video_id):
+        return ensure_cached_source(url), start
+    section_path = SECTION_CACHE_DIR / f"{video_id}_{int(start)}_{int(duration)}.m4a"
+    if not CACHE.lookup("sections", section_path):
+        _inflight.do(("section", section_path.name), _download_section, url, section_path, int(start), int(duration))
+    return section_path, 0
+
+def _download_section(url, section_path: Path, start: int, duration: int):
+    if section_path.exists():
+        return
+    section_tmp = section_path.with_name(f"{section_path.stem}.partial.m4a")
+    with tracing.span("download", tool=_ytdlp_tool()):
+        METADATA.put_many(YTDLP.download(url, section_tmp, section=(start, start + duration)))
+    _record_download(section_tmp)
+    os.replace(section_tmp, section_path)
+    CACHE.record("sections", section_path)
+
+def fetch_song_window(url, start_override=None, profile: OutputProfile = None, seconds: int = SONG_SECONDS) -> dict:
+    """Network half of rendering a song: resolve its start and make its window available locally.
+
+    Returns {"cached": path} when the segment (the first `seconds` of the window, in
+    `profile`, default DEFAULT_PROFILE) is already cached, otherwise {"segmentKey", "source",
+    "offset", "profile", "seconds", "loudnessKey"} for render_song_segment() to encode; both carry the
+    resolved "start".
+    """
+    if not is_valid_youtube_url(url):
+        raise ValueError(f"Refusing to download non-YouTube URL: {url!r}")
+    profile = profile or DEFAULT_PROFILE
+    video_id = extract_youtube_id(url)
+    if start_override is not None:
+        # A fixed start fully determines the segment, so check the cache before probing.
+        segment_key = segment_cache_key(video_id, int(start_override), seconds, encode_params(profile))
+        cached = lookup_segment(segment_key, profile)
+        if cached:
+            return {"cached": cached, "start": int(start_override)}
+    start = choose_song_start(get_youtube_duration(url), start_override, video_id)
+    if start_override is None:
+        segment_key = segment_cache_key(video_id, start, seconds, encode_params(profile))
+        cached = lookup_segment(segment_key, profile)
+        if cached:
+            return {"cached": cached, "start": start}
+    source, offset = ensure_source_window(url, start)
+    return {"segmentKey": segment_key, "source": source, "offset": offset, "start": start,
+            "profile": profile, "seconds": seconds, "loudnessKey": song_loudness_key(video_id, start)}
+
+def render_song_segment(window: dict, out_path) -> Path:
+    """CPU half of rendering a song: write the normalized segment for a fetch_song_window() result."""
+    if "cached" in window:
+        # Unchanged songs are just linked in, which is what makes a regeneration cheap.
+        link_or_copy(window["cached"], Path(out_path))
+        return Path(out_path)
+    # Trim, apply the cached loudness gain and encode in one pass; the result is the final per-item file.
+    profile = window["profile"]
+    gain = loudness_gain(window["loudnessKey"], window["source"], window["offset"], SONG_SECONDS)
+    cmd_trim = ["ffmpeg", "-y", "-ss", str(window["offset"]), "-i", str(window["source"]),
+                "-t", str(window["seconds"]), *loudness.volume_filter(gain), *profile.output_args, str(out_path)]
+    with tracing.span("trim", tool="ffmpeg"):
+        subprocess.run(cmd_trim, check=True, timeout=FFMPEG_TIMEOUT)
+    store_segment(out_path, window["segmentKey"], profile)
+    return Path(out_path)
+
+def download_random_youtube_audio(url, out_path, start_override=None):
+    """Write a normalized 60s audio segment of a YouTube video to out_path, with caching.
+
+    Full downloads are cached per video, and the final normalized segment is cached per
+    (video, start, duration, encode params), so a repeat song with a fixed start needs no
+    yt-dlp or ffmpeg work at all.
+    """
+    render_song_segment(fetch_song_window(url, start_override), out_path)
+
+def link_or_copy(src: Path, dest: Path):
+    """Hardlink src to dest (no data copied), falling back to a copy across filesystems."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy(src, dest)
+
+def decode_data_url(audio_url: str) -> bytes:
+    """Decode a base64 `data:audio/...` URL (or bare base64) into raw bytes."""
+    match = re.match(r'data:audio/[\w.+-]+(?:;[^,;]*)*;base64,(.*)', audio_url, re.DOTALL)
+    b64data = match.group(1) if match else audio_url
+    return base64.b64decode(b64data)
+
+def is_valid_snippet_id(snippet_id) -> bool:
+    return isinstance(snippet_id, str) and re.fullmatch(r"[0-9a-f]{64}", snippet_id) is not None
+
+def _touch_snippet(snippet_id: str, suffix: str):
+    if not is_valid_snippet_id(snippet_id):
+        return None
+    return CACHE.lookup("snippets", SNIPPET_CACHE_DIR / f"{snippet_id}.{suffix}")
+
+def lookup_snippet_source(snippet_id: str):
+    """Return the original uploaded audio for a snippet id (marking it recently used), or None."""
+    return _touch_snippet(snippet_id, "src")
+
+def store_snippet(audio_bytes: bytes) -> str:
+    """Add uploaded snippet audio to the content-addressed cache; returns its snippet id.
+
+    Identical uploads hash to the same id, so each distinct clip is stored (and later
+    normalized) only once no matter how often it is re-submitted.
+    """
+    snippet_id = hashlib.sha256(audio_bytes).hexdigest()
+    if lookup_snippet_source(snippet_id) is None:
+        _inflight.do(("snippet", snippet_id), _write_snippet, snippet_id, audio_bytes)
+    return snippet_id
+
+def _write_snippet(snippet_id: str, audio_bytes: bytes):
+    if lookup_snippet_source(snippet_id) is not None:
+        return
+    tmp = SNIPPET_CACHE_DIR / f"{snippet_id}.{uuid.uuid4().hex}.partial"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(audio_bytes)
+        os.replace(tmp, SNIPPET_CACHE_DIR / f"{snippet_id}.src")
+    finally:
+        tmp.unlink(missing_ok=True)
+    CACHE.record("snippets", SNIPPET_CACHE_DIR / f"{snippet_id}.src")
+
+def open_snippet_writer() -> HashingWriter:
+    """A writer that streams uploaded audio into the snippet cache; commit() returns its id.
+
+    Like store_snippet, but the audio never has to be in memory all at once.
+    """
+    return HashingWriter(SNIPPET_CACHE_DIR, _adopt_snippet)
+
+def _adopt_snippet(upload: Path, snippet_id: str) -> str:
+    if lookup_snippet_source(snippet_id) is None:
+        _inflight.do(("snippet", snippet_id), _move_snippet, upload, snippet_id)
+    return snippet_id
+
+def _move_snippet(upload: Path, snippet_id: str):
+    if lookup_snippet_source(snippet_id) is not None:
+        return
+    os.replace(upload, SNIPPET_CACHE_DIR / f"{snippet_id}.src")
+    CACHE.record("snippets", SNIPPET_CACHE_DIR / f"{snippet_id}.src")
+
+def normalized_snippet(snippet_id: str, profile: OutputProfile = None):
+    """Return the snippet encoded to `profile` (default DEFAULT_PROFILE), encoding it on first use only."""
+    profile = profile or DEFAULT_PROFILE
+    cached = _touch_snippet(snippet_id, _item_suffix(profile))
+    if cached:
+        return cached
+    return _inflight.do(("snippet-encode", snippet_id, profile.name), _encode_snippet, snippet_id, profile)
+
+def _encode_snippet(snippet_id: str, profile: OutputProfile):
+    suffix = _item_suffix(profile)
+    cached = _touch_snippet(snippet_id, suffix)
+    if cached:
+        return cached
+    source = lookup_snippet_source(snippet_id)
+    if source is None:
+        return None
+    gain = loudness_gain(f"snippet:{snippet_id}", source)
+    path = SNIPPET_CACHE_DIR / f"{snippet_id}.{suffix}"
+    tmp = SNIPPET_CACHE_DIR / f"{snippet_id}.{uuid.uuid4().hex}.partial.{profile.extension}"
+    try:
+        cmd = ["ffmpeg", "-y", "-i", str(source), *loudness.volume_filter(gain), *profile.output_args, str(tmp)]
+        with tracing.span("normalize", tool="ffmpeg"):
+            subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    CACHE.record("snippets", path)
+    return path
+
+def resolve_snippet(snippet: dict, memo: dict):
+    """Return the snippet id for a timeline snippet, or None (with a warning) if unusable.
+
+    Snippets reference an uploaded `snippetId` or inline an `audioUrl` data URL. `memo` maps
+    data URLs already seen in this job to their id, so repeated clips are decoded once.
+    """
+    if snippet.get('type') != 'upload':
+        print(f"Skipping unsupported snippet (only uploaded audio is supported): {snippet.get('type')}", file=sys.stderr)
+        return None
+    if snippet.get('snippetId'):
+        if lookup_snippet_source(snippet['snippetId']) is None:
+            print(f"Unknown snippet id: {snippet['snippetId']}", file=sys.stderr)
+            return None
+        return snippet['snippetId']
+    audio_url = snippet.get('audioUrl')
+    if not audio_url:
+        print("Skipping snippet without audio", file=sys.stderr)
+        return None
+    snippet_id = memo.get(audio_url)
+    if snippet_id is None:
+        snippet_id = store_snippet(decode_data_url(audio_url))
+        memo[audio_url] = snippet_id
+    return snippet_id
+
+def effect_source_path(effect: dict):
+    """Resolve a timeline effect to its file in EFFECTS_DIR, or None (with a warning) if unknown."""
+    effect_id = effect.get('id')
+    effect_meta = EFFECTS_MAP.get(effect_id)
+    if not effect_meta:
+        print(f"Unknown effect id: {effect_id}", file=sys.stderr)
+        return None
+    effect_path = EFFECTS_DIR / effect_meta['audioUrl'].split('/')[-1]
+    if not effect_path.exists():
+        print(f"Effect file not found: {effect_path}", file=sys.stderr)
+        return None
+    return effect_path
+
+def _effect_fingerprint(effect_path: Path, profile: OutputProfile) -> dict:
+    st = effect_path.stat()
+    return {"size": st.st_size, "mtime": st.st_mtime, "encode": encode_params(profile)}
+
+def _load_effect_manifest() -> dict:
+    try:
+        with open(EFFECT_CACHE_DIR / "manifest.json", 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_effect_manifest(manifest: dict):
+    path = EFFECT_CACHE_DIR / "manifest.json"
+    tmp = path.with_suffix(f".{uuid.uuid4().hex}.partial")
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def _record_effect(name: str, fingerprint: dict):
+    # Effects build concurrently (and in other processes), so merge into the manifest on disk.
+    with _effects_lock, _inflight.leases.hold("effects"):
+        manifest = _load_effect_manifest()
+        manifest[name] = fingerprint
+        _save_effect_manifest(manifest)
+
+def _normalize_effect(effect_path: Path, normalized: Path, fingerprint: dict, profile: OutputProfile) -> Path:
+    if _load_effect_manifest().get(normalized.name) != fingerprint or not normalized.exists():
+        gain = loudness_gain(effect_loudness_key(effect_path), effect_path)
+        tmp = EFFECT_CACHE_DIR / f"{effect_path.stem}.{uuid.uuid4().hex}.partial.{profile.extension}"
+        try:
+            cmd = ["ffmpeg", "-y", "-i", str(effect_path), *loudness.volume_filter(gain), *profile.output_args,
+                   str(tmp)]
+            with tracing.span("normalize", tool="ffmpeg"):
+                subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT)
+            os.replace(tmp, normalized)
+        finally:
+            tmp.unlink(missing_ok=True)
+        _record_effect(normalized.name, fingerprint)
+    _effects_ready[str(normalized)] = fingerprint
+    return normalized
+
+def normalized_effect_path(effect_path: Path, profile: OutputProfile = None) -> Path:
+    """Return the effect transcoded to `profile` (default DEFAULT_PROFILE), (re)building it only if it changed.
+
+    An up-to-date file is returned without taking any lock; a missing or stale one is built
+    once per effect and profile, across threads and processes.
+    """
+    profile = profile or DEFAULT_PROFILE
+    # Keyed by the normalized file's name, so each profile's copy is tracked on its own.
+    normalized = EFFECT_CACHE_DIR / f"{effect_path.stem}.{_item_suffix(profile)}"
+    fingerprint = _effect_fingerprint(effect_path, profile)
+    if _effects_ready.get(str(normalized)) == fingerprint and normalized.exists():
+        return normalized
+    # The manifest is replaced atomically, so reading it needs no lock.
+    if _load_effect_manifest().get(normalized.name) == fingerprint and normalized.exists():
+        _effects_ready[str(normalized)] = fingerprint
+        return normalized
+    return _inflight.do(("effect-encode", str(normalized)), _normalize_effect,
+                        effect_path, normalized, fingerprint, profile)
+
+def prepare_effects():
+    """Pre-transcode every effect in EFFECTS to DEFAULT_PROFILE; unchanged files are skipped.
+
+    Meant to run once at startup (in the background); items also normalize lazily on first use.
+    """
+    for effect in EFFECTS:
+        effect_path = EFFECTS_DIR / effect['audioUrl'].split('/')[-1]
+        try:
+            normalized_effect_path(effect_path, DEFAULT_PROFILE)
+        except Exception as e:
+            print(f"Could not pre-normalize effect {effect['id']}: {e}", file=sys.stderr)
+
+def build_single_pass_command(sources, output_path: Path, profile: OutputProfile = None) -> list:
+    """Build one ffmpeg invocation that trims, normalizes and concatenates every source.
+
+    `sources` is a list of (path, start, duration[, gain_db]) in timeline order; start/duration
+    of None use the whole file. Songs are trimmed with input seeking, every input gets its
+    loudness gain and is resampled to the profile's format inside the filter graph, and the
+    mix is encoded exactly once.
+    """
+    profile = profile or DEFAULT_PROFILE
+    cmd = ["ffmpeg", "-y"]
+    filters = []
+    for n, (path, start, duration, *gain) in enumerate(sources):
+        if start is not None:
+            cmd += ["-ss", str(start)]
+        if duration is not None:
+            cmd += ["-t", str(duration)]
+        cmd += ["-i", str(path)]
+        volume = f"volume={gain[0]}dB," if gain and gain[0] else ""
+        filters.append(f"[{n}:a]{volume}aresample={profile.sample_rate},aformat=sample_fmts=fltp:channel_layouts=stereo[a{n}]")
+    labels = "".join(f"[a{n}]" for n in range(len(sources)))
+    filters.append(f"{labels}concat=n={len(sources)}:v=0:a=1[out]")
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[out]", *profile.output_args, str(output_path)]
+    return cmd
 
 # --- Main Processing Function ---
-def process_audio(data: dict) -> str:
-    """Process the timeline and generate the final audio file. Returns output path."""
-    timeline = data.get("timeline", [])
-    # Bound disk usage: drop stale generated output (1h) and cached downloads (24h).
-    cleanup_old_files(OUTPUT_DIR, 60 * 60)
-    cleanup_old_files(CACHE_DIR, 24 * 60 * 60)
-    job_id = str(uuid.uuid4())
-    job_dir = Path(tempfile.gettempdir()) / f"club100_{job_id}"
-    job_dir.mkdir(exist_ok=True)
-    audio_files = []
+def output_path(job_id: str, profile: OutputProfile = None) -> Path:
+    """Where a finished job's mix is published."""
+    return OUTPUT_DIR / f"club100_{job_id}.{(profile or DEFAULT_PROFILE).extension}"
+
+def partial_output_path(job_id: str, profile: OutputProfile = None) -> Path:
+    """Where a job's mix is written while it is still being rendered."""
+    return OUTPUT_DIR / f"club100_{job_id}.partial.{(profile or DEFAULT_PROFILE).extension}"
+
+def find_output(job_id: str, partial: bool = False):
+    """The job's published (or, with partial, in-progress) mix in whichever profile it used, or None."""
+    for extension in OUTPUT_EXTENSIONS:
+        name = f"club100_{job_id}.partial.{extension}" if partial else f"club100_{job_id}.{extension}"
+        if (OUTPUT_DIR / name).exists():
+            return OUTPUT_DIR / name
+    return None
+
+def song_fingerprint(song: dict):
+    """Identity of a song item as requested: its video and requested start (None = random)."""
+    url = song.get('url')
+    if not is_valid_youtube_url(url):
+        return None
+    return json.dumps([extract_youtube_id(url), parse_song_start(song.get('start'))])
+
+def _render_manifest_path(job_id):
+    if not isinstance(job_id, str) or not re.fullmatch(r'[0-9A-Za-z-]{1,64}', job_id):
+        return None
+    return RENDER_MANIFEST_DIR / f"{job_id}.json"
+
+def load_render_manifest(job_id) -> dict:
+    """{fingerprint: [resolved starts]} recorded by an earlier job, or {} if unknown/expired."""
+    path = _render_manifest_path(job_id)
+    if path is None:
+        return {}
     try:
-        # 1. Download all songs in parallel first
-        song_download_tasks = []
-        song_download_results = {}
-        for i, item in enumerate(timeline):
-            if item.get('type') == 'song' and 'song' in item:
-                song = item['song']
-                url = song.get('url')
-                start_override = song.get('start')
-                song_raw = job_dir / f"song_{i:03d}_raw.mp3"
-                song_download_tasks.append((i, url, song_raw, start_override))
-        def download_song_task(args):
-            i, url, song_raw, start_override = args
-            try:
-                download_random_youtube_audio(url, song_raw, start_override)
-                return (i, song_raw)
-            except Exception as e:
-                print(f"Error downloading {url}: {e}", file=sys.stderr)
-                return (i, None)
-        if song_download_tasks:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(download_song_task, args) for args in song_download_tasks]
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result is not None and isinstance(result, tuple) and len(result) == 2:
-                        i, song_raw = result
-                        if i is not None and song_raw is not None:
-                            song_download_results[i] = song_raw
-
-        # 2. Process all timeline items in parallel (re-encode/generate/copy)
-        def process_item_task(args):
-            i, item = args
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    starts = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if isinstance(entry, dict) and isinstance(entry.get('start'), int):
+            starts.setdefault(entry.get('fingerprint'), []).append(entry['start'])
+    return starts
+
+def save_render_manifest(job_id: str, entries: list):
+    """Record [{"fingerprint", "start"}] for a finished job (atomic write)."""
+    path = _render_manifest_path(job_id)
+    if path is None:
+        return
+    RENDER_MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{uuid.uuid4().hex}.partial")
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    CACHE.record("renders", path)
+
+def _pin_song_starts(timeline, previous_job_id) -> list:
+    """Copy the song items of timeline, pinning random-start songs to a start that is already warm.
+
+    Unchanged songs take the previous job's start; otherwise a start chosen by /prefetch is used
+    (once). Returns the copied timeline; renderers write each song's resolved start back into it.
+    """
+    previous = load_render_manifest(previous_job_id) if previous_job_id else {}
+    copied = []
+    for item in timeline:
+        if item.get('type') == 'song' and isinstance(item.get('song'), dict):
+            song = dict(item['song'])
+            # Parsed once here, so one bad value only costs that song its fixed start.
+            song['start'] = parse_song_start(song.get('start'))
+            fingerprint = song_fingerprint(song)
+            if song.get('start') is None and previous.get(fingerprint):
+                song['start'] = previous[fingerprint].pop(0)
+            elif song.get('start') is None and fingerprint:
+                song['start'] = METADATA.pop_field(extract_youtube_id(song['url']), 'prefetchedStart')
+            item = {**item, 'song': song, '_fingerprint': fingerprint}
+        copied.append(item)
+    return copied
+
+def prefetch_songs(songs) -> list:
+    """Warm the metadata, source and segment caches for songs ({url, start?}) in the background.
+
+    Everything runs on the shared scheduler at PRIORITY_LOW, so it only uses capacity render
+    jobs leave idle. A song without a start gets one chosen now and remembered as its
+    "prefetchedStart", which the next render uses, so that render finds the segment already
+    cached. Returns one future per distinct song queued.
+    """
+    scheduler = get_scheduler()
+    wanted = {}
+    for song in songs:
+        url = song.get('url')
+        if not is_valid_youtube_url(url):
+            continue
+        key = (extract_youtube_id(url), parse_song_start(song.get('start')))
+        wanted.setdefault(key, url)
+    if not wanted:
+        return []
+    # One batched probe first; every song's own work is chained after it.
+    probe = scheduler.submit("net", "prefetch", _prefetch_probe, list(set(wanted.values())),
+                             priority=PRIORITY_LOW)
+    futures = []
+    for (video_id, start), url in wanted.items():
+        fetch = scheduler.then(probe, "net", "prefetch", functools.partial(_prefetch_window, url, start),
+                               priority=PRIORITY_LOW)
+        warm = scheduler.then(fetch, "cpu", "prefetch", _warm_segment, priority=PRIORITY_LOW)
+        warm.add_done_callback(functools.partial(_log_prefetch_failure, url))
+        futures.append(warm)
+    return futures
+
+def _prefetch_probe(urls):
+    try:
+        prefetch_metadata(urls)
+    except Exception as e:
+        # Songs fall back to probing one by one, so keep going.
+        print(f"Batched metadata probe failed: {e}", file=sys.stderr)
+
+def _prefetch_window(url, start, _probed=None) -> dict:
+    video_id = extract_youtube_id(url)
+    if start is None:
+        # Re-use a start chosen by an earlier prefetch, so repeated calls stay idempotent.
+        remembered = (METADATA.get(video_id) or {}).get('prefetchedStart')
+        window = fetch_song_window(url, remembered)
+        METADATA.put(video_id, {'prefetchedStart': window['start']})
+        return window
+    return fetch_song_window(url, start)
+
+def _warm_segment(window: dict):
+    if "cached" in window:
+        return window["cached"]
+    JOB_WORK_DIR.mkdir(parents=True, exist_ok=True)
+    scratch = JOB_WORK_DIR / f"prefetch_{uuid.uuid4().hex}.{window['profile'].extension}"
+    try:
+        render_song_segment(window, scratch)
+    finally:
+        scratch.unlink(missing_ok=True)
+    return lookup_segment(window["segmentKey"], window["profile"])
+
+def _log_prefetch_failure(url, future):
+    if future.exception() is not None:
+        print(f"Prefetch of {url} failed: {future.exception()}", file=sys.stderr)
+
+def render_settings(data: dict) -> tuple:
+    """(output profile, seconds of each song) a render request is encoded with; drafts use less of both."""
+    if data.get("draft"):
+        return DRAFT_PROFILE, min(DRAFT_SONG_SECONDS, SONG_SECONDS)
+    return get_profile(data.get("outputProfile") or OUTPUT_PROFILE), SONG_SECONDS
+
+def prepare_batch(datas: list, job_key: str = "batch") -> tuple:
+    """Do the work a batch of render requests shares once; returns (datas, plan).
+
+    A song (same video, same fixed start -- or no start) that appears more than once across
+    the batch is downloaded and trimmed a single time here, on the shared scheduler, before
+    any timeline renders; the renders then take it from the segment cache. Songs without a
+    start get one chosen now, shared by every timeline, unless a request sets
+    `"shuffleStarts": true` to keep its own random starts. Returns copies of the requests with
+    those starts pinned, and a plan summary (counts and how long the shared work took).
+    Shared songs are encoded once per output profile (and draft length) the batch's requests use.
+    """
+    started = time.time()
+    occurrences, urls, profiles = {}, {}, {}
+    for data in datas:
+        profile, seconds = render_settings(data)
+        for key, url in _batch_song_keys(data):
+            occurrences[key] = occurrences.get(key, 0) + 1
+            urls.setdefault(key, url)
+            profiles.setdefault(key, {})[(profile.name, seconds)] = (profile, seconds)
+    shared = {key: urls[key] for key, count in occurrences.items() if count > 1}
+    starts, failed = {}, 0
+    if shared:
+        scheduler = get_scheduler()
+        probe = scheduler.submit("net", job_key, _prefetch_probe, list(set(urls.values())))
+        pending = {}
+        for key, url in shared.items():
+            first, *others = profiles[key].values()
+            fetch = scheduler.then(probe, "net", job_key, functools.partial(_batch_window, url, key[1], *first))
+            warms = [scheduler.then(fetch, "cpu", job_key, _warm_segment)]
+            for profile, seconds in others:
+                # Same start as the first profile's window; the source is already local by then.
+                refetch = scheduler.then(fetch, "net", job_key,
+                                         functools.partial(_batch_rewindow, url, profile, seconds))
+                warms.append(scheduler.then(refetch, "cpu", job_key, _warm_segment))
+            pending[key] = (fetch, warms)
+        for key, (fetch, warms) in pending.items():
             try:
-                if item.get('type') == 'song' and 'song' in item:
-                    song = item['song']
-                    url = song.get('url')
-                    song_raw = song_download_results.get(i)
-                    song_std = job_dir / f"song_{i:03d}.mp3"
-                    if song_raw and song_raw.exists():
-                        cmd = ["ffmpeg", "-y", "-i", str(song_raw), "-ar", "44100", "-ac", "2", "-codec:a", "libmp3lame", "-b:a", "192k", str(song_std)]
-                        subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT)
-                        song_raw.unlink(missing_ok=True)
-                        return (i, song_std)
-                    else:
-                        print(f"Song download failed for {url}", file=sys.stderr)
-                        return (i, None)
-                elif item.get('type') == 'snippet' and 'snippet' in item:
-                    snippet = item['snippet']
-                    snippet_faded = job_dir / f"snippet_{i:03d}.mp3"
-                    if snippet.get('type') == 'upload' and snippet.get('audioUrl'):
-                        audio_url = snippet['audioUrl']
-                        match = re.match(r'data:audio/\w+;base64,(.*)', audio_url)
-                        b64data = match.group(1) if match else audio_url
-                        audio_bytes = base64.b64decode(b64data)
-                        temp_upload = job_dir / f"snippet_{i:03d}_upload"
-                        with open(temp_upload, 'wb') as f:
-                            f.write(audio_bytes)
-                        cmd = ["ffmpeg", "-y", "-i", str(temp_upload), "-ar", "44100", "-ac", "2", "-codec:a", "libmp3lame", "-b:a", "192k", str(snippet_faded)]
-                        subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT)
-                        temp_upload.unlink(missing_ok=True)
-                        return (i, snippet_faded)
-                    else:
-                        print(f"Skipping unsupported snippet (only uploaded audio is supported): {snippet.get('type')}", file=sys.stderr)
-                        return (i, None)
-                elif item.get('type') == 'effect' and 'effect' in item:
-                    effect = item['effect']
-                    effect_id = effect.get('id')
-                    effect_meta = EFFECTS_MAP.get(effect_id)
-                    if effect_meta:
-                        filename = effect_meta['audioUrl'].split('/')[-1]
-                        effect_path = EFFECTS_DIR / filename
-                        if effect_path.exists():
-                            # Copy to job dir to avoid file lock issues
-                            effect_copy = job_dir / f"effect_{i:03d}.mp3"
-                            shutil.copy(effect_path, effect_copy)
-                            return (i, effect_copy)
-                        else:
-                            print(f"Effect file not found: {effect_path}", file=sys.stderr)
-                            return (i, None)
-                    else:
-                        print(f"Unknown effect id: {effect_id}", file=sys.stderr)
-                        return (i, None)
+                for warm in warms:
+                    warm.result()
+                starts[key] = fetch.result()["start"]
             except Exception as e:
-                print(f"Error processing item {i}: {e}", file=sys.stderr)
-                return (i, None)
-
-        item_tasks = [(i, item) for i, item in enumerate(timeline)]
-        processed_results = {}
-        if item_tasks:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(process_item_task, args) for args in item_tasks]
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result is not None and isinstance(result, tuple) and len(result) == 2:
-                        i, out_path = result
-                        if i is not None and out_path is not None:
-                            processed_results[i] = out_path
-
-        # 3. Collect processed audio files in timeline order
-        audio_files = []
-        for i in range(len(timeline)):
-            out_path = processed_results.get(i)
-            if out_path and hasattr(out_path, 'exists') and out_path.exists():
-                audio_files.append(out_path)
-            else:
-                print(f"Skipping item {i} due to processing error", file=sys.stderr)
-        concat_list = job_dir / "concat.txt"
-        with open(concat_list, "w", encoding="utf-8") as f:
-            for af in audio_files:
-                if not af.exists() or af.stat().st_size == 0:
-                    print(f"[WARN] File missing or empty before concat: {af}", file=sys.stderr)
-                f.write(f"file '{af.as_posix()}'\n")
-        output_mp3 = OUTPUT_DIR / f"club100_{job_id}.mp3"
-        # Re-encode the concatenated audio to ensure valid MP3 output
-        cmd_concat = [
-            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list),
-            "-ar", "44100", "-ac", "2", "-codec:a", "libmp3lame", "-b:a", "192k", str(output_mp3)
-        ]
-        subprocess.run(cmd_concat, check=True, timeout=FFMPEG_TIMEOUT)
-        return str(output_mp3)
+                # The timelines still render the song themselves; only the sharing is lost.
+                failed += 1
+                print(f"Shared work for {shared[key]} failed: {e}", file=sys.stderr)
+    prepared = [_pin_batch_starts(data, starts) for data in datas]
+    plan = {"timelines": len(datas), "songs": sum(occurrences.values()), "uniqueSongs": len(occurrences),
+            "sharedSongs": len(shared), "sharedFailures": failed, "planSeconds": round(time.time() - started, 4)}
+    return prepared, plan
+
+def _batch_song_keys(data: dict):
+    """(key, url) for each song of a request; key is (video id, fixed start or None)."""
+    for item in data.get('timeline') or []:
+        song = item.get('song') if isinstance(item, dict) and item.get('type') == 'song' else None
+        if not isinstance(song, dict) or not is_valid_youtube_url(song.get('url')):
+            continue
+        start = parse_song_start(song.get('start'))
+        if start is None and data.get('shuffleStarts'):
+            continue
+        yield (extract_youtube_id(song['url']), start), song['url']
+
+def _batch_window(url, start, profile, seconds, _probed=None) -> dict:
+    return fetch_song_window(url, start, profile, seconds)
+
+def _batch_rewindow(url, profile, seconds, window: dict) -> dict:
+    return fetch_song_window(url, window["start"], profile, seconds)
+
+def _pin_batch_starts(data: dict, starts: dict) -> dict:
+    if data.get('shuffleStarts'):
+        return data
+    timeline = []
+    for item in data.get('timeline') or []:
+        song = item.get('song') if isinstance(item, dict) and item.get('type') == 'song' else None
+        if isinstance(song, dict) and parse_song_start(song.get('start')) is None and is_valid_youtube_url(song.get('url')):
+            start = starts.get((extract_youtube_id(song['url']), None))
+            if start is not None:
+                item = {**item, 'song': {**song, 'start': start}}
+        timeline.append(item)
+    return {**data, 'timeline': timeline}
+
+def process_audio(data: dict, job_id: str = None, progress=None) -> str:
+    """Process the timeline and generate the final audio file. Returns output path.
+
+    `job_id` names the output file (a fresh UUID if omitted); `progress(stage, done, total)`
+    is called as items finish so callers can report per-item progress. `data["renderMode"]`
+    (default RENDER_MODE) selects the renderer; see RENDER_MODES. `data["outputProfile"]`
+    (default OUTPUT_PROFILE) selects the output format. `data["previousJobId"]` reuses that
+    job's random song starts for songs that did not change. `data["draft"]` renders a quick
+    preview instead: DRAFT_PROFILE quality and DRAFT_SONG_SECONDS of each song.
+    """
+    render_mode = data.get("renderMode") or RENDER_MODE
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: {render_mode!r}")
+    draft = bool(data.get("draft"))
+    profile, song_seconds = render_settings(data)
+    # Songs unchanged since `previousJobId` keep their windows, so their segments come straight
+    # from the cache and only edited items are downloaded and encoded again.
+    timeline = _pin_song_starts(data.get("timeline", []), data.get("previousJobId"))
+    job_id = job_id or str(uuid.uuid4())
+    report = progress or (lambda stage, done, total: None)
+    job_dir = JOB_WORK_DIR / f"club100_{job_id}"
+    job_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_path(job_id, profile)
+    # Resolve every uncached song's duration up front in as few yt-dlp runs as possible.
+    song_urls = [item['song'].get('url') for item in timeline
+                 if item.get('type') == 'song' and isinstance(item.get('song'), dict)]
+    try:
+        prefetch_metadata(song_urls)
+        # Request counts drive the hot-song policy for full-file caching. A draft and the full
+        # render that follows it are one request, so only the full render counts.
+        if not draft:
+            METADATA.increment(extract_youtube_id(u) for u in song_urls if is_valid_youtube_url(u))
+    except Exception as e:
+        # Per-song probing still happens as a fallback, so this is not fatal.
+        print(f"Batched metadata probe failed: {e}", file=sys.stderr)
+    # Render into the partial file (which /stream tails) and publish it atomically when done.
+    partial_file = partial_output_path(job_id, profile)
+    try:
+        if render_mode == "single_pass":
+            _render_single_pass(timeline, job_dir, partial_file, report, profile, song_seconds)
+        elif render_mode == "pcm":
+            _render_pcm(timeline, job_dir, partial_file, report, profile, song_seconds,
+                        crossfade=data.get("crossfade", PCM_CROSSFADE_SECONDS),
+                        normalize=bool(data.get("normalize", False)))
+        else:
+            _render_segments(timeline, job_dir, partial_file, report, profile, song_seconds)
+        os.replace(partial_file, output_file)
+        CACHE.record("outputs", output_file)
+        save_render_manifest(job_id, [
+            {'fingerprint': item['_fingerprint'], 'start': item['song']['start']}
+            for item in timeline
+            if item.get('_fingerprint') and isinstance(item['song'].get('start'), int)])
+        return str(output_file)
     finally:
+        partial_file.unlink(missing_ok=True)
         shutil.rmtree(job_dir, ignore_errors=True)
 
+def _run_pipelines(job_key, pipelines: dict, report, on_result=None) -> dict:
+    """Run each item's chain of (lane, fn) steps on the shared scheduler; returns {index: result}.
+
+    An item's steps run back to back, each given the previous step's result, so its encode
+    starts as soon as its own download is done. Failed items are logged and left out.
+    on_result(index, result) is called on this thread as each item finishes (None if it failed).
+    """
+    scheduler = get_scheduler()
+    downloads, finals = {}, {}
+    for i, steps in pipelines.items():
+        future = None
+        for lane, fn in steps:
+            fn = tracing.for_item(i, fn)
+            if future is None:
+                future = scheduler.submit(lane, job_key, fn)
+            else:
+                future = scheduler.then(future, lane, job_key, fn)
+            if lane == "net":
+                downloads[future] = i
+        finals[future] = i
+    results = {}
+    downloaded = processed = 0
+    if downloads:
+        report("downloading", 0, len(downloads))
+    pending = set(downloads) | set(finals)
+    while pending:
+        finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            if future in downloads:
+                downloaded += 1
+                report("downloading", downloaded, len(downloads))
+            if future in finals:
+                processed += 1
+                report("processing", processed, len(finals))
+                try:
+                    results[finals[future]] = future.result()
+                except Exception as e:
+                    print(f"Error processing item {finals[future]}: {e}", file=sys.stderr)
+                if on_result:
+                    on_result(finals[future], results.get(finals[future]))
+    return results
+
+def _render_segments(timeline, job_dir: Path, output_file: Path, report, profile: OutputProfile,
+                     song_seconds: int = SONG_SECONDS):
+    """Render every item to a file in the output profile in job_dir, then concatenate them.
+
+    For appendable profiles each item is also appended to output_file as soon as it and every
+    item before it are done, so /stream can play the start of the mix while the rest renders.
+    The concatenated mix then replaces it in one step.
+    """
+    snippet_memo = {}
+
+    def snippet_task(i, snippet):
+        snippet_id = resolve_snippet(snippet, snippet_memo)
+        cached = normalized_snippet(snippet_id, profile) if snippet_id else None
+        if not cached:
+            raise ValueError("snippet could not be resolved")
+        # Link it in so cache eviction can't pull it out from under the concat.
+        snippet_std = job_dir / f"snippet_{i:03d}.{profile.extension}"
+        link_or_copy(cached, snippet_std)
+        return snippet_std
+
+    def effect_task(effect):
+        effect_path = effect_source_path(effect)
+        if not effect_path:
+            raise ValueError(f"unknown effect {effect!r}")
+        # Pre-normalized library files are never evicted, so reference them directly.
+        return normalized_effect_path(effect_path, profile)
+
+    pipelines = {}
+    for i, item in enumerate(timeline):
+        if item.get('type') == 'song' and 'song' in item:
+            song = item['song']
+            pipelines[i] = [
+                ("net", functools.partial(_fetch_song, song, profile, song_seconds)),
+                ("cpu", functools.partial(_render_song_into, job_dir / f"song_{i:03d}.{profile.extension}")),
+            ]
+        elif item.get('type') == 'snippet' and 'snippet' in item:
+            pipelines[i] = [("cpu", functools.partial(snippet_task, i, item['snippet']))]
+        elif item.get('type') == 'effect' and 'effect' in item:
+            pipelines[i] = [("cpu", functools.partial(effect_task, item['effect']))]
+    streamed = []
+    pending_order, ready = list(pipelines), {}
+
+    def stream_in_order(i, out_path):
+        ready[i] = out_path
+        while pending_order and pending_order[0] in ready:
+            path = ready.pop(pending_order.pop(0))
+            if not path or not path.exists() or path.stat().st_size == 0:
+                continue
+            if not streamed:
+                streamed.append(open(output_file, "wb"))
+            _append_frames(streamed[0], path, profile)
+
+    try:
+        processed_results = _run_pipelines(job_dir.name, pipelines, report,
+                                           on_result=stream_in_order if profile.appendable else None)
+    finally:
+        for f in streamed:
+            f.close()
+
+    # Collect processed audio files in timeline order
+    audio_files = []
+    for i in range(len(timeline)):
+        out_path = processed_results.get(i)
+        if out_path and out_path.exists():
+            audio_files.append(out_path)
+        else:
+            print(f"Skipping item {i} due to processing error", file=sys.stderr)
+    concat_list = job_dir / "concat.txt"
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for af in audio_files:
+            if af.stat().st_size == 0:
+                print(f"[WARN] File empty before concat: {af}", file=sys.stderr)
+            f.write(f"file '{af.as_posix()}'\n")
+    report("concatenating", len(audio_files), len(timeline))
+    if not streamed:
+        _concat_items(concat_list, audio_files, output_file, profile)
+        return
+    # Streams tailing the appended file keep reading it after the finished mix replaces it.
+    concat_file = output_file.with_name(f"{output_file.stem}.concat{output_file.suffix}")
+    try:
+        _concat_items(concat_list, audio_files, concat_file, profile)
+        os.replace(concat_file, output_file)
+    finally:
+        concat_file.unlink(missing_ok=True)
+
+def _append_frames(dest, path: Path, profile: OutputProfile):
+    """Append path's audio frames (without its tag and info frame) to the open file dest."""
+    with open(path, "rb") as src:
+        src.seek(audio_offset(profile, src))
+        shutil.copyfileobj(src, dest)
+    dest.flush()
+
+def _concat_items(concat_list: Path, audio_files, output_file: Path, profile: OutputProfile):
+    cmd_concat = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+    if CONCAT_MODE == "copy" and _concat_copy_safe(audio_files, profile):
+        # Every item is already encoded exactly as the mix will be: join the frames as they are.
+        try:
+            with tracing.span("concat", tool="ffmpeg"):
+                subprocess.run([*cmd_concat, "-c", "copy", "-f", profile.muxer, str(output_file)],
+                               check=True, timeout=FFMPEG_TIMEOUT)
+            return
+        except subprocess.CalledProcessError as e:
+            print(f"Stream-copy concat failed, re-encoding instead: {e}", file=sys.stderr)
+    with tracing.span("concat", tool="ffmpeg"):
+        subprocess.run([*cmd_concat, *profile.output_args, str(output_file)], check=True, timeout=FFMPEG_TIMEOUT)
+
+def _concat_copy_safe(audio_files, profile: OutputProfile) -> bool:
+    """Whether the per-item files can be joined without re-encoding.
+
+    Every per-item file comes from a cache keyed by the profile's codec args (or was just
+    encoded with them), so sharing the profile's extension means sharing its sample rate,
+    channels and codec: each file is a self-contained run of frames, and joining them on frame
+    boundaries gives a valid stream.
+    """
+    return bool(audio_files) and all(f.suffix == f".{profile.extension}" and f.stat().st_size > 0
+                                     for f in audio_files)
+
+def _fetch_song(song: dict, profile: OutputProfile, seconds: int) -> dict:
+    window = fetch_song_window(song.get('url'), song.get('start'), profile, seconds)
+    # Record the start actually used, for this job's render manifest.
+    song['start'] = window['start']
+    return window
+
+def _render_song_into(out_path: Path, window: dict) -> Path:
+    return render_song_segment(window, out_path)
+
+def _source_pipelines(timeline, job_dir: Path, song_seconds: int = SONG_SECONDS) -> dict:
+    """Steps resolving every item to (path, start, duration, gain_db); start/duration of None mean the whole file.
+
+    Songs resolve to their cached window (net lane), snippets to the original upload and
+    effects to the library file (cpu lane, no network). gain_db is the item's cached loudness
+    normalization (see loudness_gain()), for the renderer to apply while decoding.
+    """
+    snippet_memo = {}
+
+    def song_task(song):
+        url = song.get('url')
+        start = choose_song_start(get_youtube_duration(url), song.get('start'), extract_youtube_id(url))
+        song['start'] = start
+        source, offset = ensure_source_window(url, start)
+        return (source, offset, song_seconds)
+
+    def song_gain(song, source):
+        path, offset, duration = source
+        key = song_loudness_key(extract_youtube_id(song.get('url')), song['start'])
+        return (path, offset, duration, loudness_gain(key, path, offset, SONG_SECONDS))
+
+    def snippet_task(i, snippet):
+        snippet_id = resolve_snippet(snippet, snippet_memo)
+        # Renderers normalize while decoding, so use the original upload (no extra encode).
+        cached = lookup_snippet_source(snippet_id) if snippet_id else None
+        if not cached:
+            raise ValueError("snippet could not be resolved")
+        snippet_src = job_dir / f"snippet_{i:03d}_upload"
+        link_or_copy(cached, snippet_src)
+        return (snippet_src, None, None, loudness_gain(f"snippet:{snippet_id}", snippet_src))
+
+    def effect_task(effect):
+        effect_path = effect_source_path(effect)
+        if not effect_path:
+            raise ValueError(f"unknown effect {effect!r}")
+        return (effect_path, None, None, loudness_gain(effect_loudness_key(effect_path), effect_path))
+
+    pipelines = {}
+    for i, item in enumerate(timeline):
+        if item.get('type') == 'song' and 'song' in item:
+            # Analysis (first use of a window only) is CPU work, so it runs on the cpu lane.
+            pipelines[i] = [("net", functools.partial(song_task, item['song'])),
+                            ("cpu", functools.partial(song_gain, item['song']))]
+        elif item.get('type') == 'snippet' and 'snippet' in item:
+            pipelines[i] = [("cpu", functools.partial(snippet_task, i, item['snippet']))]
+        elif item.get('type') == 'effect' and 'effect' in item:
+            pipelines[i] = [("cpu", functools.partial(effect_task, item['effect']))]
+    return pipelines
+
+def _in_timeline_order(timeline, results: dict) -> list:
+    """[(index, result)] for the items that succeeded, logging the ones that didn't."""
+    ordered = []
+    for i in range(len(timeline)):
+        if i in results:
+            ordered.append((i, results[i]))
+        else:
+            print(f"Skipping item {i} due to processing error", file=sys.stderr)
+    if not ordered:
+        raise RuntimeError("No timeline items could be rendered")
+    return ordered
+
+def _resolve_sources(timeline, job_dir: Path, report, song_seconds: int = SONG_SECONDS) -> list:
+    """Resolve every item to (index, (path, start, duration, gain_db)) in timeline order, skipping failures."""
+    results = _run_pipelines(job_dir.name, _source_pipelines(timeline, job_dir, song_seconds), report)
+    return _in_timeline_order(timeline, results)
+
+def _render_single_pass(timeline, job_dir: Path, output_file: Path, report, profile: OutputProfile,
+                        song_seconds: int = SONG_SECONDS):
+    """Resolve each item to a source file, then trim/normalize/concat in a single ffmpeg run."""
+    sources = [source for _, source in _resolve_sources(timeline, job_dir, report, song_seconds)]
+    report("concatenating", len(sources), len(timeline))
+    with tracing.span("concat", tool="ffmpeg"):
+        subprocess.run(build_single_pass_command(sources, output_file, profile), check=True, timeout=FFMPEG_TIMEOUT)
+
+def _render_pcm(timeline, job_dir: Path, output_file: Path, report, profile: OutputProfile,
+                song_seconds: int = SONG_SECONDS, crossfade=0.0, normalize=False):
+    """Decode every item to float32 PCM, assemble the mix with NumPy, and encode it once.
+
+    Decoded items and the mix are memory-mapped files in job_dir, so long timelines don't
+    need the whole mix in RAM. Effects with `"overlay": true` play over the end of the
+    previous item; `crossfade` seconds blend consecutive items.
+    """
+    import numpy as np
+    import pcm_mixer
+
+    def decode_task(dest, source):
+        path, start, duration, gain = source
+        with tracing.span("decode", tool="ffmpeg"):
+            return pcm_mixer.decode_to_pcm(path, dest, start, duration, timeout=FFMPEG_TIMEOUT), gain
+
+    # Each item decodes as soon as it is resolved, rather than after every download is done.
+    pipelines = _source_pipelines(timeline, job_dir, song_seconds)
+    for i, steps in pipelines.items():
+        steps.append(("cpu", functools.partial(decode_task, job_dir / f"item_{i:03d}.f32")))
+    decoded = _in_timeline_order(timeline, _run_pipelines(job_dir.name, pipelines, report))
+    clips = [pcm_mixer.Clip(pcm, overlay=bool(timeline[i].get('overlay')) and timeline[i].get('type') == 'effect',
+                            gain=10 ** (gain / 20))
+             for i, (pcm, gain) in decoded]
+    crossfade_frames = int(float(crossfade) * pcm_mixer.SAMPLE_RATE)
+    frames = pcm_mixer.mix_length(clips, crossfade_frames)
+    if frames == 0:
+        raise RuntimeError("No audio could be decoded from the timeline")
+    report("concatenating", len(decoded), len(timeline))
+    mix = np.memmap(job_dir / "mix.f32", dtype=np.float32, mode="w+", shape=(frames, pcm_mixer.CHANNELS))
+    with tracing.span("mix"):
+        pcm_mixer.assemble(clips, mix, crossfade_frames)
+        if normalize:
+            pcm_mixer.normalize_peak(mix)
+    with tracing.span("encode", tool="ffmpeg"):
+        pcm_mixer.encode_pcm(mix, output_file, profile.output_args, timeout=FFMPEG_TIMEOUT)
+
+def batch_requests(batch_input) -> list:
+    """Expand a batch body into one render request per timeline.
+
+    Accepts a list, or `{"timelines": [...], ...settings}` whose other keys (renderMode,
+    shuffleStarts, ...) apply to every timeline. Each entry is a request dict or a bare
+    timeline list. Raises ValueError if the shape is wrong.
+    """
+    defaults = {}
+    if isinstance(batch_input, dict):
+        defaults = {k: v for k, v in batch_input.items() if k != "timelines"}
+        batch_input = batch_input.get("timelines")
+    if not isinstance(batch_input, list) or not batch_input:
+        raise ValueError("timelines must be a non-empty list")
+    requests = []
+    for entry in batch_input:
+        entry = {"timeline": entry} if isinstance(entry, list) else entry
+        if not isinstance(entry, dict) or not isinstance(entry.get("timeline"), list):
+            raise ValueError("each batch entry must be a timeline list or an object with a timeline")
+        requests.append({**defaults, **entry})
+    return requests
+
+def run_batch(datas: list) -> dict:
+    """Render several requests as one batch in this process; returns the batch report."""
+    queue = JobQueue(lambda data, job_id, progress: process_audio(data, job_id=job_id, progress=progress),
+                     max_queued=len(datas))
+    try:
+        batch_id, _ = queue.submit_batch(datas, prepare_batch)
+        batch = queue.wait_batch(batch_id)
+    finally:
+        queue.shutdown()
+    for job in batch["jobs"]:
+        output = find_output(job["jobId"]) if job["status"] == "done" else None
+        job["output"] = str(output) if output else None
+    return batch
+
+def run_worker():
+    """Render jobs from the shared queue at JOB_QUEUE_DB until interrupted."""
+    worker = QueueWorker(SharedJobQueue(JOB_QUEUE_DB),
+                         lambda data, job_id, progress: process_audio(data, job_id=job_id, progress=progress),
+                         prepare_batch)
+    threading.Thread(target=prepare_effects, name='prepare-effects', daemon=True).start()
+    CACHE.start_janitor(CACHE_JANITOR_INTERVAL)
+    print(f"Worker {worker.name} rendering jobs from {JOB_QUEUE_DB}", file=sys.stderr)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <input.json>")
+    if len(sys.argv) < 2 or (sys.argv[1] in ("--batch", "--draft") and len(sys.argv) < 3):
+        print("Usage: python main.py [--draft] <input.json>\n       python main.py --batch <batch.json>\n"
+              "       JOB_QUEUE_DB=<queue.db> python main.py --worker")
         sys.exit(1)
-    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    if sys.argv[1] == "--worker":
+        if not JOB_QUEUE_DB:
+            print("--worker needs JOB_QUEUE_DB set to the shared queue file", file=sys.stderr)
+            sys.exit(1)
+        run_worker()
+        sys.exit(0)
+    if sys.argv[1] == "--batch":
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            report = run_batch(batch_requests(json.load(f)))
+        print(json.dumps(report, indent=2))
+        CACHE.collect()
+        sys.exit(0 if report["report"]["failed"] == 0 else 1)
+    draft = sys.argv[1] == "--draft"
+    with open(sys.argv[2] if draft else sys.argv[1], 'r', encoding='utf-8') as f:
         data = json.load(f)
-    output_path = process_audio(data)
-    print(output_path) 
\ No newline at end of file
+    job_id = str(uuid.uuid4())
+    output_path = process_audio({**data, "draft": True} if draft else data, job_id=job_id)
+    print(output_path)
+    if draft:
+        print(f'Full render with the same starts: add "previousJobId": "{job_id}" to the input', file=sys.stderr)
+    # No janitor thread in one-shot mode: enforce the cache budgets before exiting.
+    CACHE.collect()
@@ -0,0 +1,125 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, the index is last-writer-wins there.
+    fcntl = None
+
+
+class MetadataStore:
+    """Persistent JSON index mapping a YouTube video id to its duration, title and format info.
+
+    Reads are served from memory; every write is flushed to disk with an atomic replace so
+    the index survives restarts and is never left half-written. Several processes may share
+    one index: a write reloads the file under an exclusive lock and applies its change to
+    that, so no process overwrites another's entries, and reads reload it once it changed.
+    """
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._stamp = self._disk_stamp()
+        self._entries: dict[str, dict] = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, video_id: str) -> Optional[dict]:
+        with self._lock:
+            self._refresh_locked()
+            entry = self._entries.get(video_id)
+            return dict(entry) if entry is not None else None
+
+    def put(self, video_id: str, info: dict):
+        self.put_many({video_id: info})
+
+    def put_many(self, infos: dict):
+        """Merge {video_id: info} into the index and persist it."""
+        if not infos:
+            return
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            for video_id, info in infos.items():
+                entry = self._entries.setdefault(video_id, {})
+                entry.update({k: v for k, v in info.items() if v is not None})
+                entry['updatedAt'] = time.time()
+            self._flush_locked()
+
+    def increment(self, video_ids, field: str = 'requests'):
+        """Add one to `field` for each video id (repeats count repeatedly), with a single flush."""
+        video_ids = list(video_ids)
+        if not video_ids:
+            return
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            for video_id in video_ids:
+                entry = self._entries.setdefault(video_id, {})
+                entry[field] = entry.get(field, 0) + 1
+            self._flush_locked()
+
+    def pop_field(self, video_id: str, field: str):
+        """Remove `field` from a video's entry and return its value (None if it was not set)."""
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            entry = self._entries.get(video_id)
+            if entry is None or field not in entry:
+                return None
+            value = entry.pop(field)
+            self._flush_locked()
+            return value
+
+    def __contains__(self, video_id) -> bool:
+        with self._lock:
+            self._refresh_locked()
+            return video_id in self._entries
+
+    def _disk_stamp(self):
+        """Identity of the index file on disk; every atomic replace changes it."""
+        try:
+            st = self._path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh_locked(self):
+        """Reload the index if another process (or instance) has replaced it since we read it."""
+        stamp = self._disk_stamp()
+        if stamp != self._stamp:
+            self._entries = self._load()
+            self._stamp = stamp
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path.with_suffix('.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _flush_locked(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_suffix(f'.{uuid.uuid4().hex}.partial')
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self._path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self._stamp = self._disk_stamp()
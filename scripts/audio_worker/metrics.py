@@ -0,0 +1,151 @@
+import bisect
+import math
+import threading
+
+# Default buckets (seconds) for stage and job durations: sub-second cache hits up to long renders.
+TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Buckets (bytes) for downloaded audio: a short section is ~1 MB, a full track tens of MB.
+BYTE_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+# Buckets for per-job subprocess counts (timelines run from a handful to 500 items).
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    def __init__(self, name: str, help: str, buckets=TIME_BUCKETS, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._series: dict = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(tuple(str(labels[name]) for name in self.labels))
+            return series["count"] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series["counts"]):
+                    cumulative += n
+                    le = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    """A set of metrics plus collector callbacks, rendered together for /metrics.
+
+    Collectors return extra exposition lines computed at scrape time (e.g. cache sizes).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: list = []
+        self._collectors: list = []
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets=TIME_BUCKETS, labels=()) -> Histogram:
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def add_collector(self, collect):
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+def gauge_lines(name: str, help: str, samples, labels=()) -> list:
+    """Exposition lines for a gauge computed at scrape time; samples are (label values, value)."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for key, value in samples:
+        lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+    return lines
+
+
+REGISTRY = Registry()
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "club100_queue_wait_seconds", "Time jobs spent queued before a worker picked them up.")
+RENDER_SECONDS = REGISTRY.histogram(
+    "club100_render_seconds", "Wall time of a job's render, by outcome.", labels=("status",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "club100_stage_seconds", "Wall time of individual pipeline stages.", labels=("stage",))
+DOWNLOAD_BYTES = REGISTRY.histogram(
+    "club100_download_bytes", "Size of each audio download.", buckets=BYTE_BUCKETS)
+JOB_SUBPROCESSES = REGISTRY.histogram(
+    "club100_job_subprocesses", "External processes (ffmpeg, yt-dlp) spawned per job.", buckets=COUNT_BUCKETS)
+SUBPROCESSES_TOTAL = REGISTRY.counter(
+    "club100_subprocesses_total", "External processes spawned, by tool.", labels=("tool",))
+SEARCH_LOOKUPS = REGISTRY.counter(
+    "club100_search_lookups_total", "/ytsearch requests, by how the search cache answered them.",
+    labels=("source",))
@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """How a mix (and every per-item file it is assembled from) is encoded.
+
+    Items are encoded with exactly `output_args`, so a mix whose items all share a profile can
+    be concatenated with stream copy instead of being encoded a second time. Every format
+    here is a plain sequence of self-contained frames (no index at the end of the file), so a
+    rendering mix can also be streamed while it is written.
+    """
+    name: str
+    extension: str
+    mime_type: str
+    sample_rate: int
+    muxer: str
+    # Part of every per-item cache key, so files encoded for one profile never serve another.
+    codec_args: tuple
+    # Whether files in this format still form a valid stream when appended byte for byte
+    # (bare frame sequences), so a mix can be streamed item by item while it is assembled.
+    appendable: bool = False
+
+    @property
+    def output_args(self) -> list:
+        return [*self.codec_args, "-f", self.muxer]
+
+    @property
+    def cache_suffix(self) -> str:
+        """Suffix of per-item cache files; the name tells profiles sharing an extension apart."""
+        return self.extension if self.name == self.extension else f"{self.name}.{self.extension}"
+
+
+PROFILES = {p.name: p for p in (
+    # The historical format; its codec args are unchanged so existing caches stay valid.
+    OutputProfile("mp3", "mp3", "audio/mpeg", 44100, "mp3",
+                  ("-ar", "44100", "-ac", "2", "-codec:a", "libmp3lame", "-b:a", "192k"), appendable=True),
+    OutputProfile("mp3_vbr", "mp3", "audio/mpeg", 44100, "mp3",
+                  ("-ar", "44100", "-ac", "2", "-codec:a", "libmp3lame", "-q:a", "2"), appendable=True),
+    # Raw ADTS rather than .m4a: an MP4 is unplayable until its index is written at the end.
+    OutputProfile("aac", "aac", "audio/aac", 44100, "adts",
+                  ("-ar", "44100", "-ac", "2", "-codec:a", "aac", "-b:a", "192k"), appendable=True),
+    OutputProfile("opus", "opus", "audio/ogg", 48000, "ogg",
+                  ("-ar", "48000", "-ac", "2", "-codec:a", "libopus", "-b:a", "128k")),
+)}
+
+# Draft previews: mono, low rate and bitrate, a fraction of the encode work and size.
+DRAFT_PROFILE = OutputProfile("draft", "mp3", "audio/mpeg", 22050, "mp3",
+                              ("-ar", "22050", "-ac", "1", "-codec:a", "libmp3lame", "-b:a", "48k"), appendable=True)
+
+# Distinct output file extensions, for finding a job's mix without knowing its profile.
+OUTPUT_EXTENSIONS = tuple(dict.fromkeys(p.extension for p in PROFILES.values()))
+
+
+def get_profile(name: str) -> OutputProfile:
+    """The profile called name; raises ValueError for unknown names."""
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown output profile: {name!r}") from None
+
+
+# MPEG audio Layer III bitrates (kbit/s) by bitrate index, for MPEG-1 and for MPEG-2/2.5.
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = (44100, 48000, 32000)
+
+
+def audio_offset(profile: OutputProfile, f) -> int:
+    """Where the audio frames begin in the open (binary, seekable) file f of profile.
+
+    ffmpeg starts MP3 files with an ID3v2 tag and a Xing/Info frame that holds the length of
+    that one file; both are skipped so that appended files read as one continuous stream.
+    """
+    if profile.muxer != "mp3":
+        return 0
+    f.seek(0)
+    head = f.read(10)
+    offset = 0
+    if len(head) == 10 and head.startswith(b"ID3"):
+        size = (head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | (head[8] & 0x7f) << 7 | (head[9] & 0x7f)
+        offset = 10 + size + (10 if head[5] & 0x10 else 0)
+    f.seek(offset)
+    return offset + _info_frame_length(f.read(64))
+
+
+def _info_frame_length(frame: bytes) -> int:
+    """Length of the Xing/Info frame at the start of frame, or 0 if it starts with an audio frame."""
+    if len(frame) < 4 or frame[0] != 0xff or frame[1] & 0xe6 != 0xe2:
+        return 0  # Not a Layer III frame header.
+    version = (frame[1] >> 3) & 3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    bitrate_index, rate_index = frame[2] >> 4, (frame[2] >> 2) & 3
+    if version == 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0
+    mpeg1, mono = version == 3, frame[3] >> 6 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    if frame[4 + side_info:8 + side_info] not in (b"Xing", b"Info"):
+        return 0
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[rate_index] >> {3: 0, 2: 1, 0: 2}[version]
+    padding = (frame[2] >> 1) & 1
+    return (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+
+def mime_type_for(path) -> str:
+    """Content type to serve an output file with, by its extension."""
+    extension = str(path).rsplit(".", 1)[-1]
+    for profile in PROFILES.values():
+        if profile.extension == extension:
+            return profile.mime_type
+    return "application/octet-stream"
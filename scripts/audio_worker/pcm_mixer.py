@@ -0,0 +1,111 @@
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# Frames handed to the encoder per write, so a memory-mapped mix is streamed, not loaded.
+ENCODE_CHUNK_FRAMES = SAMPLE_RATE * 10
+
+
+@dataclass
+class Clip:
+    """One decoded timeline item: float32 PCM shaped (frames, CHANNELS).
+
+    An `overlay` clip is mixed on top of the end of what came before it (e.g. an airhorn
+    over the last second of a song) instead of being appended after it. `gain` is a linear
+    factor applied as the clip is laid out (its loudness normalization).
+    """
+    pcm: np.ndarray
+    overlay: bool = False
+    gain: float = 1.0
+
+
+def decode_to_pcm(source: Path, dest: Path, start=None, duration=None, timeout=None) -> np.ndarray:
+    """Decode (a window of) source into a raw float32 file and memory-map it read-only."""
+    cmd = ["ffmpeg", "-y"]
+    if start is not None:
+        cmd += ["-ss", str(start)]
+    if duration is not None:
+        cmd += ["-t", str(duration)]
+    cmd += ["-i", str(source), "-f", "f32le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), str(dest)]
+    subprocess.run(cmd, check=True, capture_output=True, timeout=timeout)
+    if dest.stat().st_size == 0:
+        return np.zeros((0, CHANNELS), dtype=np.float32)
+    return np.memmap(dest, dtype=np.float32, mode="r").reshape(-1, CHANNELS)
+
+
+def mix_length(clips, crossfade_frames: int = 0) -> int:
+    """Number of frames assemble() produces for these clips."""
+    total = 0
+    for clip in clips:
+        frames = len(clip.pcm)
+        if clip.overlay:
+            total = max(total, frames)
+        elif total == 0:
+            total = frames
+        else:
+            total += frames - min(crossfade_frames, frames, total)
+    return total
+
+
+def assemble(clips, out: np.ndarray, crossfade_frames: int = 0) -> np.ndarray:
+    """Lay clips out end to end into `out` (zeroed, shaped (mix_length(...), CHANNELS)).
+
+    Consecutive clips overlap by `crossfade_frames` with a linear fade; overlay clips are
+    summed over the tail of the mix so far. Everything is vectorized per clip.
+    """
+    cursor = 0
+    for clip in clips:
+        pcm = clip.pcm
+        frames = len(pcm)
+        if frames == 0:
+            continue
+        gain = np.float32(clip.gain)
+        if clip.overlay:
+            begin = max(0, cursor - frames)
+            out[begin:begin + frames] += pcm * gain
+            cursor = max(cursor, begin + frames)
+            continue
+        fade = min(crossfade_frames, frames, cursor)
+        begin = cursor - fade
+        if fade:
+            ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+            out[begin:cursor] *= 1.0 - ramp
+            out[begin:cursor] += pcm[:fade] * (ramp * gain)
+        out[cursor:begin + frames] = pcm[fade:] * gain
+        cursor = begin + frames
+    return out
+
+
+def normalize_peak(pcm: np.ndarray, target_dbfs: float = -1.0, chunk_frames: int = ENCODE_CHUNK_FRAMES):
+    """Scale the mix in place so its peak sits at target_dbfs (chunked, so memmaps stay paged)."""
+    peak = 0.0
+    for n in range(0, len(pcm), chunk_frames):
+        peak = max(peak, float(np.abs(pcm[n:n + chunk_frames]).max(initial=0.0)))
+    if peak > 0:
+        gain = np.float32(10 ** (target_dbfs / 20) / peak)
+        for n in range(0, len(pcm), chunk_frames):
+            pcm[n:n + chunk_frames] *= gain
+    return pcm
+
+
+def encode_pcm(pcm: np.ndarray, output_path: Path, encode_args, timeout=None):
+    """Encode float32 PCM to output_path with a single ffmpeg run fed through stdin."""
+    # Errors only and no progress stats, so the stderr pipe can't fill up while we write stdin.
+    cmd = ["ffmpeg", "-y", "-v", "error", "-nostats", "-f", "f32le", "-ac", str(CHANNELS),
+           "-ar", str(SAMPLE_RATE), "-i", "pipe:0", *encode_args, str(output_path)]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for n in range(0, len(pcm), ENCODE_CHUNK_FRAMES):
+            chunk = np.clip(pcm[n:n + ENCODE_CHUNK_FRAMES], -1.0, 1.0)
+            proc.stdin.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+        _, stderr = proc.communicate(timeout=timeout)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
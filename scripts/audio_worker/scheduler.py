@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import concurrent.futures
+import contextvars
+from collections import deque
+
+# Network-bound work (yt-dlp probes and downloads) mostly waits on I/O, so it gets more threads.
+NET_WORKERS = int(os.environ.get("NET_WORKERS", "8"))
+# CPU-bound work (ffmpeg encodes/decodes) is sized to the machine.
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(os.cpu_count() or 2)))
+
+# Background work (cache warm-up) only runs when no render job has a task waiting in that lane.
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = 1
+
+
+class _Lane:
+    """A fixed set of worker threads fed from per-job FIFO queues, served round-robin.
+
+    Round-robin across jobs means a 500-item timeline gets one turn per cycle like a
+    5-item one, instead of every task it queued running before the small job's first.
+    PRIORITY_LOW tasks are only picked when no PRIORITY_NORMAL task is waiting.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self._cond = threading.Condition()
+        # One (queues by job, round-robin order) pair per priority, highest priority first.
+        self._tiers = {priority: ({}, deque()) for priority in (PRIORITY_NORMAL, PRIORITY_LOW)}
+        self._threads = [
+            threading.Thread(target=self._work, name=f"club100-{name}-{n}", daemon=True)
+            for n in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, job_key, fn, *args, priority: int = PRIORITY_NORMAL) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        queues, order = self._tiers[priority]
+        with self._cond:
+            queue = queues.get(job_key)
+            if queue is None:
+                queue = queues[job_key] = deque()
+                order.append(job_key)
+            # Run the task in a copy of the submitter's context, so per-job state (the job's
+            # trace) follows the work onto the worker thread.
+            queue.append((future, contextvars.copy_context(), fn, args))
+            self._cond.notify()
+        return future
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(q) for queues, _ in self._tiers.values() for q in queues.values())
+
+    def _next_locked(self):
+        for queues, order in self._tiers.values():
+            if not order:
+                continue
+            job_key = order.popleft()
+            queue = queues[job_key]
+            task = queue.popleft()
+            if queue:
+                order.append(job_key)
+            else:
+                del queues[job_key]
+            return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = self._next_locked()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next_locked()
+                future, context, fn, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(context.run(fn, *args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+class Scheduler:
+    """Process-wide scheduler with separate network-bound ("net") and CPU-bound ("cpu") lanes.
+
+    Every job shares the same threads, so concurrent jobs compete fairly for a bounded pool
+    instead of each spawning its own. `then()` chains a cpu task onto a net task so an
+    item's encode starts as soon as its own download finishes.
+    """
+
+    def __init__(self, net_workers: int = NET_WORKERS, cpu_workers: int = CPU_WORKERS):
+        self.lanes = {"net": _Lane("net", net_workers), "cpu": _Lane("cpu", cpu_workers)}
+
+    def submit(self, lane: str, job_key, fn, *args, priority: int = PRIORITY_NORMAL) -> concurrent.futures.Future:
+        return self.lanes[lane].submit(job_key, fn, *args, priority=priority)
+
+    def then(self, upstream: concurrent.futures.Future, lane: str, job_key, fn,
+             priority: int = PRIORITY_NORMAL) -> concurrent.futures.Future:
+        """Queue fn(upstream's result) on `lane` the moment upstream succeeds; one future for both.
+
+        If upstream fails, fn never runs and the returned future carries the same exception.
+        """
+        result = concurrent.futures.Future()
+        context = contextvars.copy_context()
+
+        def after_upstream(done):
+            try:
+                value = done.result()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            future = context.run(self.submit, lane, job_key, fn, value, priority=priority)
+            future.add_done_callback(_copy_outcome(result))
+
+        upstream.add_done_callback(after_upstream)
+        return result
+
+    def stats(self) -> dict:
+        return {name: {"pending": lane.pending()} for name, lane in self.lanes.items()}
+
+
+def _copy_outcome(target: concurrent.futures.Future):
+    def copy(source: concurrent.futures.Future):
+        try:
+            target.set_result(source.result())
+        except BaseException as e:
+            target.set_exception(e)
+    return copy
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """The shared process-wide scheduler, created on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+            print(f"Scheduler started: {NET_WORKERS} net / {CPU_WORKERS} cpu workers", file=sys.stderr)
+        return _default
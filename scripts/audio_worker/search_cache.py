@@ -0,0 +1,147 @@
+import bisect
+import collections
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from singleflight import SingleFlight
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a search query, used as the cache key."""
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+class SearchCache:
+    """Shared, persistent cache of YouTube search results in front of the search engine.
+
+    Entries live for `ttl` seconds and the least recently used are dropped beyond
+    `max_entries`. A query is answered, in order of preference, from its own entry, from the
+    entry of a longer cached query it is a prefix of (so the search box's intermediate
+    keystrokes reuse finished searches), or by one engine call shared by every concurrent
+    request for the same normalized query. The index is persisted with an atomic replace so
+    it survives restarts.
+    """
+
+    def __init__(self, path: Path, ttl: float, max_entries: int, prefix_min_chars: int = 3):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._prefix_min_chars = prefix_min_chars
+        self._lock = threading.Lock()
+        self._inflight = SingleFlight()
+        # Query -> {"results", "fetchedAt"}, least recently used first; plus the keys sorted,
+        # so every cached query starting with a prefix is one contiguous bisect range.
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._sorted: list = []
+        self._load()
+
+    def search(self, query: str, fetch) -> tuple:
+        """Return (results, source) for query; source is "hit", "prefix", "miss" or "shared".
+
+        `fetch(normalized_query)` runs the real search on a miss; its errors are not cached.
+        """
+        key = normalize_query(query)
+        cached = self.get(key)
+        if cached is not None:
+            return cached, "hit"
+        cached = self.get_prefix(key)
+        if cached is not None:
+            return cached, "prefix"
+        led = []
+
+        def lead():
+            led.append(True)
+            return self._fill(key, fetch)
+
+        results = self._inflight.do(key, lead)
+        return results, "miss" if led else "shared"
+
+    def get(self, key: str) -> Optional[list]:
+        """Fresh results cached for exactly this normalized query (marking it used), or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now - entry["fetchedAt"] > self._ttl:
+                self._drop_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            return list(entry["results"])
+
+    def get_prefix(self, key: str) -> Optional[list]:
+        """Results of the shortest fresh cached query that starts with `key`, or None."""
+        if len(key) < self._prefix_min_chars:
+            return None
+        now = time.time()
+        with self._lock:
+            best = None
+            for candidate in self._sorted[bisect.bisect_left(self._sorted, key):]:
+                if not candidate.startswith(key):
+                    break
+                if now - self._entries[candidate]["fetchedAt"] > self._ttl:
+                    continue
+                if best is None or len(candidate) < len(best):
+                    best = candidate
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            return list(self._entries[best]["results"])
+
+    def put(self, key: str, results: list):
+        with self._lock:
+            if key not in self._entries:
+                bisect.insort(self._sorted, key)
+            self._entries[key] = {"results": list(results), "fetchedAt": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._drop_locked(next(iter(self._entries)))
+            self._flush_locked()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _fill(self, key: str, fetch) -> list:
+        # A flight that finished just before this one started may already have stored it.
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        results = fetch(key)
+        self.put(key, results)
+        return results
+
+    def _drop_locked(self, key: str):
+        del self._entries[key]
+        del self._sorted[bisect.bisect_left(self._sorted, key)]
+
+    def _load(self):
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if not isinstance(data, list):
+            return
+        now = time.time()
+        # Stored least recently used first, so the LRU order survives a restart.
+        for key, entry in data:
+            if now - entry.get("fetchedAt", 0) <= self._ttl:
+                self._entries[key] = entry
+        self._sorted = sorted(self._entries)
+
+    def _flush_locked(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_suffix(f".{uuid.uuid4().hex}.partial")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp, self._path)
+        finally:
+            tmp.unlink(missing_ok=True)
@@ -1,11 +1,24 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask import send_from_directory
+import json
 import os
 import re
-import subprocess
-import traceback
+import threading
+import time
 import pathlib
-from main import process_audio, EFFECTS
+from main import (
+    process_audio, EFFECTS, RENDER_MODES, YTDLP, DEFAULT_PROFILE, find_output,
+    open_snippet_writer, lookup_snippet_source, is_valid_snippet_id, prepare_effects,
+    CACHE, CACHE_DIR, CACHE_JANITOR_INTERVAL, prefetch_songs, batch_requests, prepare_batch,
+)
+from ingest import BodyTooLargeError, copy_stream, read_json_with_snippets, snippet_id_from_marker
+from jobs import JobQueue, QueueFullError
+from output_profiles import PROFILES, mime_type_for
+from metrics import REGISTRY, SEARCH_LOOKUPS, gauge_lines
+from scheduler import get_scheduler
+from search_cache import SearchCache
+from shared_queue import JOB_QUEUE_DB, SharedJobQueue
+import tracing
 from flask_cors import CORS
 
 app = Flask(__name__)
@@ -16,9 +29,54 @@ CORS(app, origins=ALLOWED_ORIGINS)
 
 # Cap request body size (uploaded snippets arrive as base64 data URLs).
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', str(100 * 1024 * 1024)))
+# JSON bodies are read as a stream: inline base64 snippet audio is decoded straight into the
+# snippet cache, and only the rest of the document (capped at JSON_MAX_BYTES) is kept in memory.
+JSON_MAX_BYTES = int(os.environ.get('JSON_MAX_BYTES', str(8 * 1024 * 1024)))
 
 EFFECTS_DIR = pathlib.Path(__file__).parent / 'effects'
 
+# How often /stream checks a rendering job's output for new bytes, and the chunk size it sends.
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', '0.25'))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Upper bound on songs per /prefetch call (a Club 100 timeline is ~100 songs).
+PREFETCH_MAX_SONGS = int(os.environ.get('PREFETCH_MAX_SONGS', '500'))
+# Upper bound on timelines per /generate/batch call (each becomes one job).
+BATCH_MAX_TIMELINES = int(os.environ.get('BATCH_MAX_TIMELINES', '20'))
+
+# Server-side /ytsearch cache shared by every client: results live SEARCH_CACHE_TTL seconds,
+# at most SEARCH_CACHE_MAX_ENTRIES queries are kept (least recently used dropped first), and
+# queries of at least SEARCH_PREFIX_MIN_CHARS characters are answered from a cached longer
+# query they are a prefix of.
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', str(6 * 3600)))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '5000'))
+SEARCH_PREFIX_MIN_CHARS = int(os.environ.get('SEARCH_PREFIX_MIN_CHARS', '3'))
+SEARCH_RESULTS = 5
+SEARCH_TIMEOUT = 120
+
+SEARCH_CACHE = SearchCache(CACHE_DIR / 'index' / 'search.json', SEARCH_CACHE_TTL,
+                           SEARCH_CACHE_MAX_ENTRIES, SEARCH_PREFIX_MIN_CHARS)
+
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_tasks():
+    """Start effect pre-normalization and the cache janitor, once per process."""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    # Normalize the effect library in the background; items fall back to lazy normalization.
+    threading.Thread(target=prepare_effects, name='prepare-effects', daemon=True).start()
+    # Cache budgets and output retention are enforced off the request path.
+    CACHE.start_janitor(CACHE_JANITOR_INTERVAL)
+
+@app.before_request
+def _ensure_background_tasks():
+    # On first use rather than only in __main__, so `flask run` and WSGI servers get them too.
+    start_background_tasks()
+
 def build_timeline_from_legacy(data):
     """Convert legacy youtubeUrls/snippets format to timeline format."""
     timeline = []
@@ -43,24 +101,194 @@ def serve_effect(filename):
     """Serve an effect audio file by filename."""
     return send_from_directory(EFFECTS_DIR, filename)
 
+def _render_job(data, job_id, progress):
+    return process_audio(data, job_id=job_id, progress=progress)
+
+# With JOB_QUEUE_DB set this server only enqueues; `python main.py --worker` processes render.
+jobs = SharedJobQueue(JOB_QUEUE_DB) if JOB_QUEUE_DB else JobQueue(_render_job)
+
+def _unknown_snippet_ids(timeline):
+    """Snippet ids referenced by the timeline that are not in the snippet cache."""
+    missing = []
+    for item in timeline:
+        snippet = item.get('snippet') if isinstance(item, dict) else None
+        if isinstance(snippet, dict) and snippet.get('snippetId'):
+            if lookup_snippet_source(snippet['snippetId']) is None:
+                missing.append(snippet['snippetId'])
+    return missing
+
+def _read_json_body():
+    """Parse a JSON request body, streaming inline data URLs into the snippet cache.
+
+    Snippets that inlined an `audioUrl` come back with a `snippetId` instead. Returns None if
+    the body is not valid JSON; raises BodyTooLargeError past JSON_MAX_BYTES.
+    """
+    try:
+        text = read_json_with_snippets(request.stream, open_snippet_writer, JSON_MAX_BYTES)
+        data = json.loads(text)
+    except BodyTooLargeError:
+        raise
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        # Timeline snippets (of the request or of each batch entry), or the legacy `snippets` list.
+        timelines = [data.get('timeline')]
+        if isinstance(data.get('timelines'), list):
+            timelines += [t.get('timeline') if isinstance(t, dict) else t for t in data['timelines']]
+        snippets = [item.get('snippet') for timeline in timelines if isinstance(timeline, list)
+                    for item in timeline if isinstance(item, dict)]
+        if isinstance(data.get('snippets'), list):
+            snippets += data['snippets']
+        for snippet in snippets:
+            if isinstance(snippet, dict) and snippet_id_from_marker(snippet.get('audioUrl')):
+                snippet['snippetId'] = snippet_id_from_marker(snippet.pop('audioUrl'))
+    return data
+
+@app.errorhandler(BodyTooLargeError)
+def body_too_large(e):
+    return jsonify({"error": str(e)}), 413
+
+@app.route('/snippets', methods=['POST'])
+def upload_snippet():
+    """Store an uploaded snippet once and return a handle the timeline can reference.
+
+    Accepts a multipart `file`, a JSON `{"audioUrl": "data:audio/...;base64,..."}`, or a raw
+    `audio/*` body. Identical audio always yields the same `snippetId`. The audio is written
+    to the cache in chunks as it is read, never held in memory whole.
+    """
+    if 'file' in request.files:
+        snippet_id = _store_stream(request.files['file'].stream)
+    elif request.is_json:
+        data = _read_json_body()
+        if data is None:
+            return jsonify({"error": "audioUrl is not valid base64"}), 400
+        audio_url = data.get('audioUrl') if isinstance(data, dict) else None
+        snippet_id = snippet_id_from_marker(audio_url)
+        if snippet_id is None:
+            return jsonify({"error": "Missing audioUrl"}), 400
+        # Streamed audio is already stored; a client could also send the marker text itself.
+        if not is_valid_snippet_id(snippet_id):
+            return jsonify({"error": "Invalid snippet id"}), 400
+        if lookup_snippet_source(snippet_id) is None:
+            return jsonify({"error": "Snippet not found"}), 404
+    elif (request.mimetype or '').startswith('audio/'):
+        snippet_id = _store_stream(request.stream)
+    else:
+        return jsonify({"error": "Expected a multipart file, JSON audioUrl or audio/* body"}), 400
+    if snippet_id is None:
+        return jsonify({"error": "Empty snippet"}), 400
+    return jsonify({"snippetId": snippet_id}), 201
+
+def _store_stream(stream):
+    """Copy an upload into the snippet cache; returns its snippet id, or None if it was empty."""
+    with open_snippet_writer() as writer:
+        copy_stream(stream, writer)
+        if writer.size == 0:
+            writer.abort()
+            return None
+        return writer.commit()
+
 @app.route('/generate', methods=['POST'])
 def generate():
-    """Generate audio from a timeline or legacy format."""
-    data = request.get_json(silent=True)
+    """Queue audio generation from a timeline or legacy format; returns a job ID immediately."""
+    data = _read_json_body() if request.is_json else None
     if not isinstance(data, dict):
         return jsonify({"error": "Invalid or missing JSON body"}), 400
     if 'timeline' not in data:
         data['timeline'] = build_timeline_from_legacy(data)
+    invalid = _validate_request(data)
+    if invalid:
+        return invalid
     try:
-        output_path = process_audio(data)
-        if not output_path or not os.path.exists(output_path):
-            return jsonify({"error": "Audio generation failed, no output file was produced."}), 500
-        job_id = os.path.basename(output_path).replace('club100_', '').replace('.mp3', '')
-        return jsonify({"jobId": job_id})
-    except Exception as e:
-        # Log the full traceback server-side, but don't leak internals to the client.
-        print(traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        job_id = jobs.submit(data)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '30'}
+    return jsonify({"jobId": job_id, "status": "queued"}), 202
+
+def _validate_request(data):
+    """An error response for a render request that can't be queued, or None if it is fine."""
+    if data.get('renderMode') is not None and data['renderMode'] not in RENDER_MODES:
+        return jsonify({"error": f"renderMode must be one of {', '.join(RENDER_MODES)}"}), 400
+    if data.get('outputProfile') is not None and data['outputProfile'] not in PROFILES:
+        return jsonify({"error": f"outputProfile must be one of {', '.join(PROFILES)}"}), 400
+    if not isinstance(data.get('draft', False), bool):
+        return jsonify({"error": "draft must be true or false"}), 400
+    if not isinstance(data['timeline'], list):
+        return jsonify({"error": "timeline must be a list"}), 400
+    missing = _unknown_snippet_ids(data['timeline'])
+    if missing:
+        return jsonify({"error": "Unknown snippet ids, upload them to /snippets first", "snippetIds": missing}), 400
+    return None
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """Queue several timelines as one batch; their shared songs are fetched and trimmed once.
+
+    Body: `{"timelines": [timeline or request, ...], ...settings for all}`. Returns the batch id
+    and one job id per timeline (each also visible under /jobs/<id>); see /batches/<id>.
+    """
+    data = _read_json_body() if request.is_json else None
+    try:
+        requests = batch_requests(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(requests) > BATCH_MAX_TIMELINES:
+        return jsonify({"error": f"At most {BATCH_MAX_TIMELINES} timelines per batch"}), 400
+    for entry in requests:
+        invalid = _validate_request(entry)
+        if invalid:
+            return invalid
+    try:
+        batch_id, job_ids = jobs.submit_batch(requests, prepare_batch)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '30'}
+    return jsonify({"batchId": batch_id, "jobIds": job_ids, "status": "queued"}), 202
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Per-timeline job records, the shared-work plan and an aggregate throughput report."""
+    if not re.fullmatch(r'[0-9a-fA-F-]{36}', batch_id):
+        return jsonify({"error": "Invalid batch id"}), 400
+    batch = jobs.get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(batch)
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    """Warm the caches for songs ahead of /generate: `{"urls": [...]}` or `{"timeline": [...]}`."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid or missing JSON body"}), 400
+    if isinstance(data.get('urls'), list):
+        songs = [{'url': url} for url in data['urls']]
+    elif isinstance(data.get('timeline'), list):
+        songs = []
+        for i, item in enumerate(data['timeline']):
+            if isinstance(item, dict) and item.get('type') == 'song' and isinstance(item.get('song'), dict):
+                start = item['song'].get('start')
+                if start is not None and (isinstance(start, bool) or not isinstance(start, int)):
+                    return jsonify({"error": f"timeline[{i}].song.start must be an integer"}), 400
+                songs.append(item['song'])
+    else:
+        return jsonify({"error": "Provide urls or timeline as a list"}), 400
+    if len(songs) > PREFETCH_MAX_SONGS:
+        return jsonify({"error": f"At most {PREFETCH_MAX_SONGS} songs per request"}), 400
+    return jsonify({"queued": len(prefetch_songs(songs))}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report a job's status (queued/running/done/error) and per-item progress."""
+    if not re.fullmatch(r'[0-9a-fA-F-]{36}', job_id):
+        return jsonify({"error": "Invalid job id"}), 400
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] == 'queued':
+        job['queuePosition'] = jobs.position(job_id)
+    if job['status'] == 'done':
+        job['downloadUrl'] = f'/download/{job_id}'
+    return jsonify(job)
 
 @app.route('/download/<job_id>', methods=['GET'])
 def download(job_id):
@@ -68,48 +296,126 @@ def download(job_id):
     # job_id is a UUID; reject anything else to avoid path traversal.
     if not re.fullmatch(r'[0-9a-fA-F-]{36}', job_id):
         return jsonify({"error": "Invalid job id"}), 400
-    output_dir = os.path.join(os.path.dirname(__file__), 'output')
-    file_path = os.path.join(output_dir, f'club100_{job_id}.mp3')
-    if not os.path.exists(file_path):
+    file_path = find_output(job_id)
+    if file_path is None:
         return jsonify({"error": "File not found"}), 404
-    return send_file(file_path, as_attachment=True)
+    # conditional=True answers Range requests with 206 so browsers can seek.
+    return send_file(file_path, mimetype=mime_type_for(file_path), as_attachment=True, conditional=True)
+
+def _tail_render(job_id):
+    """Yield the job's mix as it is written, until the job finishes."""
+    f = None
+    try:
+        while f is None:
+            job = jobs.get(job_id)
+            for candidate in (find_output(job_id, partial=True), find_output(job_id)):
+                if candidate is None:
+                    continue
+                try:
+                    # Once opened, the handle survives the partial -> final rename.
+                    f = open(candidate, 'rb')
+                    break
+                except FileNotFoundError:
+                    pass
+            if f is None:
+                if job is None or job['status'] in ('done', 'error'):
+                    return
+                time.sleep(STREAM_POLL_INTERVAL)
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            job = jobs.get(job_id)
+            if job is None or job['status'] in ('done', 'error'):
+                rest = f.read()
+                if rest:
+                    yield rest
+                return
+            time.sleep(STREAM_POLL_INTERVAL)
+    finally:
+        if f is not None:
+            f.close()
+
+@app.route('/stream/<job_id>', methods=['GET'])
+def stream(job_id):
+    """Stream a job's mix while it renders; finished files are served with Range support."""
+    if not re.fullmatch(r'[0-9a-fA-F-]{36}', job_id):
+        return jsonify({"error": "Invalid job id"}), 400
+    final = find_output(job_id)
+    if final is not None:
+        return send_file(final, mimetype=mime_type_for(final), conditional=True)
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "File not found"}), 404
+    if job['status'] == 'error':
+        return jsonify({"error": job['error']}), 500
+    # The format is only known once the job has started writing; until then assume the default.
+    partial = find_output(job_id, partial=True)
+    mimetype = mime_type_for(partial) if partial else DEFAULT_PROFILE.mime_type
+    return Response(stream_with_context(_tail_render(job_id)), mimetype=mimetype)
+
+def _cache_metric_lines():
+    stats = CACHE.stats()
+    lines = gauge_lines('club100_cache_bytes', 'Bytes held per cache tier.',
+                        [((area,), s['bytes']) for area, s in stats.items()], labels=('area',))
+    for field, name in (('hits', 'hits'), ('misses', 'misses'), ('evictions', 'evictions')):
+        lines += [f'# HELP club100_cache_{name}_total Cache {name} per tier.',
+                  f'# TYPE club100_cache_{name}_total counter']
+        lines += [f'club100_cache_{name}_total{{area="{area}"}} {s[field]}' for area, s in stats.items()]
+    return lines
+
+def _scheduler_metric_lines():
+    return gauge_lines('club100_scheduler_pending', 'Tasks waiting per scheduler lane.',
+                       [((lane,), s['pending']) for lane, s in get_scheduler().stats().items()], labels=('lane',))
+
+REGISTRY.add_collector(_cache_metric_lines)
+REGISTRY.add_collector(_scheduler_metric_lines)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition: queue wait, render time, stage timings, downloads, subprocesses."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Per-tier entry counts, bytes, hits, misses and evictions of the cache manager."""
+    return jsonify(CACHE.stats())
 
 @app.route('/ytsearch', methods=['POST'])
 def ytsearch():
-    """Search YouTube for songs using yt-dlp."""
+    """Search YouTube for songs using yt-dlp (through the shared search cache).
+
+    The X-Search-Cache response header says how the query was answered: hit, prefix, miss
+    (this request ran the search) or shared (it waited on an identical in-flight search).
+    """
     data = request.get_json(silent=True) or {}
     query = data.get('query')
-    if not query or not isinstance(query, str):
+    if not query or not isinstance(query, str) or not query.strip():
         return jsonify({'error': 'Missing query'}), 400
     try:
-        result = subprocess.run(
-            [
-                'yt-dlp',
-                '--default-search', 'ytsearch5:',
-                '--print', '%(id)s\t%(title)s\t%(uploader)s\t%(thumbnail)s',
-                query
-            ],
-            capture_output=True, text=True, check=True, timeout=120
-        )
-        lines = result.stdout.strip().split('\n')
-        songs = []
-        for line in lines:
-            parts = line.split('\t')
-            if len(parts) >= 2:
-                song = {
-                    'url': f'https://www.youtube.com/watch?v={parts[0]}',
-                    'title': parts[1],
-                    'artist': parts[2] if len(parts) > 2 else '',
-                    'thumbnail': parts[3] if len(parts) > 3 else ''
-                }
-                songs.append(song)
-        return jsonify(songs)
+        songs, source = SEARCH_CACHE.search(query, _search_songs)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    SEARCH_LOOKUPS.inc(source=source)
+    resp = jsonify(songs)
+    resp.headers['X-Search-Cache'] = source
+    return resp
+
+def _search_songs(query):
+    with tracing.span('search'):
+        entries = YTDLP.search(query, limit=SEARCH_RESULTS, timeout=SEARCH_TIMEOUT)
+    return [{
+        'url': f'https://www.youtube.com/watch?v={e["id"]}',
+        'title': e['title'],
+        'artist': e['uploader'],
+        'thumbnail': e['thumbnail'],
+    } for e in entries]
 
 if __name__ == '__main__':
     # debug defaults off; opt in with FLASK_DEBUG=1 for local development only.
     debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
     host = os.environ.get('HOST', '127.0.0.1')
     port = int(os.environ.get('PORT', '5001'))
+    start_background_tasks()
     app.run(host=host, port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,378 @@
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from jobs import (
+    JOB_RETENTION_SECONDS, JOB_WORKERS, MAX_QUEUED_JOBS, QueueFullError, batch_report, finished_fields, run_render,
+)
+
+# SQLite file of the shared job queue. When set, server.py only enqueues jobs and any number of
+# `python main.py --worker` processes (on hosts sharing the file, CACHE_DIR and OUTPUT_DIR)
+# render them.
+JOB_QUEUE_DB = os.environ.get("JOB_QUEUE_DB")
+# A running job whose worker has not renewed its lease for this long is handed to another
+# worker, at most JOB_MAX_ATTEMPTS times in total.
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# How long an idle worker waits before looking for new jobs again.
+WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", "1.0"))
+
+# Job record fields update() copies verbatim into the column of the same meaning.
+_COLUMNS = {"status": "status", "stage": "stage", "error": "error", "finishedAt": "finished_at"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,             -- "render", or "plan": a batch's shared preparation step
+    batch_id TEXT,
+    status TEXT NOT NULL,           -- queued, running, done, error
+    ready INTEGER NOT NULL,         -- 0 while a batch job waits for its plan
+    stage TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    timings TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, ready, created_at);
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    job_ids TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    plan TEXT
+);
+"""
+
+
+class SharedJobQueue:
+    """Durable job queue in a SQLite file, shared by API servers and worker processes.
+
+    Exposes the same submit/get/position/batch interface as jobs.JobQueue, so server.py can use
+    either; rendering happens in QueueWorker processes, which claim jobs under a lease they
+    keep renewing. A job whose worker died is re-queued once its lease expires.
+    """
+
+    def __init__(self, path, max_queued: int = MAX_QUEUED_JOBS, retention_seconds: int = JOB_RETENTION_SECONDS,
+                 lease_seconds: int = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self._path = Path(path)
+        self._max_queued = max(0, max_queued)
+        self._retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._max_attempts = max(1, max_attempts)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            # The rollback journal, not WAL: WAL needs shared memory, which processes on different
+            # hosts sharing the file over a network filesystem don't have.
+            db.execute("PRAGMA journal_mode=DELETE")
+            db.executescript(_SCHEMA)
+
+    # --- API side -----------------------------------------------------------------------
+
+    def submit(self, data: dict) -> str:
+        """Enqueue a job and return its id, or raise QueueFullError if too many are waiting."""
+        job_id = str(uuid.uuid4())
+        with self._transaction() as db:
+            self._admit(db, 1)
+            self._insert(db, job_id, "render", data, batch_id=None, ready=True)
+        return job_id
+
+    def submit_batch(self, datas: list, prepare=None) -> tuple:
+        """Enqueue several jobs at once (all or none) plus the plan step they wait for.
+
+        `prepare` is accepted for interface parity with JobQueue but ignored: the first free
+        worker runs its own prepare function on the batch.
+        """
+        batch_id = str(uuid.uuid4())
+        job_ids = [str(uuid.uuid4()) for _ in datas]
+        with self._transaction() as db:
+            self._admit(db, len(datas))
+            now = time.time()
+            db.execute("INSERT INTO batches (batch_id, job_ids, created_at) VALUES (?, ?, ?)",
+                       (batch_id, json.dumps(job_ids), now))
+            for job_id, data in zip(job_ids, datas):
+                self._insert(db, job_id, "render", data, batch_id=batch_id, ready=False, stage="planning")
+            self._insert(db, str(uuid.uuid4()), "plan", {}, batch_id=batch_id, ready=True)
+        return batch_id, job_ids
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ? AND kind = 'render'", (job_id,)).fetchone()
+        return _record(row) if row else None
+
+    def position(self, job_id: str) -> Optional[int]:
+        with self._connect() as db:
+            row = db.execute("SELECT status, created_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] != "queued":
+                return None
+            # Batch jobs still waiting for their plan can't be claimed yet, so they are not ahead.
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'render' AND status = 'queued' "
+                              "AND ready = 1 AND created_at < ?", (row["created_at"],)).fetchone()[0]
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        with self._connect() as db:
+            batch = db.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            if batch is None:
+                return None
+            rows = {r["job_id"]: r for r in db.execute("SELECT * FROM jobs WHERE batch_id = ? AND kind = 'render'",
+                                                       (batch_id,))}
+        job_ids = json.loads(batch["job_ids"])
+        jobs = [_record(rows[j]) for j in job_ids if j in rows]
+        return {"batchId": batch_id, "jobIds": job_ids, "createdAt": batch["created_at"],
+                "plan": json.loads(batch["plan"]) if batch["plan"] else None,
+                "jobs": jobs, "report": batch_report(batch["created_at"], jobs)}
+
+    def wait_batch(self, batch_id: str, timeout: Optional[float] = None, poll_interval: float = 0.5):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            batch = self.get_batch(batch_id)
+            if batch is None or all(j["finishedAt"] is not None for j in batch["jobs"]):
+                return batch
+            if deadline is not None and time.time() >= deadline:
+                return batch
+            time.sleep(poll_interval)
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+    # --- Worker side --------------------------------------------------------------------
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Lease the oldest runnable job (plan steps first) to worker; None if there is none."""
+        with self._transaction() as db:
+            now = time.time()
+            # Jobs of workers that stopped renewing: retry them, or give up after max attempts.
+            db.execute("UPDATE jobs SET status = 'error', error = 'Worker lost while rendering', finished_at = ? "
+                       "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                       (now, now, self._max_attempts))
+            db.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' "
+                       "AND lease_expires < ?", (now,))
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' AND ready = 1 "
+                             "ORDER BY kind = 'plan' DESC, created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = ?, lease_expires = ?, "
+                       "attempts = attempts + 1 WHERE job_id = ?",
+                       (worker, now, now + self.lease_seconds, row["job_id"]))
+        return {"jobId": row["job_id"], "kind": row["kind"], "batchId": row["batch_id"],
+                "data": json.loads(row["data"]), "createdAt": row["created_at"], "startedAt": now}
+
+    def renew(self, worker: str, job_ids):
+        """Extend the leases worker holds on job_ids."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        with self._transaction() as db:
+            db.execute(f"UPDATE jobs SET lease_expires = ? WHERE worker = ? AND status = 'running' "
+                       f"AND job_id IN ({','.join('?' * len(job_ids))})",
+                       (time.time() + self.lease_seconds, worker, *job_ids))
+
+    def update(self, worker: str, job_id: str, **fields):
+        """Update a running job's record (stage, progress, or its finished_fields())."""
+        columns = {column: fields[key] for key, column in _COLUMNS.items() if key in fields}
+        if "progress" in fields:
+            columns["done"], columns["total"] = fields["progress"]["done"], fields["progress"]["total"]
+        if "timings" in fields:
+            columns["timings"] = json.dumps(fields["timings"])
+        if not columns:
+            return
+        with self._transaction() as db:
+            # Only the worker holding the lease may write; a job it lost belongs to someone else.
+            db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in columns)} "
+                       f"WHERE job_id = ? AND worker = ? AND status = 'running'",
+                       (*columns.values(), job_id, worker))
+
+    def batch_datas(self, batch_id: str) -> tuple:
+        """(job ids, request data) of a batch's render jobs, in submission order."""
+        with self._connect() as db:
+            batch = db.execute("SELECT job_ids FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            job_ids = json.loads(batch["job_ids"])
+            rows = {r["job_id"]: r["data"] for r in db.execute("SELECT job_id, data FROM jobs WHERE batch_id = ? "
+                                                               "AND kind = 'render'", (batch_id,))}
+        return job_ids, [json.loads(rows[j]) for j in job_ids]
+
+    def finish_plan(self, worker: str, plan_job_id: str, batch_id: str, job_ids: list, prepared: list, plan: dict):
+        """Store a batch's prepared requests and plan, and release its jobs to the workers."""
+        with self._transaction() as db:
+            for job_id, data in zip(job_ids, prepared):
+                db.execute("UPDATE jobs SET data = ?, ready = 1, stage = NULL WHERE job_id = ?",
+                           (json.dumps(data), job_id))
+            db.execute("UPDATE batches SET plan = ? WHERE batch_id = ?", (json.dumps(plan), batch_id))
+            db.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE job_id = ? AND worker = ?",
+                       (time.time(), plan_job_id, worker))
+
+    def fail_plan(self, worker: str, plan_job_id: str, batch_id: str, error: str):
+        with self._transaction() as db:
+            now = time.time()
+            db.execute("UPDATE jobs SET status = 'error', error = ?, finished_at = ?, stage = NULL "
+                       "WHERE batch_id = ? AND kind = 'render' AND status = 'queued'",
+                       (f"Batch planning failed: {error}", now, batch_id))
+            db.execute("UPDATE jobs SET status = 'error', error = ?, finished_at = ? WHERE job_id = ? AND worker = ?",
+                       (error, now, plan_job_id, worker))
+
+    # --- Internals ----------------------------------------------------------------------
+
+    def _open(self):
+        db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _connect(self):
+        return _Closing(self._open())
+
+    def _transaction(self):
+        return _Transaction(self._open())
+
+    def _admit(self, db, count: int):
+        cutoff = time.time() - self._retention_seconds
+        db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+        db.execute("DELETE FROM batches WHERE batch_id NOT IN (SELECT batch_id FROM jobs WHERE batch_id IS NOT NULL)")
+        queued = db.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'render' AND status = 'queued'").fetchone()[0]
+        if queued + count > self._max_queued:
+            raise QueueFullError("Too many jobs in progress, try again later")
+
+    def _insert(self, db, job_id, kind, data, batch_id, ready, stage=None):
+        db.execute("INSERT INTO jobs (job_id, kind, batch_id, status, ready, stage, total, data, created_at) "
+                   "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                   (job_id, kind, batch_id, int(ready), stage, len(data.get("timeline", [])),
+                    json.dumps(data), time.time()))
+
+
+def _record(row) -> dict:
+    """A jobs row in the shape of a jobs.JobQueue record."""
+    return {
+        "jobId": row["job_id"],
+        "batchId": row["batch_id"],
+        "status": row["status"],
+        "stage": row["stage"],
+        "progress": {"done": row["done"], "total": row["total"]},
+        "error": row["error"],
+        "createdAt": row["created_at"],
+        "startedAt": row["started_at"],
+        "finishedAt": row["finished_at"],
+        "timings": json.loads(row["timings"]) if row["timings"] else None,
+    }
+
+
+class _Closing:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+
+
+class _Transaction(_Closing):
+    """BEGIN IMMEDIATE ... COMMIT (or ROLLBACK): one writer at a time across every process."""
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.close()
+
+
+class QueueWorker:
+    """Pulls jobs from a SharedJobQueue and renders them, `threads` at a time.
+
+    `render(data, job_id, progress)` and `prepare(datas) -> (datas, plan)` are the same
+    callables jobs.JobQueue takes. Leases on running jobs are renewed in the background.
+    """
+
+    def __init__(self, queue: SharedJobQueue, render, prepare=None, threads: int = JOB_WORKERS,
+                 poll_interval: float = WORKER_POLL_INTERVAL):
+        self.queue = queue
+        self._render = render
+        self._prepare = prepare
+        self._threads = max(1, threads)
+        self._poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._running: set = set()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Work until stop() is called (blocks the calling thread)."""
+        threads = [threading.Thread(target=self._loop, name=f"club100-worker-{n}", daemon=True)
+                   for n in range(self._threads)]
+        for thread in threads:
+            thread.start()
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                running = list(self._running)
+            try:
+                self.queue.renew(self.name, running)
+            except sqlite3.Error as e:
+                print(f"Could not renew job leases: {e}", file=sys.stderr)
+        for thread in threads:
+            thread.join()
+
+    def run_once(self) -> bool:
+        """Claim and process a single job in this thread; False if none was waiting."""
+        job = self.queue.claim(self.name)
+        if job is None:
+            return False
+        with self._lock:
+            self._running.add(job["jobId"])
+        try:
+            if job["kind"] == "plan":
+                self._plan(job)
+            else:
+                self._run(job)
+        finally:
+            with self._lock:
+                self._running.discard(job["jobId"])
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                worked = self.run_once()
+            except sqlite3.Error as e:
+                print(f"Job queue unavailable: {e}", file=sys.stderr)
+                worked = False
+            if not worked:
+                self._stop.wait(self._poll_interval)
+
+    def _run(self, job: dict):
+        job_id = job["jobId"]
+        queue_wait = job["startedAt"] - job["createdAt"]
+
+        def progress(stage, done, total):
+            self.queue.update(self.name, job_id, stage=stage, progress={"done": done, "total": total})
+
+        status, error, summary = run_render(self._render, job["data"], job_id, progress)
+        self.queue.update(self.name, job_id, **finished_fields(job["startedAt"], queue_wait, status, error, summary))
+
+    def _plan(self, job: dict):
+        job_ids, datas = self.queue.batch_datas(job["batchId"])
+        try:
+            prepared, plan = self._prepare(datas) if self._prepare else (datas, {})
+        except Exception as e:
+            print(traceback.format_exc(), file=sys.stderr)
+            self.queue.fail_plan(self.name, job["jobId"], job["batchId"], str(e))
+            return
+        self.queue.finish_plan(self.name, job["jobId"], job["batchId"], job_ids, prepared, plan)
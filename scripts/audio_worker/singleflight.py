@@ -0,0 +1,54 @@
+import threading
+import concurrent.futures
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs the work in its own thread; everyone who asks
+    for the same key while it is in flight waits on the leader's future and gets the same
+    result or exception. The entry is dropped as soon as the work finishes, so the table only
+    ever holds keys that are in flight right now.
+
+    With a `leases.LeaseManager`, the leader also holds the key's cross-process lease while it
+    works, so other processes sharing the cache wait instead of repeating the work (the work
+    function should re-check the cache first, as it may have been filled meanwhile).
+    """
+
+    def __init__(self, leases=None):
+        self.leases = leases
+        self._lock = threading.Lock()
+        self._inflight: dict = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = concurrent.futures.Future()
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            if self.leases is None:
+                result = fn(*args)
+            else:
+                with self.leases.hold(key):
+                    result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
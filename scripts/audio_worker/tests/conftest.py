@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path_factory, monkeypatch):
+    """Point every on-disk cache at a per-test directory so tests never touch the real cache."""
+    root = tmp_path_factory.mktemp('cache')
+    for name in ('segments', 'sections', 'snippets', 'effects', 'renders'):
+        (root / name).mkdir()
+    monkeypatch.setattr(main, 'CACHE_DIR', root)
+    monkeypatch.setattr(main, 'SEGMENT_CACHE_DIR', root / 'segments')
+    monkeypatch.setattr(main, 'SECTION_CACHE_DIR', root / 'sections')
+    monkeypatch.setattr(main, 'SNIPPET_CACHE_DIR', root / 'snippets')
+    monkeypatch.setattr(main, 'EFFECT_CACHE_DIR', root / 'effects')
+    monkeypatch.setattr(main, 'RENDER_MANIFEST_DIR', root / 'renders')
+    monkeypatch.setattr(main, 'JOB_WORK_DIR', root / 'jobs')
+    monkeypatch.setattr(main, 'LEASE_DIR', root / 'leases')
+    monkeypatch.setattr(main, 'CACHE', main._build_cache_manager())
+    monkeypatch.setattr(main, '_inflight', main._build_inflight())
+    monkeypatch.setattr(main, 'METADATA', main.MetadataStore(root / 'index' / 'metadata.json'))
+    monkeypatch.setattr(main, 'LOUDNESS', main.MetadataStore(root / 'index' / 'loudness.json'))
+    # Most tests count ffmpeg runs; the loudness tests turn the analysis pass back on.
+    monkeypatch.setattr(main, 'LOUDNESS_NORMALIZE', False)
+    monkeypatch.setattr(main, 'HIGHLIGHT_DIR', root / 'highlights')
+    if main.highlights is not None:
+        monkeypatch.setattr(main, 'HIGHLIGHTS', main.highlights.HighlightIndex(root / 'highlights'))
+    # Keeps background analysis of fully cached test videos from running; the highlight tests opt in.
+    monkeypatch.setattr(main, 'HIGHLIGHT_INDEX', False)
+    return root
@@ -0,0 +1,65 @@
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+
+import pytest  # noqa: E402
+import main  # noqa: E402
+
+np = pytest.importorskip('numpy')
+from harness import CACHE_LOCATIONS, CACHE_STORES, point_caches_at  # noqa: E402
+
+
+def _tree(root: Path) -> set:
+    return {p.relative_to(root) for p in root.rglob('*')}
+
+
+class FakeEngine:
+    def download(self, url, out_path, section=None):
+        Path(out_path).write_bytes(b'audio')
+        return {'dQw4w9WgXcQ': {'duration': 300}}
+
+
+def test_point_caches_at_keeps_every_write_under_the_scratch_root(isolated_cache, tmp_path, monkeypatch):
+    # Register every attribute the harness rebinds, so monkeypatch restores them afterwards.
+    for name in CACHE_LOCATIONS + CACHE_STORES:
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, 'LOUDNESS_NORMALIZE', True)
+    monkeypatch.setattr(main, 'HIGHLIGHT_INDEX', True)
+    monkeypatch.setattr(main, 'DOWNLOAD_MODE', 'full')
+    monkeypatch.setattr(main, 'YTDLP', FakeEngine())
+    monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+    monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 300)
+
+    def fake_run(cmd, **kwargs):
+        if 'loudnorm=print_format=json' in cmd:
+            report = '{"input_i": "-20", "input_tp": "-6", "input_lra": "5", "input_thresh": "-30"}'
+            return subprocess.CompletedProcess(cmd, 0, '', report)
+        if 'f32le' in cmd:
+            np.zeros(5 * 11025, dtype=np.float32).tofile(cmd[-1])
+            return None
+        Path(cmd[-1]).write_bytes(b'audio')
+
+    monkeypatch.setattr(main.subprocess, 'run', fake_run)
+    queued = []
+    queue = main._queue_highlight_index
+    monkeypatch.setattr(main, '_queue_highlight_index', lambda *args: queued.append(queue(*args)))
+    # isolated_cache stands in for the real cache here: the benchmark must not touch it.
+    before = _tree(isolated_cache)
+    scratch = tmp_path / 'bench'
+    point_caches_at(main, scratch)
+    timeline = [
+        {'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 10}},
+        {'type': 'effect', 'effect': {'id': 'vine_boom'}},
+        {'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': 'data:audio/webm;base64,aGk='}},
+    ]
+    main.process_audio({'timeline': timeline})
+    for future in queued:
+        if future is not None:
+            future.result(timeout=10)
+    main.CACHE.flush()
+    assert _tree(isolated_cache) == before
+    assert (scratch / 'loudness.json').exists()
+    assert list((scratch / 'highlight_dir').glob('*.npy'))
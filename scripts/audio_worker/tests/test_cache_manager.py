@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from cache_manager import CacheManager  # noqa: E402
+
+
+def _write(path: Path, size: int, age: float = 0):
+    path.write_bytes(b'x' * size)
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+
+class TestCacheManager:
+    @pytest.fixture
+    def manager(self, tmp_path):
+        manager = CacheManager(tmp_path / 'index.json', grace_seconds=0)
+        manager.add_area('segments', tmp_path, '*.mp3', max_bytes=20)
+        return manager
+
+    def test_lru_evicts_least_recently_used_first(self, manager, tmp_path):
+        a, b, c = (_write(tmp_path / f'{n}.mp3', 10) for n in 'abc')
+        for path in (a, b, c):
+            manager.record('segments', path)
+            time.sleep(0.01)
+        # Using `a` again makes `b` the least recently used, whatever the mtimes say.
+        assert manager.lookup('segments', a) == a
+        assert manager.collect() == 1
+        assert sorted(p.name for p in tmp_path.glob('*.mp3')) == ['a.mp3', 'c.mp3']
+        stats = manager.stats()['segments']
+        assert stats['evictions'] == 1 and stats['bytes'] == 20 and stats['hits'] == 1
+
+    def test_lfu_keeps_frequently_used_entries(self, tmp_path):
+        manager = CacheManager(tmp_path / 'index.json', policy='lfu', grace_seconds=0)
+        manager.add_area('segments', tmp_path, '*.mp3', max_bytes=10)
+        hot, cold = _write(tmp_path / 'hot.mp3', 10), _write(tmp_path / 'cold.mp3', 10)
+        manager.record('segments', hot)
+        manager.record('segments', cold)
+        for _ in range(3):
+            manager.lookup('segments', hot)
+        manager.collect()
+        assert hot.exists() and not cold.exists()
+
+    def test_recently_used_entries_survive_within_grace(self, tmp_path):
+        manager = CacheManager(tmp_path / 'index.json', grace_seconds=600)
+        manager.add_area('segments', tmp_path, '*.mp3', max_bytes=0)
+        path = _write(tmp_path / 'in_use.mp3', 10)
+        manager.record('segments', path)
+        assert manager.collect() == 0 and path.exists()
+
+    def test_max_age_expires_entries(self, tmp_path):
+        manager = CacheManager(tmp_path / 'index.json')
+        manager.add_area('outputs', tmp_path, '*.mp3', max_age=60)
+        old, new = _write(tmp_path / 'old.mp3', 1, age=120), _write(tmp_path / 'new.mp3', 1)
+        manager.reconcile()
+        manager.collect()
+        assert new.exists() and not old.exists()
+
+    def test_miss_is_counted_and_drops_stale_entry(self, manager, tmp_path):
+        path = _write(tmp_path / 'gone.mp3', 5)
+        manager.record('segments', path)
+        path.unlink()
+        assert manager.lookup('segments', path) is None
+        stats = manager.stats()['segments']
+        assert stats['misses'] == 1 and stats['entries'] == 0 and stats['bytes'] == 0
+
+    def test_contains_counts_nothing(self, manager, tmp_path):
+        path = _write(tmp_path / 'a.mp3', 5)
+        assert manager.contains('segments', path)
+        assert not manager.contains('segments', tmp_path / 'missing.mp3')
+        stats = manager.stats()['segments']
+        assert stats['hits'] == 0 and stats['misses'] == 0 and stats['entries'] == 0
+
+    def test_index_persists_across_instances(self, manager, tmp_path):
+        path = _write(tmp_path / 'a.mp3', 5)
+        manager.record('segments', path)
+        manager.flush()
+        assert str(path) in json.loads((tmp_path / 'index.json').read_text())['segments']
+        reloaded = CacheManager(tmp_path / 'index.json')
+        reloaded.add_area('segments', tmp_path, '*.mp3', max_bytes=20)
+        assert reloaded.stats()['segments']['bytes'] == 5
+
+    def test_unknown_policy(self, tmp_path):
+        with pytest.raises(ValueError):
+            CacheManager(tmp_path / 'index.json', policy='fifo')
+
+
+class TestSharedIndex:
+    def test_flush_keeps_entries_of_other_processes(self, tmp_path):
+        index = tmp_path / 'index.json'
+        first, second = CacheManager(index), CacheManager(index)
+        for manager in (first, second):
+            manager.add_area('segments', tmp_path, '*.mp3')
+        a, b = _write(tmp_path / 'a.mp3', 10), _write(tmp_path / 'b.mp3', 10)
+        first.record('segments', a)
+        first.flush()
+        second.record('segments', b)
+        second.flush()
+        assert sorted(Path(k).name for k in json.loads(index.read_text())['segments']) == ['a.mp3', 'b.mp3']
+        assert second.stats()['segments']['bytes'] == 20
+
+    def test_evicted_entries_are_not_merged_back(self, tmp_path):
+        index = tmp_path / 'index.json'
+        first = CacheManager(index, grace_seconds=0)
+        first.add_area('segments', tmp_path, '*.mp3', max_bytes=10)
+        a = _write(tmp_path / 'a.mp3', 10)
+        first.record('segments', a)
+        first.flush()
+        time.sleep(0.01)
+        first.record('segments', _write(tmp_path / 'b.mp3', 10))
+        assert first.collect() == 1
+        assert list(json.loads(index.read_text())['segments']) == [str(tmp_path / 'b.mp3')]
@@ -0,0 +1,66 @@
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+np = pytest.importorskip('numpy')
+import highlights  # noqa: E402
+
+RATE = highlights.ANALYSIS_RATE
+
+
+def quiet(seconds):
+    return np.full(seconds * RATE, 0.001, dtype=np.float32)
+
+
+def beats(seconds, level=0.5):
+    """A loud signal with an attack every quarter second."""
+    pcm = np.full(seconds * RATE, level / 10, dtype=np.float32)
+    for n in range(0, len(pcm), RATE // 4):
+        pcm[n:n + 2048] = level
+    return pcm
+
+
+class TestEnvelope:
+    def test_one_row_per_second(self):
+        index = highlights.envelope(np.concatenate([quiet(3), beats(2)]))
+        assert index.shape == (5, 2) and index.dtype == np.float32
+        assert index[4, 0] > index[0, 0] + 30
+        assert index[4, 1] > index[0, 1]
+
+    def test_silence_is_floored(self):
+        index = highlights.envelope(np.zeros(2 * RATE, dtype=np.float32))
+        assert index[:, 0].tolist() == [highlights.SILENCE_DB] * 2
+
+    def test_too_short_is_empty(self):
+        assert highlights.envelope(np.zeros(10, dtype=np.float32)).shape == (0, 2)
+
+
+class TestChooseStart:
+    def test_picks_the_lively_window(self):
+        # Quiet intro, 20 s chorus, quiet outro: a 10 s window should land inside the chorus.
+        index = highlights.envelope(np.concatenate([quiet(40), beats(20), quiet(40)]))
+        starts = {highlights.choose_start(index, 100, 10, random.Random(seed)) for seed in range(20)}
+        assert all(40 <= s <= 50 for s in starts)
+
+    def test_start_fits_in_duration(self):
+        index = highlights.envelope(np.concatenate([quiet(20), beats(10)]))
+        # The metadata says the video is shorter than the decoded audio.
+        assert highlights.choose_start(index, 25, 10, random.Random(0)) <= 15
+
+    def test_index_shorter_than_window_starts_at_zero(self):
+        assert highlights.choose_start(np.zeros((5, 2), dtype=np.float32), 300, 60) == 0
+
+
+class TestHighlightIndex:
+    def test_persists_and_reloads(self, tmp_path):
+        index = highlights.envelope(beats(3))
+        highlights.HighlightIndex(tmp_path).put('vid', index)
+        store = highlights.HighlightIndex(tmp_path)
+        assert 'vid' in store and 'other' not in store
+        assert np.array_equal(store.get('vid'), index)
+        assert store.get('other') is None
+        assert [p.name for p in tmp_path.iterdir()] == ['vid.npy']
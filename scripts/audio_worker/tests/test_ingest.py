@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from ingest import (  # noqa: E402
+    Base64Decoder, BodyTooLargeError, HashingWriter, JsonSnippetExtractor, snippet_id_from_marker,
+)
+
+
+def _extract(body: bytes, tmp_path, chunk_size=7, max_json_bytes=10_000):
+    stored = {}
+
+    def on_commit(path, digest):
+        stored[digest] = path.read_bytes()
+        return digest
+
+    extractor = JsonSnippetExtractor(lambda: HashingWriter(tmp_path, on_commit), max_json_bytes)
+    for start in range(0, len(body), chunk_size):
+        extractor.feed(body[start:start + chunk_size])
+    return json.loads(extractor.finish()), stored
+
+
+class TestBase64Decoder:
+    def test_decodes_across_arbitrary_splits(self):
+        data = bytes(range(256)) * 3
+        encoded = base64.encodebytes(data)  # includes newlines
+        decoder = Base64Decoder()
+        out = b''.join(decoder.feed(encoded[i:i + 5]) for i in range(0, len(encoded), 5))
+        assert out + decoder.finish() == data
+
+    def test_truncated_input(self):
+        decoder = Base64Decoder()
+        decoder.feed(b'aGVsbG')
+        with pytest.raises(ValueError):
+            decoder.finish()
+
+
+class TestJsonSnippetExtractor:
+    def test_data_urls_go_to_disk_and_other_strings_stay(self, tmp_path):
+        audio = b'\x00\x01clip' * 50
+        url = 'data:audio/webm;codecs=opus;base64,' + base64.b64encode(audio).decode()
+        body = json.dumps({'timeline': [
+            {'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': url}},
+            {'type': 'song', 'song': {'url': 'https://youtu.be/x', 'title': 'say "data:audio/"\\n'}},
+        ]}).replace('/', '\\/').encode()
+        data, stored = _extract(body, tmp_path)
+        snippet_id = snippet_id_from_marker(data['timeline'][0]['snippet']['audioUrl'])
+        assert snippet_id == hashlib.sha256(audio).hexdigest() and stored[snippet_id] == audio
+        assert data['timeline'][1]['song']['title'] == 'say "data:audio/"\\n'
+        assert list(tmp_path.iterdir()) == []
+
+    def test_retained_json_is_capped(self, tmp_path):
+        with pytest.raises(BodyTooLargeError):
+            _extract(json.dumps({'title': 'x' * 100}).encode(), tmp_path, max_json_bytes=50)
+
+    def test_truncated_body_discards_partial_upload(self, tmp_path):
+        extractor = JsonSnippetExtractor(lambda: HashingWriter(tmp_path, lambda path, digest: digest), 1000)
+        extractor.feed(b'{"audioUrl": "data:audio/wav;base64,aGVsbG8')
+        with pytest.raises(ValueError):
+            extractor.finish()
+        assert list(tmp_path.iterdir()) == []
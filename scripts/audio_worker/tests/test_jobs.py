@@ -0,0 +1,135 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+import jobs  # noqa: E402
+
+
+def _wait(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'error'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+class TestJobQueue:
+    def test_reports_progress_and_done(self, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'x')
+
+        def render(data, job_id, progress):
+            progress('processing', 2, 2)
+            return str(out)
+
+        q = jobs.JobQueue(render, workers=1, max_queued=1)
+        job_id = q.submit({'timeline': [{}, {}]})
+        job = _wait(q, job_id)
+        assert job['status'] == 'done'
+        assert job['progress'] == {'done': 2, 'total': 2}
+        assert job['startedAt'] is not None and job['finishedAt'] is not None
+
+    def test_missing_output_is_error(self):
+        q = jobs.JobQueue(lambda data, job_id, progress: None, workers=1)
+        job = _wait(q, q.submit({'timeline': []}))
+        assert job['status'] == 'error'
+        assert 'no output file' in job['error']
+
+    def test_admission_control_rejects_when_full(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def render(data, job_id, progress):
+            started.set()
+            release.wait(5)
+            return None
+
+        q = jobs.JobQueue(render, workers=1, max_queued=1)
+        try:
+            first = q.submit({'timeline': []})
+            assert started.wait(5)
+            second = q.submit({'timeline': []})
+            with pytest.raises(jobs.QueueFullError):
+                q.submit({'timeline': []})
+            assert q.position(second) == 0
+            assert q.position(first) is None
+        finally:
+            release.set()
+            q.shutdown()
+
+    def test_batch_prepares_once_and_reports_throughput(self, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'x')
+        prepared, rendered = [], []
+
+        def prepare(datas):
+            prepared.append(len(datas))
+            return [{**d, 'pinned': True} for d in datas], {'sharedSongs': 1}
+
+        def render(data, job_id, progress):
+            rendered.append(data)
+            return str(out)
+
+        q = jobs.JobQueue(render, workers=2, max_queued=2)
+        batch_id, job_ids = q.submit_batch([{'timeline': [{}]}, {'timeline': [{}, {}]}], prepare)
+        batch = q.wait_batch(batch_id, timeout=5)
+        assert prepared == [2] and all(d['pinned'] for d in rendered)
+        assert [j['jobId'] for j in batch['jobs']] == job_ids
+        assert batch['plan'] == {'sharedSongs': 1}
+        assert batch['report']['done'] == 2 and batch['report']['failed'] == 0
+        assert q.get(job_ids[0])['batchId'] == batch_id
+
+    def test_planning_batch_holds_no_workers(self, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'x')
+        planning = threading.Event()
+
+        def prepare(datas):
+            planning.wait(5)
+            return datas, {}
+
+        q = jobs.JobQueue(lambda data, job_id, progress: str(out), workers=1, max_queued=4)
+        try:
+            batch_id, job_ids = q.submit_batch([{'timeline': []}] * 3, prepare)
+            assert q.get(job_ids[0])['status'] == 'queued' and q.get(job_ids[0])['stage'] == 'planning'
+            # An unrelated job gets the only worker while the batch is still planning.
+            assert _wait(q, q.submit({'timeline': []}), timeout=2)['status'] == 'done'
+            planning.set()
+            batch = q.wait_batch(batch_id, timeout=5)
+            assert batch['report']['done'] == 3
+        finally:
+            planning.set()
+            q.shutdown()
+
+    def test_batch_is_admitted_all_or_nothing(self):
+        q = jobs.JobQueue(lambda data, job_id, progress: None, workers=1, max_queued=1)
+        with pytest.raises(jobs.QueueFullError):
+            q.submit_batch([{'timeline': []}] * 3)
+
+    def test_failed_preparation_fails_every_job(self):
+        def prepare(datas):
+            raise RuntimeError('probe failed')
+
+        q = jobs.JobQueue(lambda data, job_id, progress: None, workers=1, max_queued=1)
+        batch_id, _ = q.submit_batch([{'timeline': []}] * 2, prepare)
+        batch = q.wait_batch(batch_id, timeout=5)
+        assert [j['status'] for j in batch['jobs']] == ['error', 'error']
+        assert 'probe failed' in batch['jobs'][0]['error']
+
+    def test_finished_jobs_are_pruned(self):
+        q = jobs.JobQueue(lambda data, job_id, progress: None, workers=1, retention_seconds=0)
+        job_id = q.submit({'timeline': []})
+        _wait(q, job_id)
+        time.sleep(0.01)
+        q.submit({'timeline': []})
+        assert q.get(job_id) is None
+
+    def test_unknown_job(self):
+        q = jobs.JobQueue(lambda data, job_id, progress: None, workers=1)
+        assert q.get('nope') is None
@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from leases import LeaseManager  # noqa: E402
+
+
+class TestLeaseManager:
+    def test_holders_of_one_key_take_turns_across_managers(self, tmp_path):
+        # Two managers stand in for two processes sharing the lease directory.
+        first, second = LeaseManager(tmp_path, poll_interval=0.01), LeaseManager(tmp_path, poll_interval=0.01)
+        inside, overlaps = [], []
+
+        def hold(manager):
+            with manager.hold(('song', 'abc')):
+                if inside:
+                    overlaps.append(True)
+                inside.append(True)
+                time.sleep(0.05)
+                inside.pop()
+
+        threads = [threading.Thread(target=hold, args=(m,)) for m in (first, second)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert overlaps == []
+        assert first.waits + second.waits == 1
+        assert list(tmp_path.iterdir()) == []
+
+    def test_different_keys_do_not_wait(self, tmp_path):
+        manager = LeaseManager(tmp_path)
+        with manager.hold('a'), manager.hold('b'):
+            assert len(list(tmp_path.glob('*.lease'))) == 2
+        assert manager.waits == 0
+
+    def test_expired_lease_of_a_dead_holder_is_broken(self, tmp_path):
+        dead = LeaseManager(tmp_path, ttl=1)
+        path = tmp_path / 'stale.lease'
+        # A lease left behind by a process that died mid-download.
+        dead._acquire(path, 'k')
+        with dead._lock:
+            dead._held.clear()
+        old = time.time() - 5
+        os.utime(path, (old, old))
+
+        manager = LeaseManager(tmp_path, ttl=1, poll_interval=0.01)
+        token = manager._acquire(path, 'k')
+        assert manager.broken == 1
+        manager._release(path, token)
+        assert not path.exists()
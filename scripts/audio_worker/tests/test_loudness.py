@@ -0,0 +1,63 @@
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+import loudness  # noqa: E402
+
+REPORT = """[Parsed_loudnorm_0 @ 0x55d0c8] 
+{
+	"input_i" : "-23.40",
+	"input_tp" : "-4.10",
+	"input_lra" : "6.20",
+	"input_thresh" : "-33.80",
+	"output_i" : "-16.02",
+	"output_tp" : "-1.50",
+	"output_lra" : "5.10",
+	"output_thresh" : "-26.40",
+	"normalization_type" : "dynamic",
+	"target_offset" : "0.02"
+}
+"""
+
+
+class TestParseMeasurement:
+    def test_reads_the_input_values(self):
+        measured = loudness.parse_measurement("Input #0, mp3, from 'a.mp3':\n" + REPORT)
+        assert measured == {"inputI": -23.4, "inputTP": -4.1, "inputLRA": 6.2, "inputThresh": -33.8}
+
+    def test_silence_parses_as_infinite(self):
+        measured = loudness.parse_measurement(REPORT.replace('"-23.40"', '"-inf"'))
+        assert measured["inputI"] == float("-inf")
+
+    def test_missing_report_raises(self):
+        with pytest.raises(ValueError):
+            loudness.parse_measurement("Conversion failed!")
+
+
+class TestGain:
+    def test_brings_loudness_to_target(self):
+        assert loudness.gain_db({"inputI": -23.4, "inputTP": -9.0}, -16, -1.5) == pytest.approx(7.4)
+
+    def test_true_peak_caps_the_gain(self):
+        assert loudness.gain_db({"inputI": -23.4, "inputTP": -4.1}, -16, -1.5) == pytest.approx(2.6)
+
+    def test_loud_sources_are_turned_down(self):
+        assert loudness.gain_db({"inputI": -8.0, "inputTP": 0.5}, -16, -1.5) == pytest.approx(-8.0)
+
+    def test_silence_is_left_alone(self):
+        assert loudness.gain_db({"inputI": float("-inf"), "inputTP": float("-inf")}, -16, -1.5) == 0.0
+
+    def test_volume_filter(self):
+        assert loudness.volume_filter(2.6) == ["-af", "volume=2.6dB"]
+        assert loudness.volume_filter(0.0) == []
+
+
+def test_measure_command_analyzes_a_window_without_output():
+    cmd = loudness.measure_command(Path("song.m4a"), 30, 60)
+    assert cmd[cmd.index("-ss") + 1] == "30" and cmd[cmd.index("-t") + 1] == "60"
+    assert "loudnorm=print_format=json" in cmd
+    assert cmd[-3:] == ["-f", "null", os.devnull]
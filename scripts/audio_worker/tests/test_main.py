@@ -1,11 +1,15 @@
+import subprocess
 import sys
+import threading
 import time
 from pathlib import Path
 
 # Make the audio_worker package importable when running pytest from anywhere.
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
+import pytest  # noqa: E402
 import main  # noqa: E402
+from output_profiles import PROFILES  # noqa: E402
 
 
 class TestExtractYoutubeId:
@@ -52,30 +56,37 @@ class TestDownloadGuard:
             main.download_random_youtube_audio('https://evil.com/x', tmp_path / 'out.mp3')
 
 
-class TestCacheLocks:
-    def test_same_key_returns_same_lock(self):
-        a = main._get_cache_lock('vid1')
-        b = main._get_cache_lock('vid1')
-        c = main._get_cache_lock('vid2')
-        assert a is b
-        assert a is not c
+class TestSingleFlightDownloads:
+    URL = 'https://youtu.be/dQw4w9WgXcQ'
 
+    def test_concurrent_requests_share_one_download(self, monkeypatch):
+        import threading
+        release = threading.Event()
+        downloads = []
 
-class TestCleanupOldFiles:
-    def test_deletes_old_keeps_new(self, tmp_path):
-        old = tmp_path / 'old.mp3'
-        new = tmp_path / 'new.mp3'
-        old.write_text('x')
-        new.write_text('y')
-        old_time = time.time() - 7200  # 2 hours ago
-        import os
-        os.utime(old, (old_time, old_time))
-        main.cleanup_old_files(tmp_path, max_age_seconds=3600)
-        assert not old.exists()
-        assert new.exists()
+        class SlowEngine:
+            def download(self, url, out_path, section=None):
+                downloads.append(url)
+                release.wait(5)
+                Path(out_path).write_bytes(b'window')
+                return {}
 
-    def test_missing_directory_is_noop(self, tmp_path):
-        main.cleanup_old_files(tmp_path / 'does-not-exist', max_age_seconds=1)
+        monkeypatch.setattr(main, 'YTDLP', SlowEngine())
+        monkeypatch.setattr(main, '_inflight', main._build_inflight())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(main.ensure_source_window(self.URL, 60)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 5
+        while main._inflight.shared < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join(5)
+        assert len(downloads) == 1
+        assert len(set(results)) == 1 and len(results) == 4
+        assert main._inflight.inflight() == 0
 
 
 class TestEffectsMap:
@@ -87,3 +98,634 @@ class TestEffectsMap:
     def test_ids_are_unique(self):
         ids = [e['id'] for e in main.EFFECTS]
         assert len(ids) == len(set(ids))
+
+
+class TestSegmentCache:
+    URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    def test_key_depends_on_window_and_encode_params(self):
+        key = main.segment_cache_key('vid', 30)
+        assert key == main.segment_cache_key('vid', 30)
+        assert key != main.segment_cache_key('vid', 31)
+        assert key != main.segment_cache_key('vid', 30, duration=30)
+        assert key != main.segment_cache_key('vid', 30, encode_args=['-b:a', '128k'])
+
+    def test_hit_with_fixed_start_runs_no_subprocess(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'SEGMENT_CACHE_DIR', tmp_path)
+        src = tmp_path / 'src.mp3'
+        src.write_bytes(b'segment')
+        main.store_segment(src, main.segment_cache_key('dQw4w9WgXcQ', 42))
+
+        def fail(*args, **kwargs):
+            raise AssertionError('cache hit must not spawn yt-dlp/ffmpeg')
+
+        monkeypatch.setattr(main.subprocess, 'run', fail)
+        monkeypatch.setattr(main, 'get_youtube_duration', fail)
+        out = tmp_path / 'out.mp3'
+        main.download_random_youtube_audio(self.URL, out, start_override=42)
+        assert out.read_bytes() == b'segment'
+
+    def test_miss_stores_normalized_segment(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'SEGMENT_CACHE_DIR', tmp_path / 'segments')
+        monkeypatch.setattr(main, 'CACHE_DIR', tmp_path)
+        (tmp_path / 'segments').mkdir()
+        (tmp_path / 'dQw4w9WgXcQ.full.m4a').write_bytes(b'full')
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 300)
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            Path(cmd[-1]).write_bytes(b'encoded')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        out = tmp_path / 'out.mp3'
+        main.download_random_youtube_audio(self.URL, out, start_override=42)
+        assert len(calls) == 1 and calls[0][0] == 'ffmpeg'
+        assert '-b:a' in calls[0]
+        cached = main.lookup_segment(main.segment_cache_key('dQw4w9WgXcQ', 42))
+        assert cached is not None and cached.read_bytes() == b'encoded'
+
+
+class TestPrefetch:
+    URL = 'https://youtu.be/dQw4w9WgXcQ'
+
+    def test_generate_after_prefetch_is_all_cache_hits(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            if '-ss' in cmd:
+                trims.append(cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        futures = main.prefetch_songs([{'url': self.URL}, {'url': self.URL}, {'url': 'https://evil.com/x'}])
+        assert len(futures) == 1
+        futures[0].result(timeout=5)
+        assert len(trims) == 1 and main.METADATA.get('dQw4w9WgXcQ')['prefetchedStart'] is not None
+        trims.clear()
+        main.process_audio({'timeline': [{'type': 'song', 'song': {'url': self.URL}}]})
+        assert trims == []
+
+
+class TestBatch:
+    URL_A = 'https://youtu.be/dQw4w9WgXcQ'
+    URL_B = 'https://youtu.be/9bZkp7q5f_w'
+
+    def test_batch_requests_expands_shared_settings(self):
+        requests = main.batch_requests({'renderMode': 'pcm', 'timelines': [[], {'timeline': [], 'renderMode': 'segments'}]})
+        assert requests == [{'renderMode': 'pcm', 'timeline': []}, {'renderMode': 'segments', 'timeline': []}]
+        with pytest.raises(ValueError):
+            main.batch_requests({'timelines': [{'timeline': 'nope'}]})
+
+    def test_shared_songs_are_trimmed_once_for_the_whole_batch(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        picks = iter(range(100, 200))
+        monkeypatch.setattr(main.random, 'randint', lambda lo, hi: next(picks))
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            if '-ss' in cmd:
+                trims.append(cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        song_a = {'type': 'song', 'song': {'url': self.URL_A}}
+        song_b = {'type': 'song', 'song': {'url': self.URL_B, 'start': 30}}
+        datas = [{'timeline': [song_a, song_b]}, {'timeline': [song_b, song_a]},
+                 {'timeline': [song_a], 'shuffleStarts': True}]
+        batch = main.run_batch(datas)
+        assert batch['report']['done'] == 3
+        assert batch['plan']['sharedSongs'] == 2 and batch['plan']['uniqueSongs'] == 2
+        # One trim per shared song, plus the shuffled timeline's own random window of song A.
+        assert len(trims) == 3
+        assert all(Path(job['output']).exists() for job in batch['jobs'])
+
+    def test_draft_batch_warms_draft_segments(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            trims.append(cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        song = {'type': 'song', 'song': {'url': self.URL_B, 'start': 30}}
+        main.prepare_batch([{'timeline': [song], 'draft': True}] * 2)
+        assert len(trims) == 1
+        assert trims[0][trims[0].index('-t') + 1] == str(min(main.DRAFT_SONG_SECONDS, main.SONG_SECONDS))
+        assert trims[0][-1 - len(main.DRAFT_PROFILE.output_args):-1] == list(main.DRAFT_PROFILE.output_args)
+
+
+class TestIncrementalRender:
+    URL_A = 'https://youtu.be/dQw4w9WgXcQ'
+    URL_B = 'https://youtu.be/9bZkp7q5f_w'
+    URL_C = 'https://youtu.be/kJQP7kiw5Fk'
+
+    def test_regeneration_only_encodes_changed_songs(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        # Every fresh random pick differs, so a reused window can only come from the manifest.
+        picks = iter(range(100, 200))
+        monkeypatch.setattr(main.random, 'randint', lambda lo, hi: next(picks))
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            if '-ss' in cmd:
+                trims.append(cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        first = [{'type': 'song', 'song': {'url': self.URL_A}}, {'type': 'song', 'song': {'url': self.URL_B}}]
+        main.process_audio({'timeline': first}, job_id='job-1')
+        assert len(trims) == 2
+        trims.clear()
+        # Swap the second song: the first keeps its random window and comes from the segment cache.
+        second = [first[0], {'type': 'song', 'song': {'url': self.URL_C}}]
+        main.process_audio({'timeline': second, 'previousJobId': 'job-1'}, job_id='job-2')
+        assert len(trims) == 1
+        assert main.load_render_manifest('job-1')[main.song_fingerprint({'url': self.URL_A})] == \
+            main.load_render_manifest('job-2')[main.song_fingerprint({'url': self.URL_A})]
+
+    def test_invalid_start_falls_back_to_random_for_that_song_only(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        monkeypatch.setattr(main.random, 'randint', lambda lo, hi: 123)
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            if '-ss' in cmd:
+                trims.append(cmd[cmd.index('-ss') + 1])
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        timeline = [{'type': 'song', 'song': {'url': self.URL_A, 'start': 'soon'}},
+                    {'type': 'song', 'song': {'url': self.URL_B, 'start': '45'}}]
+        main.process_audio({'timeline': timeline}, job_id='job-1')
+        assert sorted(trims) == ['123', '45']
+
+    def test_manifest_ignores_unsafe_job_ids(self):
+        main.save_render_manifest('../escape', [{'fingerprint': 'x', 'start': 1}])
+        assert main.load_render_manifest('../escape') == {}
+        assert not list(main.RENDER_MANIFEST_DIR.parent.glob('escape*'))
+
+
+class TestSinglePassRender:
+    def test_command_trims_normalizes_and_concats(self, tmp_path):
+        cmd = main.build_single_pass_command(
+            [(Path('a.m4a'), 30, 60), (Path('b.mp3'), None, None)], tmp_path / 'out.mp3')
+        assert cmd[:8] == ['ffmpeg', '-y', '-ss', '30', '-t', '60', '-i', 'a.m4a']
+        assert cmd[8:10] == ['-i', 'b.mp3']
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        assert '[0:a]aresample=44100' in graph and '[1:a]aresample=44100' in graph
+        assert graph.endswith('[a0][a1]concat=n=2:v=0:a=1[out]')
+        assert cmd[-1] == str(tmp_path / 'out.mp3')
+
+    def test_process_audio_encodes_once(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        source = tmp_path / 'src.m4a'
+        source.write_bytes(b'full')
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 200)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (source, start))
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            Path(cmd[-1]).write_bytes(b'mix')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        timeline = [
+            {'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 10}},
+            {'type': 'effect', 'effect': {'id': 'vine_boom'}},
+            {'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': 'data:audio/webm;base64,aGk='}},
+        ]
+        out = main.process_audio({'timeline': timeline, 'renderMode': 'single_pass'})
+        assert len(calls) == 1
+        assert calls[0].count('-i') == 3
+        assert Path(out).read_bytes() == b'mix'
+        # Rendered into the partial file, then published under the final name.
+        assert calls[0][-1].endswith('.partial.mp3')
+        assert not any(p.name.endswith('.partial.mp3') for p in tmp_path.iterdir())
+
+    def test_unknown_render_mode(self):
+        import pytest
+        with pytest.raises(ValueError):
+            main.process_audio({'timeline': [], 'renderMode': 'turbo'})
+
+
+class TestConcat:
+    URL = 'https://youtu.be/dQw4w9WgXcQ'
+
+    @pytest.fixture
+    def render(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 200)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            if '-c' in cmd and getattr(self, 'copy_fails', False):
+                raise main.subprocess.CalledProcessError(1, cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        timeline = [{'type': 'song', 'song': {'url': self.URL, 'start': 10}},
+                    {'type': 'effect', 'effect': {'id': 'vine_boom'}}]
+
+        def render(**settings):
+            calls.clear()
+            return main.process_audio({'timeline': timeline, **settings}), calls
+        return render
+
+    def test_items_in_the_output_format_are_joined_without_reencoding(self, render):
+        out, calls = render()
+        concat = calls[-1]
+        assert concat[concat.index('-c') + 1] == 'copy' and 'libmp3lame' not in concat
+        assert out.endswith('.mp3')
+
+    def test_encode_mode_and_failed_copy_reencode(self, render, monkeypatch):
+        monkeypatch.setattr(main, 'CONCAT_MODE', 'encode')
+        _, calls = render()
+        assert '-c' not in calls[-1] and 'libmp3lame' in calls[-1]
+        monkeypatch.setattr(main, 'CONCAT_MODE', 'copy')
+        self.copy_fails = True
+        out, calls = render()
+        assert '-c' in calls[-2] and 'libmp3lame' in calls[-1]
+        assert Path(out).exists()
+
+    def test_profile_reaches_every_item_encode_and_the_cache_keys(self, render):
+        out, calls = render(outputProfile='opus')
+        assert out.endswith('.opus') and main.find_output(Path(out).stem[len('club100_'):]) == Path(out)
+        # Song trim and effect normalization both encode to the profile, so the join is a copy.
+        assert len(calls) == 3 and all('libopus' in cmd for cmd in calls[:-1])
+        assert calls[-1][calls[-1].index('-c') + 1] == 'copy'
+        opus_key = main.segment_cache_key('dQw4w9WgXcQ', 10, encode_args=PROFILES['opus'].codec_args)
+        assert main.lookup_segment(opus_key, PROFILES['opus']) is not None
+        assert main.lookup_segment(main.segment_cache_key('dQw4w9WgXcQ', 10)) is None
+
+    def test_single_pass_uses_the_profile_sample_rate(self, tmp_path):
+        cmd = main.build_single_pass_command([(Path('a.m4a'), 0, 60)], tmp_path / 'out.opus', PROFILES['opus'])
+        assert 'aresample=48000' in cmd[cmd.index('-filter_complex') + 1]
+        assert cmd[-3:] == ['-f', 'ogg', str(tmp_path / 'out.opus')]
+
+    def test_unknown_profile(self):
+        with pytest.raises(ValueError):
+            main.process_audio({'timeline': [], 'outputProfile': 'flac'})
+
+
+class TestDraftRender:
+    URL = 'https://youtu.be/dQw4w9WgXcQ'
+
+    def test_full_render_reuses_the_drafts_starts_and_sources(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        windows = []
+
+        def fake_window(url, start):
+            windows.append(start)
+            return tmp_path / 'song.m4a', 0
+        monkeypatch.setattr(main, 'ensure_source_window', fake_window)
+        trims = []
+
+        def fake_run(cmd, **kwargs):
+            if '-ss' in cmd:
+                trims.append(cmd)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        timeline = [{'type': 'song', 'song': {'url': self.URL}}]
+        main.process_audio({'timeline': timeline, 'draft': True, 'outputProfile': 'opus'}, job_id='draft')
+        draft_trim = trims[-1]
+        assert draft_trim[draft_trim.index('-t') + 1] == str(main.DRAFT_SONG_SECONDS)
+        assert draft_trim[draft_trim.index('-ac') + 1] == '1'
+        # Nothing counted towards the hot-song policy yet: the full render is the real request.
+        assert (main.METADATA.get('dQw4w9WgXcQ') or {}).get('requests', 0) == 0
+
+        main.process_audio({'timeline': timeline, 'previousJobId': 'draft'}, job_id='full')
+        full_trim = trims[-1]
+        assert full_trim[full_trim.index('-t') + 1] == str(main.SONG_SECONDS)
+        assert windows[0] == windows[1]
+        assert (tmp_path / 'club100_draft.mp3').exists() and (tmp_path / 'club100_full.mp3').exists()
+
+
+class TestMetadataCache:
+    URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    @pytest.fixture
+    def store(self):
+        return main.METADATA
+
+    def test_parse_probe_line(self):
+        vid, info = main.parse_probe_line('dQw4w9WgXcQ\t212.0\twebm\t251\tNever Gonna\tGive You Up')
+        assert vid == 'dQw4w9WgXcQ'
+        assert info == {'duration': 212, 'ext': 'webm', 'formatId': '251', 'title': 'Never Gonna\tGive You Up'}
+        assert main.parse_probe_line('ERROR: unavailable') is None
+        assert main.parse_probe_line('dQw4w9WgXcQ\tNA\twebm\t251\tLive') is None
+
+    def test_cached_duration_needs_no_subprocess(self, store, monkeypatch):
+        store.put('dQw4w9WgXcQ', {'duration': 212})
+
+        def fail(*args, **kwargs):
+            raise AssertionError('cached metadata must not spawn yt-dlp')
+
+        monkeypatch.setattr(main.subprocess, 'run', fail)
+        assert main.get_youtube_duration(self.URL) == 212
+
+    def test_prefetch_batches_uncached_urls(self, store, monkeypatch):
+        store.put('aaaaaaaaaaa', {'duration': 100})
+        monkeypatch.setattr(main, 'METADATA_BATCH_SIZE', 2)
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            urls = [a for a in cmd if a.startswith('https://')]
+            out = ''.join(f'{main.extract_youtube_id(u)}\t90\tm4a\t140\tT\n' for u in urls)
+            return subprocess.CompletedProcess(cmd, 0, stdout=out, stderr='')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        urls = [f'https://youtu.be/{c * 11}' for c in 'abcd'] + ['https://youtu.be/bbbbbbbbbbb', 'https://evil.com/x']
+        infos = main.prefetch_metadata(urls)
+        # 'a' is cached and 'b' is deduplicated: three URLs -> two batched processes.
+        assert len(calls) == 2
+        assert sorted(infos) == ['bbbbbbbbbbb', 'ccccccccccc', 'ddddddddddd']
+        assert main.get_youtube_duration('https://youtu.be/ccccccccccc') == 90
+
+
+class TestSectionDownloads:
+    URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    class FakeEngine:
+        def __init__(self):
+            self.calls = []
+
+        def download(self, url, out_path, section=None):
+            self.calls.append((url, section))
+            Path(out_path).write_bytes(b'audio')
+            return {'dQw4w9WgXcQ': {'duration': 600}}
+
+    def test_fetches_only_the_window_and_caches_it(self, monkeypatch):
+        engine = self.FakeEngine()
+        monkeypatch.setattr(main, 'YTDLP', engine)
+        path, offset = main.ensure_source_window(self.URL, 120)
+        assert engine.calls == [(self.URL, (120, 180))]
+        assert offset == 0 and path.read_bytes() == b'audio'
+        assert main.ensure_source_window(self.URL, 120) == (path, 0)
+        assert len(engine.calls) == 1
+
+    def test_section_hit_counts_no_full_miss(self, monkeypatch):
+        monkeypatch.setattr(main, 'YTDLP', self.FakeEngine())
+        main.ensure_source_window(self.URL, 120)
+        main.ensure_source_window(self.URL, 120)
+        stats = main.CACHE.stats()
+        assert stats['full']['misses'] == 0
+        assert stats['sections']['hits'] == 1
+
+    def test_hot_song_is_cached_in_full(self, monkeypatch):
+        engine = self.FakeEngine()
+        monkeypatch.setattr(main, 'YTDLP', engine)
+        monkeypatch.setattr(main, 'HOT_SONG_THRESHOLD', 2)
+        main.METADATA.increment(['dQw4w9WgXcQ', 'dQw4w9WgXcQ'])
+        path, offset = main.ensure_source_window(self.URL, 120)
+        assert engine.calls == [(self.URL, None)]
+        assert path.name == 'dQw4w9WgXcQ.full.m4a' and offset == 120
+
+    def test_existing_full_download_is_reused(self, monkeypatch, isolated_cache):
+        (isolated_cache / 'dQw4w9WgXcQ.full.m4a').write_bytes(b'full')
+        engine = self.FakeEngine()
+        monkeypatch.setattr(main, 'YTDLP', engine)
+        assert main.ensure_source_window(self.URL, 30) == (isolated_cache / 'dQw4w9WgXcQ.full.m4a', 30)
+        assert engine.calls == []
+
+
+class TestHighlightStarts:
+    URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    def test_full_download_is_indexed_once_and_steers_the_start(self, monkeypatch):
+        np = pytest.importorskip('numpy')
+        import highlights
+        monkeypatch.setattr(main, 'HIGHLIGHT_INDEX', True)
+        monkeypatch.setattr(main, 'YTDLP', TestSectionDownloads.FakeEngine())
+        # 300 s of near-silence with a loud, busy stretch from 200 s to 280 s.
+        rate = highlights.ANALYSIS_RATE
+        pcm = np.full(300 * rate, 0.001, dtype=np.float32)
+        pcm[200 * rate:280 * rate:rate // 4] = 0.8
+        pcm[200 * rate:280 * rate] += 0.1
+        decodes = []
+
+        def fake_run(cmd, **kwargs):
+            decodes.append(cmd)
+            pcm.tofile(cmd[-1])
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        queued = []
+        queue = main._queue_highlight_index
+        monkeypatch.setattr(main, '_queue_highlight_index', lambda *args: queued.append(queue(*args)))
+        path = main.ensure_cached_source(self.URL)
+        queued[0].result(timeout=10)
+        assert main.ensure_cached_source(self.URL) == path
+        assert queued[1] is None
+        assert len(decodes) == 1 and decodes[0][decodes[0].index('-i') + 1] == str(path)
+        starts = {main.choose_song_start(300, video_id='dQw4w9WgXcQ') for _ in range(20)}
+        assert all(190 <= s <= 220 for s in starts)
+        # No scratch PCM is left behind, only the index.
+        assert [p.name for p in main.HIGHLIGHT_DIR.iterdir()] == ['dQw4w9WgXcQ.npy']
+
+    def test_without_index_start_stays_random(self, monkeypatch):
+        monkeypatch.setattr(main, 'HIGHLIGHT_INDEX', True)
+        assert 0 <= main.choose_song_start(300, video_id='unindexed') <= 240
+
+
+class TestLoudnessNormalization:
+    URL = 'https://youtu.be/dQw4w9WgXcQ'
+    REPORT = '{"input_i": "-20.00", "input_tp": "-6.00", "input_lra": "5.00", "input_thresh": "-30.00"}'
+
+    @pytest.fixture
+    def runs(self, monkeypatch):
+        monkeypatch.setattr(main, 'LOUDNESS_NORMALIZE', True)
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            if 'loudnorm=print_format=json' in cmd:
+                return subprocess.CompletedProcess(cmd, 0, '', self.REPORT)
+            Path(cmd[-1]).write_bytes(b'audio')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        return calls
+
+    @staticmethod
+    def analyses(calls):
+        return [c for c in calls if 'loudnorm=print_format=json' in c]
+
+    def test_song_window_is_analyzed_once_and_gain_applied_in_the_trim(self, runs, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', 0))
+        timeline = [{'type': 'song', 'song': {'url': self.URL, 'start': 42}}]
+        main.process_audio({'timeline': timeline, 'draft': True})
+        main.process_audio({'timeline': timeline, 'outputProfile': 'opus'})
+        assert len(self.analyses(runs)) == 1
+        # Draft and full render measured the same full window: same gain, min(-16 - -20, -1.5 - -6).
+        trims = [c for c in runs if '-ss' in c and c not in self.analyses(runs)]
+        assert len(trims) == 2
+        assert all(c[c.index('-af') + 1] == 'volume=4.0dB' for c in trims)
+        assert main.LOUDNESS.get('song:dQw4w9WgXcQ:42:60')['inputI'] == -20.0
+
+    def test_snippet_is_analyzed_once_across_profiles(self, runs):
+        snippet_id = main.store_snippet(b'clip')
+        mp3 = main.normalized_snippet(snippet_id)
+        main.normalized_snippet(snippet_id, PROFILES['opus'])
+        assert len(self.analyses(runs)) == 1
+        # Normalized copies never share a name with an unnormalized one.
+        assert mp3.name != f"{snippet_id}.mp3"
+
+    def test_single_pass_applies_cached_gain_in_the_graph(self, runs, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 600)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        timeline = [{'type': 'song', 'song': {'url': self.URL, 'start': 42}},
+                    {'type': 'effect', 'effect': {'id': 'vine_boom'}}]
+        for _ in range(2):
+            main.process_audio({'timeline': timeline, 'renderMode': 'single_pass'})
+        assert len(self.analyses(runs)) == 2
+        graph = runs[-1][runs[-1].index('-filter_complex') + 1]
+        assert '[0:a]volume=4.0dB,aresample' in graph and '[1:a]volume=4.0dB,aresample' in graph
+
+    def test_target_is_part_of_the_segment_key(self, monkeypatch):
+        monkeypatch.setattr(main, 'LOUDNESS_NORMALIZE', True)
+        normalized = main.segment_cache_key('vid', 30)
+        monkeypatch.setattr(main, 'LOUDNESS_TARGET_I', -14.0)
+        assert main.segment_cache_key('vid', 30) != normalized
+
+
+class TestSnippetCache:
+    DATA_URL = 'data:audio/webm;codecs=opus;base64,aGVsbG8='
+
+    def test_store_is_content_addressed(self):
+        a = main.store_snippet(b'hello')
+        assert a == main.store_snippet(b'hello')
+        assert a != main.store_snippet(b'other')
+        assert main.lookup_snippet_source(a).read_bytes() == b'hello'
+        assert main.lookup_snippet_source('not-an-id') is None
+
+    def test_decode_data_url_with_codec_parameters(self):
+        assert main.decode_data_url(self.DATA_URL) == b'hello'
+        assert main.decode_data_url('aGVsbG8=') == b'hello'
+
+    def test_repeated_snippet_is_decoded_and_encoded_once(self, monkeypatch):
+        encodes = []
+
+        def fake_run(cmd, **kwargs):
+            encodes.append(cmd)
+            Path(cmd[-1]).write_bytes(b'normalized')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        decodes = []
+        real_decode = main.decode_data_url
+        monkeypatch.setattr(main, 'decode_data_url', lambda url: decodes.append(url) or real_decode(url))
+        memo = {}
+        snippet = {'type': 'upload', 'audioUrl': self.DATA_URL}
+        ids = {main.resolve_snippet(snippet, memo) for _ in range(5)}
+        assert len(ids) == 1 and len(decodes) == 1
+        snippet_id = ids.pop()
+        paths = {main.normalized_snippet(snippet_id) for _ in range(5)}
+        assert len(paths) == 1 and len(encodes) == 1
+        assert main.resolve_snippet({'type': 'upload', 'snippetId': snippet_id}, {}) == snippet_id
+
+    def test_unknown_snippet_id_is_skipped(self):
+        assert main.resolve_snippet({'type': 'upload', 'snippetId': 'f' * 64}, {}) is None
+        assert main.resolve_snippet({'type': 'tts'}, {}) is None
+
+
+class TestEffectLibrary:
+    @pytest.fixture
+    def encodes(self, monkeypatch):
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append(cmd)
+            Path(cmd[-1]).write_bytes(b'normalized')
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        return calls
+
+    def test_prepare_skips_unchanged_effects(self, encodes):
+        main.prepare_effects()
+        assert len(encodes) == len(main.EFFECTS)
+        main.prepare_effects()
+        assert len(encodes) == len(main.EFFECTS)
+
+    def test_changed_source_is_rebuilt(self, encodes, tmp_path):
+        effect = tmp_path / 'boom.mp3'
+        effect.write_bytes(b'v1')
+        first = main.normalized_effect_path(effect)
+        assert main.normalized_effect_path(effect) == first and len(encodes) == 1
+        effect.write_bytes(b'version two')
+        main.normalized_effect_path(effect)
+        assert len(encodes) == 2
+
+    def test_built_effect_is_served_without_the_manifest_lock(self, encodes, tmp_path):
+        effect = tmp_path / 'boom.mp3'
+        effect.write_bytes(b'v1')
+        built = main.normalized_effect_path(effect)
+        result = []
+        # Another effect (or startup precompute) updating the manifest must not hold this one up.
+        with main._effects_lock:
+            worker = threading.Thread(target=lambda: result.append(main.normalized_effect_path(effect)))
+            worker.start()
+            worker.join(2)
+            finished = not worker.is_alive()
+        worker.join()
+        assert finished and result == [built] and len(encodes) == 1
+
+
+class TestPcmRender:
+    def test_assembles_overlay_and_encodes_once(self, tmp_path, monkeypatch):
+        np = pytest.importorskip('numpy')
+        import pcm_mixer
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        monkeypatch.setattr(main, 'prefetch_metadata', lambda urls: {})
+        monkeypatch.setattr(main, 'get_youtube_duration', lambda url: 200)
+        monkeypatch.setattr(main, 'ensure_source_window', lambda url, start: (tmp_path / 'song.m4a', start))
+        lengths = {'song.m4a': 8, 'vine-boom.mp3': 2}
+
+        def fake_decode(path, dest, start=None, duration=None, timeout=None):
+            return np.ones((lengths[Path(path).name], 2), dtype=np.float32) * 0.25
+
+        encoded = []
+
+        def fake_encode(pcm, output_path, encode_args, timeout=None):
+            encoded.append(np.array(pcm))
+            Path(output_path).write_bytes(b'mix')
+
+        monkeypatch.setattr(pcm_mixer, 'decode_to_pcm', fake_decode)
+        monkeypatch.setattr(pcm_mixer, 'encode_pcm', fake_encode)
+        timeline = [
+            {'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 10}},
+            {'type': 'effect', 'effect': {'id': 'vine_boom'}, 'overlay': True},
+            {'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 20}},
+        ]
+        out = main.process_audio({'timeline': timeline, 'renderMode': 'pcm'})
+        assert Path(out).read_bytes() == b'mix'
+        assert len(encoded) == 1
+        mix = encoded[0][:, 0]
+        assert len(mix) == 16
+        assert mix[6:8].tolist() == pytest.approx([0.5, 0.5])
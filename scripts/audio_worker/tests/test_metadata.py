@@ -0,0 +1,67 @@
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from metadata import MetadataStore  # noqa: E402
+
+
+class TestMetadataStore:
+    def test_persists_across_instances(self, tmp_path):
+        path = tmp_path / 'index' / 'metadata.json'
+        MetadataStore(path).put('vid', {'duration': 120, 'title': 'Song'})
+        entry = MetadataStore(path).get('vid')
+        assert entry['duration'] == 120
+        assert entry['title'] == 'Song'
+
+    def test_put_merges_and_ignores_none(self, tmp_path):
+        store = MetadataStore(tmp_path / 'metadata.json')
+        store.put('vid', {'duration': 120, 'title': 'Song'})
+        store.put('vid', {'duration': 121, 'title': None})
+        assert store.get('vid')['duration'] == 121
+        assert store.get('vid')['title'] == 'Song'
+        assert 'vid' in store and 'other' not in store
+
+    def test_corrupt_index_starts_empty(self, tmp_path):
+        path = tmp_path / 'metadata.json'
+        path.write_text('{not json')
+        assert MetadataStore(path).get('vid') is None
+
+    def test_increment_counts_repeats(self, tmp_path):
+        path = tmp_path / 'metadata.json'
+        MetadataStore(path).increment(['a', 'b', 'a'])
+        store = MetadataStore(path)
+        assert store.get('a')['requests'] == 2
+        assert store.get('b')['requests'] == 1
+
+    def test_pop_field_removes_and_persists(self, tmp_path):
+        path = tmp_path / 'metadata.json'
+        store = MetadataStore(path)
+        store.put('vid', {'duration': 200, 'prefetchedStart': 42})
+        assert store.pop_field('vid', 'prefetchedStart') == 42
+        assert store.pop_field('vid', 'prefetchedStart') is None
+        assert MetadataStore(path).get('vid') == {'duration': 200, 'updatedAt': store.get('vid')['updatedAt']}
+
+
+def _run_in_process(path, code):
+    """Start a separate Python process that runs code with `store` open on path."""
+    script = f"from metadata import MetadataStore\nstore = MetadataStore({str(path)!r})\n{code}\n"
+    return subprocess.Popen([sys.executable, '-c', script], cwd=str(Path(__file__).resolve().parents[1]))
+
+
+class TestSharedAcrossProcesses:
+    def test_write_from_another_process_is_seen(self, tmp_path):
+        path = tmp_path / 'metadata.json'
+        store = MetadataStore(path)
+        store.put('vid', {'duration': 200})
+        assert _run_in_process(path, "store.put('vid', {'prefetchedStart': 42})").wait(timeout=30) == 0
+        assert store.pop_field('vid', 'prefetchedStart') == 42
+        assert MetadataStore(path).get('vid')['duration'] == 200
+
+    def test_concurrent_increments_are_not_lost(self, tmp_path):
+        path = tmp_path / 'metadata.json'
+        code = "for _ in range(50):\n    store.increment(['vid'])"
+        procs = [_run_in_process(path, code) for _ in range(2)]
+        assert [p.wait(timeout=60) for p in procs] == [0, 0]
+        assert MetadataStore(path).get('vid')['requests'] == 100
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from metrics import Registry, gauge_lines  # noqa: E402
+
+
+class TestMetrics:
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        hist = registry.histogram('job_seconds', 'Job time.', buckets=(1, 5), labels=('status',))
+        for value in (0.5, 1, 3, 10):
+            hist.observe(value, status='done')
+        text = registry.render()
+        assert '# TYPE job_seconds histogram' in text
+        assert 'job_seconds_bucket{status="done",le="1"} 2' in text
+        assert 'job_seconds_bucket{status="done",le="5"} 3' in text
+        assert 'job_seconds_bucket{status="done",le="+Inf"} 4' in text
+        assert 'job_seconds_sum{status="done"} 14.5' in text
+        assert 'job_seconds_count{status="done"} 4' in text
+
+    def test_counter_and_collectors(self):
+        registry = Registry()
+        counter = registry.counter('spawned_total', 'Processes.', labels=('tool',))
+        counter.inc(tool='ffmpeg')
+        counter.inc(2, tool='ffmpeg')
+        registry.add_collector(lambda: gauge_lines('pending', 'Pending.', [(('net',), 3)], labels=('lane',)))
+        text = registry.render()
+        assert 'spawned_total{tool="ffmpeg"} 3' in text
+        assert 'pending{lane="net"} 3' in text
+        assert counter.value(tool='ffmpeg') == 3
+
+    def test_label_values_are_escaped(self):
+        registry = Registry()
+        registry.counter('c', 'C.', labels=('name',)).inc(name='a"b')
+        assert 'c{name="a\\"b"} 1' in registry.render()
@@ -0,0 +1,47 @@
+import io
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from output_profiles import DRAFT_PROFILE, OUTPUT_EXTENSIONS, PROFILES, audio_offset, get_profile, mime_type_for  # noqa: E402
+
+
+class TestOutputProfiles:
+    def test_default_mp3_profile_keeps_the_historical_encode(self):
+        # Segment cache keys hash these args, so changing them invalidates every cached segment.
+        assert list(PROFILES['mp3'].codec_args) == ['-ar', '44100', '-ac', '2', '-codec:a', 'libmp3lame',
+                                                    '-b:a', '192k']
+        assert PROFILES['mp3'].cache_suffix == 'mp3'
+
+    def test_profiles_sharing_an_extension_get_distinct_cache_suffixes(self):
+        suffixes = [p.cache_suffix for p in PROFILES.values()]
+        assert len(set(suffixes)) == len(suffixes)
+        assert OUTPUT_EXTENSIONS == ('mp3', 'aac', 'opus')
+
+    def test_lookup_and_mime_types(self):
+        assert get_profile('aac').output_args[-2:] == ['-f', 'adts']
+        with pytest.raises(ValueError):
+            get_profile('wav')
+        assert mime_type_for('club100_x.opus') == 'audio/ogg'
+        assert mime_type_for('club100_x.bin') == 'application/octet-stream'
+
+    def test_audio_offset_skips_a_leading_id3_tag(self):
+        # Syncsafe size 0x01 0x00 = 128 bytes of tag body after the 10-byte header.
+        tag = b'ID3\x04\x00\x00\x00\x00\x01\x00' + b'\x00' * 128
+        audio = b'\xff\xfb\xb0\x00' + b'\x00' * 60
+        assert audio_offset(PROFILES['mp3'], io.BytesIO(tag + audio)) == 138
+        assert audio_offset(PROFILES['mp3'], io.BytesIO(audio)) == 0
+        assert audio_offset(PROFILES['aac'], io.BytesIO(tag + audio)) == 0
+        assert [p.appendable for p in PROFILES.values()] == [True, True, True, False]
+
+    def test_audio_offset_skips_the_info_frame(self):
+        # MPEG-1 192k 44.1kHz stereo: 626-byte frames, tag after 32 bytes of side info.
+        info = b'\xff\xfb\xb0\x00' + b'\x00' * 32 + b'Info'
+        info += b'\x00' * (626 - len(info))
+        audio = b'\xff\xfb\xb0\x00' + b'\x00' * 622
+        assert audio_offset(PROFILES['mp3'], io.BytesIO(info + audio)) == 626
+        # The draft profile's MPEG-2 48k 22.05kHz mono: 156-byte frames, 9 bytes of side info.
+        xing = b'\xff\xf3\x60\xc0' + b'\x00' * 9 + b'Xing'
+        assert audio_offset(DRAFT_PROFILE, io.BytesIO(xing + b'\x00' * 200)) == 156
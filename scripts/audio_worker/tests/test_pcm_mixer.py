@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+np = pytest.importorskip('numpy')
+import pcm_mixer  # noqa: E402
+from pcm_mixer import Clip  # noqa: E402
+
+
+def tone(frames, value):
+    return np.full((frames, pcm_mixer.CHANNELS), value, dtype=np.float32)
+
+
+def render(clips, crossfade=0):
+    out = np.zeros((pcm_mixer.mix_length(clips, crossfade), pcm_mixer.CHANNELS), dtype=np.float32)
+    return pcm_mixer.assemble(clips, out, crossfade)
+
+
+class TestAssemble:
+    def test_concatenates_in_order(self):
+        mix = render([Clip(tone(3, 0.1)), Clip(tone(2, 0.2))])
+        assert mix[:, 0].tolist() == pytest.approx([0.1, 0.1, 0.1, 0.2, 0.2])
+
+    def test_crossfade_overlaps_and_blends(self):
+        mix = render([Clip(tone(4, 1.0)), Clip(tone(4, 0.0))], crossfade=2)
+        assert len(mix) == 6
+        # Linear fade from the first clip to the second across the overlap.
+        assert mix[:, 0].tolist() == pytest.approx([1.0, 1.0, 1.0, 0.0, 0.0, 0.0])
+        mix = render([Clip(tone(4, 0.0)), Clip(tone(4, 1.0))], crossfade=3)
+        assert mix[1:4, 0].tolist() == pytest.approx([0.0, 0.5, 1.0])
+
+    def test_overlay_mixes_over_the_tail(self):
+        mix = render([Clip(tone(5, 0.25)), Clip(tone(2, 0.5), overlay=True), Clip(tone(1, 0.1))])
+        assert mix[:, 0].tolist() == pytest.approx([0.25, 0.25, 0.25, 0.75, 0.75, 0.1])
+
+    def test_overlay_longer_than_mix_extends_it(self):
+        clips = [Clip(tone(2, 0.25)), Clip(tone(3, 0.5), overlay=True)]
+        assert pcm_mixer.mix_length(clips) == 3
+        assert render(clips)[:, 0].tolist() == pytest.approx([0.75, 0.75, 0.5])
+
+    def test_empty_clips_are_ignored(self):
+        assert len(render([Clip(tone(0, 0.0)), Clip(tone(2, 0.3))])) == 2
+
+    def test_gain_scales_each_clip(self):
+        mix = render([Clip(tone(2, 0.2), gain=2.0), Clip(tone(2, 0.5), overlay=True, gain=0.5)])
+        assert mix[:, 0].tolist() == pytest.approx([0.65, 0.65])
+
+
+class TestNormalizePeak:
+    def test_scales_to_target(self):
+        pcm = tone(10, 0.25)
+        pcm[3] = -0.5
+        pcm_mixer.normalize_peak(pcm, target_dbfs=0.0, chunk_frames=4)
+        assert float(np.abs(pcm).max()) == pytest.approx(1.0)
+        assert float(pcm[0, 0]) == pytest.approx(0.5)
+
+    def test_silence_is_untouched(self):
+        pcm = tone(4, 0.0)
+        pcm_mixer.normalize_peak(pcm)
+        assert not pcm.any()
@@ -0,0 +1,76 @@
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from scheduler import PRIORITY_LOW, Scheduler  # noqa: E402
+
+
+class TestScheduler:
+    def test_round_robin_across_jobs(self):
+        scheduler = Scheduler(net_workers=1, cpu_workers=1)
+        gate = threading.Event()
+        order = []
+        # Occupy the only cpu worker so everything below queues up before it runs.
+        blocker = scheduler.submit('cpu', 'blocker', gate.wait)
+        big = [scheduler.submit('cpu', 'big', order.append, f'big{n}') for n in range(4)]
+        small = [scheduler.submit('cpu', 'small', order.append, f'small{n}') for n in range(2)]
+        gate.set()
+        for future in [blocker, *big, *small]:
+            future.result(timeout=5)
+        assert order == ['big0', 'small0', 'big1', 'small1', 'big2', 'big3']
+
+    def test_low_priority_waits_for_normal_work(self):
+        scheduler = Scheduler(net_workers=1, cpu_workers=1)
+        gate = threading.Event()
+        order = []
+        blocker = scheduler.submit('net', 'job', gate.wait)
+        low = scheduler.submit('net', 'prefetch', order.append, 'prefetch', priority=PRIORITY_LOW)
+        normal = scheduler.submit('net', 'job', order.append, 'render')
+        gate.set()
+        for future in (blocker, low, normal):
+            future.result(timeout=5)
+        assert order == ['render', 'prefetch']
+
+    def test_then_runs_on_next_lane_with_upstream_result(self):
+        scheduler = Scheduler(net_workers=1, cpu_workers=1)
+        lanes = []
+
+        def download():
+            lanes.append(threading.current_thread().name)
+            return 'source.m4a'
+
+        def encode(source):
+            lanes.append(threading.current_thread().name)
+            return source + '.mp3'
+
+        future = scheduler.then(scheduler.submit('net', 'job', download), 'cpu', 'job', encode)
+        assert future.result(timeout=5) == 'source.m4a.mp3'
+        assert lanes == ['club100-net-0', 'club100-cpu-0']
+
+    def test_encode_does_not_wait_for_other_downloads(self):
+        scheduler = Scheduler(net_workers=2, cpu_workers=1)
+        slow_gate = threading.Event()
+        encoded = threading.Event()
+        slow = scheduler.submit('net', 'job', slow_gate.wait)
+        fast = scheduler.then(scheduler.submit('net', 'job', lambda: 'fast'), 'cpu', 'job',
+                              lambda value: encoded.set())
+        # The fast item's encode finishes while the slow download is still in flight.
+        fast.result(timeout=5)
+        assert encoded.is_set() and not slow.done()
+        slow_gate.set()
+        slow.result(timeout=5)
+
+    def test_failed_upstream_skips_downstream(self):
+        scheduler = Scheduler(net_workers=1, cpu_workers=1)
+        ran = []
+
+        def fail():
+            raise RuntimeError('download failed')
+
+        future = scheduler.then(scheduler.submit('net', 'job', fail), 'cpu', 'job', ran.append)
+        with pytest.raises(RuntimeError, match='download failed'):
+            future.result(timeout=5)
+        assert ran == []
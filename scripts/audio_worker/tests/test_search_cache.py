@@ -0,0 +1,82 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from search_cache import SearchCache, normalize_query  # noqa: E402
+
+
+def _fetch_counting(calls):
+    def fetch(query):
+        calls.append(query)
+        return [{'title': query}]
+    return fetch
+
+
+class TestSearchCache:
+    def test_normalize_query(self):
+        assert normalize_query('  Never\tGonna  GIVE ') == 'never gonna give'
+
+    def test_concurrent_identical_queries_share_one_search(self, tmp_path):
+        cache = SearchCache(tmp_path / 'search.json', ttl=60, max_entries=10)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_fetch(query):
+            calls.append(query)
+            started.set()
+            release.wait(5)
+            return [{'title': query}]
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.search('abba', slow_fetch)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(cache.search('ABBA', slow_fetch)))
+        follower.start()
+        # Give the follower time to join the in-flight search before it completes.
+        time.sleep(0.05)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        assert calls == ['abba']
+        assert sorted(source for _, source in results) == ['miss', 'shared']
+
+    def test_prefix_served_from_shortest_longer_query(self, tmp_path):
+        cache = SearchCache(tmp_path / 'search.json', ttl=60, max_entries=10, prefix_min_chars=3)
+        cache.put('queen bohemian rhapsody live', [{'title': 'live'}])
+        cache.put('queen bohemian', [{'title': 'short'}])
+        assert cache.get_prefix('queen boh') == [{'title': 'short'}]
+        assert cache.get_prefix('qu') is None
+        assert cache.get_prefix('queens') is None
+
+    def test_lru_bound_and_ttl(self, tmp_path, monkeypatch):
+        cache = SearchCache(tmp_path / 'search.json', ttl=60, max_entries=2)
+        for query in ('a', 'b'):
+            cache.put(query, [])
+        cache.get('a')
+        cache.put('c', [])
+        assert cache.get('b') is None and cache.get('a') == [] and len(cache) == 2
+        later = time.time() + 120
+        monkeypatch.setattr('search_cache.time.time', lambda: later)
+        assert cache.get('a') is None
+
+    def test_persists_across_restarts(self, tmp_path):
+        calls = []
+        SearchCache(tmp_path / 'search.json', ttl=60, max_entries=10).search('abba', _fetch_counting(calls))
+        reloaded = SearchCache(tmp_path / 'search.json', ttl=60, max_entries=10)
+        assert reloaded.search('abba', _fetch_counting(calls)) == ([{'title': 'abba'}], 'hit')
+        assert calls == ['abba']
+
+    def test_errors_are_not_cached(self, tmp_path):
+        cache = SearchCache(tmp_path / 'search.json', ttl=60, max_entries=10)
+
+        def broken(query):
+            raise RuntimeError('yt-dlp failed')
+
+        with pytest.raises(RuntimeError):
+            cache.search('abba', broken)
+        assert cache.get('abba') is None
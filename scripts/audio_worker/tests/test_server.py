@@ -1,10 +1,38 @@
+import base64
+import hashlib
+import io
 import sys
+import threading
+import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 import pytest  # noqa: E402
+import main  # noqa: E402
 import server  # noqa: E402
+from shared_queue import QueueWorker  # noqa: E402
+
+
+def _wait_for_job(client, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        body = client.get(f'/jobs/{job_id}').get_json()
+        if body['status'] in ('done', 'error'):
+            return body
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+@pytest.fixture(autouse=True)
+def isolated_search_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'SEARCH_CACHE', server.SearchCache(tmp_path / 'search.json', 60, 100))
+
+
+@pytest.fixture(autouse=True)
+def no_background_tasks(monkeypatch):
+    # Requests would otherwise start the janitor on the real cache and normalize the real effects.
+    monkeypatch.setattr(server, '_background_started', True)
 
 
 @pytest.fixture
@@ -26,6 +54,22 @@ class TestBuildTimelineFromLegacy:
         assert timeline[0]['song']['url'] == 'u1'
 
 
+class TestBackgroundTasks:
+    def test_first_request_starts_them_once(self, client, monkeypatch):
+        started = []
+
+        class FakeCache:
+            def start_janitor(self, interval):
+                started.append(interval)
+
+        monkeypatch.setattr(server, '_background_started', False)
+        monkeypatch.setattr(server, 'CACHE', FakeCache())
+        monkeypatch.setattr(server, 'prepare_effects', lambda: None)
+        client.get('/effects')
+        client.get('/effects')
+        assert started == [server.CACHE_JANITOR_INTERVAL]
+
+
 class TestEffectsEndpoint:
     def test_lists_effects(self, client):
         resp = client.get('/effects')
@@ -50,24 +94,327 @@ class TestDownloadEndpoint:
         assert resp.status_code == 404
 
 
+class TestStreamEndpoint:
+    def test_rejects_invalid_job_id(self, client):
+        assert client.get('/stream/not-a-uuid').status_code == 400
+
+    def test_unknown_job_returns_404(self, client):
+        assert client.get('/stream/12345678-1234-1234-1234-123456789abc').status_code == 404
+
+    def test_finished_file_supports_range(self, client, monkeypatch, tmp_path):
+        job_id = '12345678-1234-1234-1234-123456789abc'
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        (tmp_path / f'club100_{job_id}.mp3').write_bytes(b'0123456789')
+        resp = client.get(f'/stream/{job_id}', headers={'Range': 'bytes=2-5'})
+        assert resp.status_code == 206
+        assert resp.data == b'2345'
+
+    def test_streams_while_rendering(self, client, monkeypatch, tmp_path):
+        monkeypatch.setattr(server, 'STREAM_POLL_INTERVAL', 0.01)
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        first_chunk_written = threading.Event()
+
+        def fake(_data, job_id=None, progress=None):
+            partial = tmp_path / f'club100_{job_id}.partial.mp3'
+            with open(partial, 'wb') as f:
+                f.write(b'first-')
+                f.flush()
+                first_chunk_written.set()
+                time.sleep(0.1)
+                f.write(b'second')
+            final = tmp_path / f'club100_{job_id}.mp3'
+            partial.replace(final)
+            return str(final)
+
+        monkeypatch.setattr(server, 'process_audio', fake)
+        job_id = client.post('/generate', json={'timeline': []}).get_json()['jobId']
+        assert first_chunk_written.wait(5)
+        resp = client.get(f'/stream/{job_id}')
+        assert resp.status_code == 200
+        assert resp.mimetype == 'audio/mpeg'
+        assert resp.data == b'first-second'
+
+    def test_segments_mix_streams_before_the_last_item_finishes(self, client, monkeypatch, tmp_path):
+        monkeypatch.setattr(server, 'STREAM_POLL_INTERVAL', 0.01)
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        release_last = threading.Event()
+
+        def fake_run(cmd, **kwargs):
+            if 'concat' in cmd:
+                Path(cmd[-1]).write_bytes(b'final mix')
+                return
+            source = Path(cmd[cmd.index('-i') + 1]).read_bytes()
+            if source == b'B':
+                release_last.wait(5)
+            Path(cmd[-1]).write_bytes(b'frames-' + source)
+
+        monkeypatch.setattr(main.subprocess, 'run', fake_run)
+        timeline = [{'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': f'data:audio/webm;base64,{b}'}}
+                    for b in ('QQ==', 'Qg==')]
+        job_id = client.post('/generate', json={'timeline': timeline, 'renderMode': 'segments'}).get_json()['jobId']
+        try:
+            resp = client.get(f'/stream/{job_id}', buffered=False)
+            assert resp.status_code == 200
+            chunks = iter(resp.response)
+            # The first item plays while the last one is still encoding.
+            assert next(chunks) == b'frames-A'
+            assert not release_last.is_set()
+            release_last.set()
+            assert b''.join(chunks) == b'frames-B'
+        finally:
+            release_last.set()
+        assert _wait_for_job(client, job_id)['status'] == 'done'
+        assert client.get(f'/download/{job_id}').data == b'final mix'
+
+    def test_finished_file_is_served_with_its_profile_type(self, client, monkeypatch, tmp_path):
+        job_id = '12345678-1234-1234-1234-123456789abc'
+        monkeypatch.setattr(main, 'OUTPUT_DIR', tmp_path)
+        (tmp_path / f'club100_{job_id}.opus').write_bytes(b'OggS')
+        assert client.get(f'/stream/{job_id}').mimetype == 'audio/ogg'
+        assert client.get(f'/download/{job_id}').mimetype == 'audio/ogg'
+
+
+class TestSnippetsEndpoint:
+    def test_json_data_url_returns_content_handle(self, client):
+        resp = client.post('/snippets', json={'audioUrl': 'data:audio/webm;base64,aGVsbG8='})
+        assert resp.status_code == 201
+        snippet_id = resp.get_json()['snippetId']
+        assert snippet_id == hashlib.sha256(b'hello').hexdigest()
+        # Same audio uploaded another way maps to the same handle.
+        resp = client.post('/snippets', data=b'hello', content_type='audio/webm')
+        assert resp.get_json()['snippetId'] == snippet_id
+
+    def test_multipart_upload(self, client):
+        resp = client.post('/snippets', data={'file': (io.BytesIO(b'cheers'), 'cheers.webm')},
+                           content_type='multipart/form-data')
+        assert resp.status_code == 201
+        assert resp.get_json()['snippetId'] == hashlib.sha256(b'cheers').hexdigest()
+
+    def test_rejects_empty_and_unknown_bodies(self, client):
+        assert client.post('/snippets', data=b'', content_type='audio/webm').status_code == 400
+        assert client.post('/snippets', data='x', content_type='text/plain').status_code == 400
+        assert client.post('/snippets', json={}).status_code == 400
+
+    def test_rejects_forged_marker(self, client):
+        resp = client.post('/snippets', json={'audioUrl': 'club100-snippet:../../etc/passwd'})
+        assert resp.status_code == 400
+        resp = client.post('/snippets', json={'audioUrl': 'club100-snippet:' + 'f' * 64})
+        assert resp.status_code == 404
+
+    def test_generate_streams_inline_audio_into_the_cache(self, client, monkeypatch):
+        submitted = []
+        monkeypatch.setattr(server.jobs, 'submit', lambda data: submitted.append(data) or 'job-1')
+        audio = base64.b64encode(b'ring ring' * 10000).decode('ascii')
+        timeline = [{'type': 'snippet', 'snippet': {'type': 'upload', 'audioUrl': f'data:audio/webm;base64,{audio}'}}]
+        resp = client.post('/generate', json={'timeline': timeline})
+        assert resp.status_code == 202
+        snippet = submitted[0]['timeline'][0]['snippet']
+        assert snippet == {'type': 'upload', 'snippetId': hashlib.sha256(b'ring ring' * 10000).hexdigest()}
+        assert server.lookup_snippet_source(snippet['snippetId']).read_bytes() == b'ring ring' * 10000
+
+    def test_json_left_after_audio_is_capped(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'JSON_MAX_BYTES', 64)
+        resp = client.post('/generate', json={'timeline': [{'type': 'song', 'song': {'url': 'x' * 100}}]})
+        assert resp.status_code == 413
+
+    def test_generate_rejects_unknown_snippet_id(self, client):
+        timeline = [{'type': 'snippet', 'snippet': {'type': 'upload', 'snippetId': 'f' * 64}}]
+        resp = client.post('/generate', json={'timeline': timeline})
+        assert resp.status_code == 400
+        assert resp.get_json()['snippetIds'] == ['f' * 64]
+
+
 class TestGenerateEndpoint:
     def test_rejects_non_json_body(self, client):
         resp = client.post('/generate', data='not json', content_type='text/plain')
         assert resp.status_code == 400
 
+    def test_rejects_unknown_render_mode(self, client):
+        resp = client.post('/generate', json={'timeline': [], 'renderMode': 'turbo'})
+        assert resp.status_code == 400
+
+    def test_rejects_unknown_output_profile(self, client):
+        resp = client.post('/generate', json={'timeline': [], 'outputProfile': 'flac'})
+        assert resp.status_code == 400
+        assert 'opus' in resp.get_json()['error']
+        assert client.post('/generate', json={'timeline': [], 'draft': 'yes'}).status_code == 400
+
+    def test_returns_job_id_immediately(self, client, monkeypatch):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(_data, job_id=None, progress=None):
+            started.set()
+            release.wait(5)
+            raise RuntimeError('cancelled')
+
+        monkeypatch.setattr(server, 'process_audio', slow)
+        resp = client.post('/generate', json={'timeline': []})
+        assert resp.status_code == 202
+        body = resp.get_json()
+        assert body['status'] == 'queued'
+        assert started.wait(5)
+        status = client.get(f"/jobs/{body['jobId']}").get_json()
+        assert status['status'] == 'running'
+        release.set()
+
     def test_error_response_has_no_traceback(self, client, monkeypatch):
-        def boom(_data):
+        def boom(_data, job_id=None, progress=None):
             raise RuntimeError('kaboom')
 
         monkeypatch.setattr(server, 'process_audio', boom)
         resp = client.post('/generate', json={'timeline': []})
-        assert resp.status_code == 500
-        body = resp.get_json()
+        assert resp.status_code == 202
+        body = _wait_for_job(client, resp.get_json()['jobId'])
+        assert body['status'] == 'error'
         assert 'traceback' not in body
         assert body['error'] == 'kaboom'
 
 
+class TestBatchEndpoint:
+    def test_queues_one_job_per_timeline(self, client, monkeypatch, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'mp3')
+        queue = server.JobQueue(lambda data, job_id, progress: str(out), workers=1, max_queued=4)
+        monkeypatch.setattr(server, 'jobs', queue)
+        monkeypatch.setattr(server, 'prepare_batch', lambda datas: (datas, {'sharedSongs': 0}))
+        resp = client.post('/generate/batch', json={'timelines': [[], {'timeline': []}]})
+        assert resp.status_code == 202
+        body = resp.get_json()
+        assert len(body['jobIds']) == 2
+        queue.wait_batch(body['batchId'], timeout=5)
+        batch = client.get(f"/batches/{body['batchId']}").get_json()
+        assert batch['report']['done'] == 2 and batch['plan'] == {'sharedSongs': 0}
+        assert client.get(f"/jobs/{body['jobIds'][0]}").get_json()['status'] == 'done'
+
+    def test_shared_queue_is_served_by_a_separate_worker(self, client, monkeypatch, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'mp3')
+        monkeypatch.setattr(server, 'jobs', server.SharedJobQueue(tmp_path / 'queue.db'))
+        resp = client.post('/generate/batch', json={'timelines': [[], []]})
+        assert resp.status_code == 202
+        body = resp.get_json()
+        assert client.get(f"/jobs/{body['jobIds'][0]}").get_json()['status'] == 'queued'
+        # A worker process would open the same file; nothing renders in the server itself.
+        worker = QueueWorker(server.SharedJobQueue(tmp_path / 'queue.db'), lambda data, job_id, progress: str(out),
+                             lambda datas: (datas, {'sharedSongs': 0}))
+        while worker.run_once():
+            pass
+        batch = client.get(f"/batches/{body['batchId']}").get_json()
+        assert batch['report']['done'] == 2 and batch['plan'] == {'sharedSongs': 0}
+
+    def test_rejects_bad_batches(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'BATCH_MAX_TIMELINES', 1)
+        assert client.post('/generate/batch', json={'timelines': []}).status_code == 400
+        assert client.post('/generate/batch', json={'timelines': [[], []]}).status_code == 400
+        assert client.post('/generate/batch', json={'timelines': [{'timeline': [], 'renderMode': 'x'}]}).status_code == 400
+        assert client.get('/batches/00000000-0000-0000-0000-000000000000').status_code == 404
+
+
+class TestPrefetchEndpoint:
+    def test_accepts_urls_or_timeline(self, client, monkeypatch):
+        seen = []
+        monkeypatch.setattr(server, 'prefetch_songs', lambda songs: seen.append(songs) or songs)
+        resp = client.post('/prefetch', json={'urls': ['https://youtu.be/dQw4w9WgXcQ']})
+        assert resp.status_code == 202 and resp.get_json() == {'queued': 1}
+        timeline = [{'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 30}},
+                    {'type': 'effect', 'effect': {'id': 'vine_boom'}}]
+        assert client.post('/prefetch', json={'timeline': timeline}).status_code == 202
+        assert seen[1] == [{'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 30}]
+
+    def test_rejects_bad_bodies(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'PREFETCH_MAX_SONGS', 2)
+        assert client.post('/prefetch', data='nope').status_code == 400
+        assert client.post('/prefetch', json={'urls': 'x'}).status_code == 400
+        assert client.post('/prefetch', json={'urls': ['a', 'b', 'c']}).status_code == 400
+
+    def test_rejects_non_integer_start_with_its_index(self, client, monkeypatch):
+        monkeypatch.setattr(server, 'prefetch_songs', lambda songs: songs)
+        timeline = [{'type': 'effect', 'effect': {'id': 'vine_boom'}},
+                    {'type': 'song', 'song': {'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': 'soon'}}]
+        resp = client.post('/prefetch', json={'timeline': timeline})
+        assert resp.status_code == 400
+        assert 'timeline[1]' in resp.get_json()['error']
+
+
+class TestJobsEndpoint:
+    def test_rejects_invalid_job_id(self, client):
+        resp = client.get('/jobs/not-a-uuid')
+        assert resp.status_code == 400
+
+    def test_unknown_job_returns_404(self, client):
+        resp = client.get('/jobs/12345678-1234-1234-1234-123456789abc')
+        assert resp.status_code == 404
+
+    def test_done_job_has_download_url(self, client, monkeypatch, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'ID3')
+
+        def fake(_data, job_id=None, progress=None):
+            progress('processing', 1, 1)
+            return str(out)
+
+        monkeypatch.setattr(server, 'process_audio', fake)
+        job_id = client.post('/generate', json={'timeline': [{}]}).get_json()['jobId']
+        body = _wait_for_job(client, job_id)
+        assert body['status'] == 'done'
+        assert body['progress'] == {'done': 1, 'total': 1}
+        assert body['downloadUrl'] == f'/download/{job_id}'
+
+    def test_done_job_has_timing_breakdown(self, client, monkeypatch, tmp_path):
+        out = tmp_path / 'out.mp3'
+        out.write_bytes(b'ID3')
+
+        def fake(_data, job_id=None, progress=None):
+            with server.tracing.span('concat', tool='ffmpeg'):
+                pass
+            return str(out)
+
+        monkeypatch.setattr(server, 'process_audio', fake)
+        job_id = client.post('/generate', json={'timeline': [{}]}).get_json()['jobId']
+        timings = _wait_for_job(client, job_id)['timings']
+        assert timings['stages']['concat']['count'] == 1
+        assert timings['subprocesses'] == 1
+        assert timings['renderSeconds'] >= 0 and timings['queueWaitSeconds'] >= 0
+
+
+class TestMetricsEndpoint:
+    def test_exposes_histograms_and_cache_counters(self, client):
+        resp = client.get('/metrics')
+        assert resp.status_code == 200 and resp.mimetype == 'text/plain'
+        text = resp.get_data(as_text=True)
+        for name in ('club100_queue_wait_seconds', 'club100_render_seconds', 'club100_download_bytes',
+                     'club100_job_subprocesses', 'club100_cache_bytes', 'club100_scheduler_pending'):
+            assert f'# TYPE {name}' in text
+
+
 class TestYtSearchEndpoint:
     def test_missing_query(self, client):
         resp = client.post('/ytsearch', json={})
         assert resp.status_code == 400
+
+    def test_maps_engine_results_to_songs(self, client, monkeypatch):
+        class FakeEngine:
+            def search(self, query, limit=5, timeout=None):
+                return [{'id': 'abc', 'title': query, 'uploader': 'Artist', 'thumbnail': 't.jpg'}]
+
+        monkeypatch.setattr(server, 'YTDLP', FakeEngine())
+        resp = client.post('/ytsearch', json={'query': 'abba'})
+        assert resp.get_json() == [{
+            'url': 'https://www.youtube.com/watch?v=abc', 'title': 'abba', 'artist': 'Artist', 'thumbnail': 't.jpg'}]
+
+    def test_repeated_and_prefix_queries_are_served_from_cache(self, client, monkeypatch):
+        calls = []
+
+        class FakeEngine:
+            def search(self, query, limit=5, timeout=None):
+                calls.append(query)
+                return [{'id': 'abc', 'title': query, 'uploader': 'Artist', 'thumbnail': 't.jpg'}]
+
+        monkeypatch.setattr(server, 'YTDLP', FakeEngine())
+        first = client.post('/ytsearch', json={'query': 'ABBA  Waterloo'})
+        again = client.post('/ytsearch', json={'query': 'abba waterloo '})
+        prefix = client.post('/ytsearch', json={'query': 'abba wat'})
+        assert [r.headers['X-Search-Cache'] for r in (first, again, prefix)] == ['miss', 'hit', 'prefix']
+        assert prefix.get_json() == first.get_json()
+        assert calls == ['abba waterloo']
@@ -0,0 +1,148 @@
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from jobs import QueueFullError  # noqa: E402
+from shared_queue import QueueWorker, SharedJobQueue  # noqa: E402
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SharedJobQueue(tmp_path / 'queue.db', max_queued=5, lease_seconds=60)
+
+
+def _output(tmp_path):
+    out = tmp_path / 'out.mp3'
+    out.write_bytes(b'x')
+    return str(out)
+
+
+class TestSharedJobQueue:
+    def test_worker_renders_job_submitted_by_another_queue_handle(self, queue, tmp_path):
+        seen = []
+
+        def render(data, job_id, progress):
+            seen.append(data)
+            progress('processing', 1, 1)
+            return _output(tmp_path)
+
+        # The API server and the worker each open the database file themselves.
+        job_id = queue.submit({'timeline': [{'type': 'song'}]})
+        assert queue.get(job_id)['status'] == 'queued'
+        assert queue.position(job_id) == 0
+        worker = QueueWorker(SharedJobQueue(tmp_path / 'queue.db'), render)
+        assert worker.run_once()
+        assert not worker.run_once()
+
+        job = queue.get(job_id)
+        assert seen == [{'timeline': [{'type': 'song'}]}]
+        assert job['status'] == 'done' and job['finishedAt'] is not None
+        assert job['progress'] == {'done': 1, 'total': 1}
+        assert job['timings']['renderSeconds'] >= 0
+
+    def test_uses_the_rollback_journal(self, queue, tmp_path):
+        with sqlite3.connect(tmp_path / 'queue.db') as db:
+            assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+
+    def test_position_skips_batch_jobs_still_planning(self, queue):
+        queue.submit_batch([{}, {}])
+        job_id = queue.submit({})
+        assert queue.position(job_id) == 0
+
+    def test_render_errors_are_recorded(self, queue):
+        def render(data, job_id, progress):
+            raise RuntimeError('boom')
+
+        job_id = queue.submit({})
+        QueueWorker(queue, render).run_once()
+        job = queue.get(job_id)
+        assert job['status'] == 'error' and job['error'] == 'boom'
+
+    def test_rejects_when_full(self, queue):
+        for _ in range(5):
+            queue.submit({})
+        with pytest.raises(QueueFullError):
+            queue.submit({})
+        with pytest.raises(QueueFullError):
+            queue.submit_batch([{}])
+
+    def test_job_of_a_lost_worker_is_reclaimed(self, tmp_path):
+        queue = SharedJobQueue(tmp_path / 'queue.db', lease_seconds=0.05, max_attempts=2)
+        job_id = queue.submit({})
+        assert queue.claim('dead-worker')['jobId'] == job_id
+        time.sleep(0.1)
+        # Its lease ran out without a renewal: the next worker gets the job.
+        assert queue.claim('live-worker')['jobId'] == job_id
+        time.sleep(0.1)
+        assert queue.claim('third-worker') is None
+        job = queue.get(job_id)
+        assert job['status'] == 'error' and 'Worker lost' in job['error']
+
+    def test_late_update_from_a_worker_that_lost_its_lease_is_ignored(self, tmp_path):
+        queue = SharedJobQueue(tmp_path / 'queue.db', lease_seconds=0.05)
+        job_id = queue.submit({})
+        queue.claim('slow-worker')
+        time.sleep(0.1)
+        queue.claim('new-worker')
+        queue.update('slow-worker', job_id, status='error', error='late', finishedAt=time.time())
+        assert queue.get(job_id)['status'] == 'running'
+
+    def test_renew_keeps_lease(self, tmp_path):
+        queue = SharedJobQueue(tmp_path / 'queue.db', lease_seconds=0.2)
+        job_id = queue.submit({})
+        queue.claim('worker')
+        for _ in range(3):
+            time.sleep(0.1)
+            queue.renew('worker', [job_id])
+        assert queue.claim('other') is None
+
+    def test_batch_waits_for_its_plan(self, queue, tmp_path):
+        rendered = []
+
+        def prepare(datas):
+            return [{**d, 'prepared': True} for d in datas], {'sharedSongs': 1}
+
+        def render(data, job_id, progress):
+            rendered.append(data)
+            return _output(tmp_path)
+
+        batch_id, job_ids = queue.submit_batch([{'n': 1}, {'n': 2}])
+        assert [queue.get(j)['stage'] for j in job_ids] == ['planning', 'planning']
+        worker = QueueWorker(queue, render, prepare)
+        while worker.run_once():
+            pass
+
+        batch = queue.wait_batch(batch_id, timeout=1)
+        assert rendered == [{'n': 1, 'prepared': True}, {'n': 2, 'prepared': True}]
+        assert batch['plan'] == {'sharedSongs': 1}
+        assert [j['jobId'] for j in batch['jobs']] == job_ids
+        assert batch['report']['done'] == 2
+
+    def test_failed_plan_fails_the_batch(self, queue):
+        def prepare(datas):
+            raise RuntimeError('no network')
+
+        batch_id, _ = queue.submit_batch([{}, {}])
+        QueueWorker(queue, lambda *a: None, prepare).run_once()
+        batch = queue.get_batch(batch_id)
+        assert [j['status'] for j in batch['jobs']] == ['error', 'error']
+        assert 'no network' in batch['jobs'][0]['error']
+
+    def test_worker_threads_stop(self, queue, tmp_path):
+        job_id = queue.submit({})
+        worker = QueueWorker(queue, lambda data, job_id, progress: _output(tmp_path), threads=2,
+                             poll_interval=0.01)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        deadline = time.time() + 5
+        while queue.get(job_id)['status'] != 'done' and time.time() < deadline:
+            time.sleep(0.01)
+        worker.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert queue.get(job_id)['status'] == 'done'
@@ -0,0 +1,54 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+
+class TestSingleFlight:
+    def test_waiters_share_the_leaders_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('k', work)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('k', work))) for _ in range(3)]
+        for t in followers:
+            t.start()
+        while flight.shared < 3:
+            time.sleep(0.01)
+        release.set()
+        for t in [leader, *followers]:
+            t.join(5)
+        assert calls == [1]
+        assert results == ['done'] * 4
+
+    def test_entry_is_dropped_when_done(self):
+        flight = SingleFlight()
+        assert flight.do('k', lambda: 1) == 1
+        assert flight.do('k', lambda: 2) == 2
+        assert flight.inflight() == 0 and flight.executed == 2
+
+    def test_failure_propagates_and_is_not_cached(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise RuntimeError('download failed')
+
+        with pytest.raises(RuntimeError):
+            flight.do('k', fail)
+        assert flight.inflight() == 0
+        assert flight.do('k', lambda: 'retry') == 'retry'
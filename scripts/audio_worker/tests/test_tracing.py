@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+import metrics  # noqa: E402
+import tracing  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+
+class TestTracing:
+    def test_spans_are_summarized_per_stage_and_item(self):
+        def trim():
+            with tracing.span('trim', tool='ffmpeg'):
+                pass
+
+        with tracing.job_trace() as trace:
+            with tracing.span('probe', tool='yt-dlp'):
+                pass
+            tracing.for_item(3, trim)()
+            with tracing.span('concat', tool='ffmpeg'):
+                tracing.count('cacheHits', 2)
+        summary = trace.summary()
+        assert set(summary['stages']) == {'probe', 'trim', 'concat'}
+        assert [sorted(item) for item in summary['items']] == [['item', 'trim']]
+        assert summary['items'][0]['item'] == 3
+        assert summary['subprocesses'] == 3 and summary['cacheHits'] == 2
+
+    def test_scheduler_tasks_report_into_the_submitting_jobs_trace(self):
+        scheduler = Scheduler(net_workers=1, cpu_workers=1)
+
+        def download():
+            with tracing.span('download'):
+                return 'src'
+
+        def trim(source):
+            with tracing.span('trim', tool='ffmpeg'):
+                return source
+
+        with tracing.job_trace() as trace:
+            first = scheduler.submit('net', 'job', tracing.for_item(0, download))
+            scheduler.then(first, 'cpu', 'job', tracing.for_item(0, trim)).result(timeout=5)
+        summary = trace.summary()
+        assert summary['stages']['download']['count'] == 1
+        assert [sorted(item) for item in summary['items']] == [['download', 'item', 'trim']]
+        assert summary['subprocesses'] == 1
+
+    def test_hook_receives_spans_including_failures(self):
+        seen = []
+        tracing.set_hook(seen.append)
+        try:
+            with pytest.raises(RuntimeError):
+                with tracing.span('download', tool='yt-dlp'):
+                    raise RuntimeError('boom')
+        finally:
+            tracing.set_hook(None)
+        assert seen[0]['stage'] == 'download' and seen[0]['error'] == 'RuntimeError'
+
+    def test_spans_feed_the_stage_histogram(self):
+        before = metrics.STAGE_SECONDS.count(stage='unit-test')
+        with tracing.span('unit-test'):
+            pass
+        assert metrics.STAGE_SECONDS.count(stage='unit-test') == before + 1
@@ -0,0 +1,138 @@
+import os
+import subprocess
+import sys
+import wave
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+import ytdlp_engine  # noqa: E402
+
+yt_dlp = pytest.importorskip('yt_dlp')
+
+# Set by the `engine` fixture before the worker processes fork, so they inherit it.
+FIXTURE_AUDIO = None
+
+
+class StandInIE(yt_dlp.extractor.common.InfoExtractor):
+    """Local stand-in for the YouTube extractor: serves a fixture file, never hits the network."""
+    IE_NAME = 'standin'
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[\w-]{11})'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            'id': video_id,
+            'title': f'Stand-in {video_id}',
+            'duration': 123,
+            'formats': [{
+                'format_id': 'fixture',
+                'url': FIXTURE_AUDIO.as_uri(),
+                'ext': 'm4a',
+                'acodec': 'aac',
+                'vcodec': 'none',
+            }],
+        }
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    fixture = tmp_path / 'fixture.m4a'
+    fixture.write_bytes(b'not really audio')
+    monkeypatch.setattr(sys.modules[__name__], 'FIXTURE_AUDIO', fixture)
+    engine = ytdlp_engine.InProcessEngine(
+        timeout=60, workers=1, extractors=[StandInIE], options={'enable_file_urls': True})
+    yield engine
+    engine.shutdown()
+
+
+class TestInProcessEngine:
+    def test_probe_uses_stand_in_extractor(self, engine):
+        infos = engine.probe([
+            'https://www.youtube.com/watch?v=aaaaaaaaaaa',
+            'https://www.youtube.com/watch?v=bbbbbbbbbbb',
+        ])
+        assert infos['aaaaaaaaaaa'] == {
+            'duration': 123, 'ext': 'm4a', 'formatId': 'fixture', 'title': 'Stand-in aaaaaaaaaaa'}
+        assert set(infos) == {'aaaaaaaaaaa', 'bbbbbbbbbbb'}
+
+    def test_download_writes_file_and_reports_metadata(self, engine, tmp_path):
+        out = tmp_path / 'song.m4a'
+        infos = engine.download('https://www.youtube.com/watch?v=aaaaaaaaaaa', out)
+        assert out.read_bytes() == b'not really audio'
+        assert infos['aaaaaaaaaaa']['duration'] == 123
+
+    def test_worker_is_reused_across_calls(self, engine):
+        # Extractor setup happens once per worker process, not per call.
+        engine.probe(['https://www.youtube.com/watch?v=aaaaaaaaaaa'])
+        engine.probe(['https://www.youtube.com/watch?v=bbbbbbbbbbb'])
+        assert len(engine._pool._processes) == 1
+
+    def test_unknown_urls_are_skipped(self, engine):
+        assert engine.probe(['https://example.com/nothing']) == {}
+
+
+class TestSubprocessEngine:
+    def test_probe_parses_batched_output(self, monkeypatch):
+        def fake_run(cmd, **kwargs):
+            assert cmd.count('--print') == 1
+            out = 'aaaaaaaaaaa\t61\tm4a\t140\tOne\nERROR: gone\nbbbbbbbbbbb\t62.5\twebm\t251\tTwo\n'
+            return subprocess.CompletedProcess(cmd, 1, stdout=out, stderr='')
+
+        monkeypatch.setattr(ytdlp_engine.subprocess, 'run', fake_run)
+        infos = ytdlp_engine.SubprocessEngine(timeout=5).probe(['u1', 'u2', 'u3'])
+        assert infos['aaaaaaaaaaa']['duration'] == 61
+        assert infos['bbbbbbbbbbb'] == {'duration': 62, 'ext': 'webm', 'formatId': '251', 'title': 'Two'}
+
+    def test_download_section_args(self, monkeypatch, tmp_path):
+        seen = []
+
+        def fake_run(cmd, **kwargs):
+            seen.append(cmd)
+            return subprocess.CompletedProcess(cmd, 0, stdout='aaaaaaaaaaa\t600\tm4a\t140\tLong\n', stderr='')
+
+        monkeypatch.setattr(ytdlp_engine.subprocess, 'run', fake_run)
+        infos = ytdlp_engine.SubprocessEngine(timeout=5).download('url', tmp_path / 'x.m4a', section=(30, 90))
+        assert seen[0][seen[0].index('--download-sections') + 1] == '*30-90'
+        assert seen[0][-1] == 'url'
+        assert infos['aaaaaaaaaaa']['duration'] == 600
+
+    def test_search_parses_entries(self, monkeypatch):
+        def fake_run(cmd, **kwargs):
+            assert 'ytsearch3:' in cmd
+            return subprocess.CompletedProcess(cmd, 0, stdout='abc\tTitle\tArtist\thttp://t\n', stderr='')
+
+        monkeypatch.setattr(ytdlp_engine.subprocess, 'run', fake_run)
+        entries = ytdlp_engine.SubprocessEngine(timeout=5).search('query', limit=3)
+        assert entries == [{'id': 'abc', 'title': 'Title', 'uploader': 'Artist', 'thumbnail': 'http://t'}]
+
+
+class TestFakeYtdlp:
+    """The benchmark's offline yt-dlp must keep speaking the CLI protocol SubprocessEngine uses."""
+
+    @pytest.fixture
+    def engine(self, monkeypatch):
+        fake_dir = Path(__file__).resolve().parents[1] / 'benchmarks' / 'fake_ytdlp'
+        monkeypatch.setenv('PATH', f"{fake_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+        return ytdlp_engine.SubprocessEngine(timeout=30)
+
+    def test_probe_download_and_search(self, engine, tmp_path):
+        urls = ['https://youtu.be/bench000001', 'https://youtu.be/bench000002']
+        infos = engine.probe(urls)
+        assert sorted(infos) == ['bench000001', 'bench000002']
+        assert infos == engine.probe(urls)  # deterministic
+        downloaded = engine.download(urls[0], tmp_path / 'x.m4a', section=(10, 20))
+        assert downloaded['bench000001']['duration'] == infos['bench000001']['duration']
+        with wave.open(str(tmp_path / 'x.m4a')) as w:
+            assert w.getnframes() == 10 * w.getframerate()
+        assert len(engine.search('party', limit=3)) == 3
+
+
+class TestMakeEngine:
+    def test_subprocess_default(self):
+        assert ytdlp_engine.make_engine('subprocess', 5).name == 'subprocess'
+
+    def test_unknown_engine(self):
+        with pytest.raises(ValueError):
+            ytdlp_engine.make_engine('carrier-pigeon', 5)
@@ -0,0 +1,109 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+import metrics
+
+# The trace of the job whose work is running in this context (None outside a job), and the
+# timeline item a scheduler task is working on. The scheduler copies the context into its
+# worker threads, so both follow a job's work wherever it runs.
+_current_trace = contextvars.ContextVar("club100_trace", default=None)
+_current_item = contextvars.ContextVar("club100_item", default=None)
+
+# Optional callable receiving every finished span as a dict (stage, item, tool, seconds,
+# error) -- e.g. to forward spans to an external tracer. See set_hook().
+_hook = None
+
+
+class Trace:
+    """Per-job collection of spans and counters, summarized into the job record's timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: list = []
+        self.counts: dict = {}
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self) -> dict:
+        """{"stages": {stage: {"count", "seconds"}}, "items": [{"item", <stage>: seconds}], ...counts}."""
+        stages, items = {}, {}
+        with self._lock:
+            spans, counts = list(self.spans), dict(self.counts)
+        for span in spans:
+            stage = stages.setdefault(span["stage"], {"count": 0, "seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += span["seconds"]
+            if span["item"] is not None:
+                item = items.setdefault(span["item"], {"item": span["item"]})
+                item[span["stage"]] = round(item.get(span["stage"], 0.0) + span["seconds"], 4)
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 4)
+        return {"stages": stages, "items": [items[i] for i in sorted(items)], **counts}
+
+
+def set_hook(hook):
+    """Install (or with None, remove) the callable that receives every finished span."""
+    global _hook
+    _hook = hook
+
+
+@contextlib.contextmanager
+def job_trace():
+    """Collect every span recorded in this context (and scheduler tasks it submits) into a Trace."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def span(stage: str, tool: str = None):
+    """Time a block as `stage`. `tool` names the external process it runs (counted as a subprocess)."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+        record = {"stage": stage, "item": _current_item.get(), "tool": tool,
+                  "seconds": seconds, "error": error}
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(record)
+        if tool:
+            count("subprocesses")
+            metrics.SUBPROCESSES_TOTAL.inc(tool=tool)
+        if _hook is not None:
+            _hook(record)
+
+
+def count(name: str, amount: int = 1):
+    """Add to a named counter on the current job's trace (no-op outside a job)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, amount)
+
+
+def for_item(index, fn):
+    """Wrap fn so spans recorded while it runs are attributed to timeline item `index`."""
+    def run(*args):
+        token = _current_item.set(index)
+        try:
+            return fn(*args)
+        finally:
+            _current_item.reset(token)
+    return run
@@ -0,0 +1,207 @@
+import re
+import subprocess
+import sys
+import concurrent.futures
+from pathlib import Path
+
+# Fields printed for every probed or downloaded video (see parse_probe_line).
+PROBE_TEMPLATE = "%(id)s\t%(duration)s\t%(ext)s\t%(format_id)s\t%(title)s"
+SEARCH_TEMPLATE = "%(id)s\t%(title)s\t%(uploader)s\t%(thumbnail)s"
+
+# Options shared by every in-process YoutubeDL instance.
+_YDL_OPTIONS = {
+    "format": "bestaudio",
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+    "ignoreerrors": True,
+}
+
+
+def parse_probe_line(line: str):
+    """Parse one PROBE_TEMPLATE line into (video_id, info), or None if it is not one."""
+    parts = line.rstrip("\n").split("\t", 4)
+    if len(parts) < 2 or not re.fullmatch(r"[\w-]{11}", parts[0]):
+        return None
+    try:
+        duration = int(float(parts[1]))
+    except ValueError:
+        return None
+    info = {"duration": duration}
+    if len(parts) > 2 and parts[2] != "NA":
+        info["ext"] = parts[2]
+    if len(parts) > 3 and parts[3] != "NA":
+        info["formatId"] = parts[3]
+    if len(parts) > 4:
+        info["title"] = parts[4]
+    return parts[0], info
+
+
+def _info_from_ydl(info: dict):
+    """Convert a YoutubeDL info dict into the same (video_id, info) shape as parse_probe_line."""
+    if not info or info.get("duration") is None:
+        return None
+    out = {"duration": int(float(info["duration"]))}
+    for src, dst in (("ext", "ext"), ("format_id", "formatId"), ("title", "title")):
+        if info.get(src) is not None:
+            out[dst] = info[src]
+    return info.get("id"), out
+
+
+class SubprocessEngine:
+    """Drives the `yt-dlp` CLI, one process per call. Always available."""
+
+    name = "subprocess"
+
+    def __init__(self, timeout: int):
+        self.timeout = timeout
+
+    def probe(self, urls) -> dict:
+        """Resolve {video_id: info} for many URLs with a single yt-dlp process."""
+        cmd = ["yt-dlp", "--skip-download", "--ignore-errors", "-f", "bestaudio",
+               "--print", PROBE_TEMPLATE, *urls]
+        # --ignore-errors keeps one bad URL from failing the batch; yt-dlp then exits non-zero.
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+        infos = {}
+        for line in result.stdout.splitlines():
+            parsed = parse_probe_line(line)
+            if parsed:
+                infos[parsed[0]] = parsed[1]
+        return infos
+
+    def download(self, url, out_path: Path, section=None) -> dict:
+        """Download the best audio stream of url to out_path; returns {video_id: info}.
+
+        `section=(start, end)` in seconds fetches only that window instead of the whole track.
+        """
+        # --no-simulate downloads while still printing metadata.
+        cmd = ["yt-dlp", "-f", "bestaudio", "--no-simulate", "--print", PROBE_TEMPLATE,
+               "-o", str(out_path)]
+        if section is not None:
+            cmd += ["--download-sections", f"*{section[0]}-{section[1]}"]
+        cmd.append(url)
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=self.timeout)
+        parsed = [parse_probe_line(line) for line in result.stdout.splitlines()]
+        return dict(p for p in parsed if p)
+
+    def search(self, query: str, limit: int = 5, timeout: int = None) -> list:
+        """Search YouTube; returns dicts with id, title, uploader and thumbnail."""
+        result = subprocess.run(
+            ["yt-dlp", "--default-search", f"ytsearch{limit}:", "--print", SEARCH_TEMPLATE, query],
+            capture_output=True, text=True, check=True, timeout=timeout or self.timeout)
+        entries = []
+        for line in result.stdout.strip().split("\n"):
+            parts = line.split("\t")
+            if len(parts) >= 2:
+                entries.append({
+                    "id": parts[0],
+                    "title": parts[1],
+                    "uploader": parts[2] if len(parts) > 2 else "",
+                    "thumbnail": parts[3] if len(parts) > 3 else "",
+                })
+        return entries
+
+    def shutdown(self):
+        pass
+
+
+# --- In-process engine: one long-lived YoutubeDL per worker process ---
+_worker_ydl = None
+
+
+def _init_worker(extractors, options):
+    """Build this worker's YoutubeDL once, so extractors are imported and set up a single time."""
+    global _worker_ydl
+    import yt_dlp
+    params = {**_YDL_OPTIONS, **options}
+    if extractors:
+        # Explicit extractors replace the defaults (used by tests with a local stand-in).
+        _worker_ydl = yt_dlp.YoutubeDL(params, auto_init=False)
+        for ie in extractors:
+            _worker_ydl.add_info_extractor(ie())
+    else:
+        _worker_ydl = yt_dlp.YoutubeDL(params)
+
+
+def _probe_in_worker(urls):
+    infos = {}
+    for url in urls:
+        parsed = _info_from_ydl(_worker_ydl.extract_info(url, download=False))
+        if parsed and parsed[0]:
+            infos[parsed[0]] = parsed[1]
+    return infos
+
+
+def _download_in_worker(url, out_path, section):
+    from yt_dlp.utils import download_range_func
+    overrides = {"outtmpl": {"default": str(out_path)}}
+    if section is not None:
+        overrides["download_ranges"] = download_range_func(None, [tuple(section)])
+    previous = {key: _worker_ydl.params.get(key) for key in overrides}
+    _worker_ydl.params.update(overrides)
+    try:
+        info = _worker_ydl.extract_info(url, download=True)
+    finally:
+        _worker_ydl.params.update(previous)
+    if info is None:
+        raise RuntimeError(f"yt-dlp could not download {url!r}")
+    parsed = _info_from_ydl(info)
+    return {parsed[0]: parsed[1]} if parsed and parsed[0] else {}
+
+
+def _search_in_worker(query, limit):
+    result = _worker_ydl.extract_info(f"ytsearch{limit}:{query}", download=False, process=False)
+    entries = []
+    for entry in (result or {}).get("entries") or []:
+        if not entry or not entry.get("id"):
+            continue
+        thumbnails = entry.get("thumbnails") or [{}]
+        entries.append({
+            "id": entry["id"],
+            "title": entry.get("title") or "",
+            "uploader": entry.get("uploader") or entry.get("channel") or "",
+            "thumbnail": entry.get("thumbnail") or thumbnails[-1].get("url", ""),
+        })
+    return entries
+
+
+class InProcessEngine:
+    """Drives `yt_dlp.YoutubeDL` inside a pool of long-lived worker processes.
+
+    Each worker pays interpreter startup and extractor import once, instead of once per call.
+    `extractors`, if given, replaces yt-dlp's built-in extractors (e.g. a local stand-in), and
+    `options` are extra YoutubeDL params.
+    """
+
+    name = "inprocess"
+
+    def __init__(self, timeout: int, workers: int = 2, extractors=None, options=None):
+        import yt_dlp  # noqa: F401 -- fail fast if the package is missing
+        self.timeout = timeout
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max(1, workers), initializer=_init_worker,
+            initargs=(list(extractors or []), dict(options or {})))
+
+    def probe(self, urls) -> dict:
+        return self._pool.submit(_probe_in_worker, list(urls)).result(timeout=self.timeout)
+
+    def download(self, url, out_path: Path, section=None) -> dict:
+        return self._pool.submit(_download_in_worker, url, str(out_path), section).result(timeout=self.timeout)
+
+    def search(self, query: str, limit: int = 5, timeout: int = None) -> list:
+        return self._pool.submit(_search_in_worker, query, limit).result(timeout=timeout or self.timeout)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_engine(name: str, timeout: int, workers: int = 2):
+    """Build the configured engine, falling back to the CLI if yt_dlp cannot be imported."""
+    if name == "inprocess":
+        try:
+            return InProcessEngine(timeout, workers=workers)
+        except ImportError as e:
+            print(f"In-process yt-dlp engine unavailable ({e}); using the CLI", file=sys.stderr)
+    elif name != "subprocess":
+        raise ValueError(f"Unknown yt-dlp engine: {name!r}")
+    return SubprocessEngine(timeout)